@@ -1,23 +1,24 @@
 #!/usr/bin/env python
 import rospy
-import tf
 import time
 import threading
+import collections
+import heapq
 import math
-import operator
-import random
 import numpy as np
 import json
 import os
 import yaml
-import random
-import pprint
+import hashlib
+import pickle
+import tempfile
 from dynamic_reconfigure.server import Server
 import dynamic_reconfigure.client
 from r2_behavior.cfg import BehaviorConfig
 from blender_api_msgs.msg import Target, EmotionState, SetGesture
 from std_msgs.msg import String, Float64, UInt8
-from r2_perception.msg import Float32XYZ, CandidateFace, CandidateHand, CandidateSaliency, AudioDirection, MotionVector
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
+from r2_perception.msg import CandidateFace, CandidateHand, CandidateSaliency, AudioDirection, MotionVector
 from hr_msgs.msg import TTS
 from pau2motors.msg import pau
 
@@ -88,12 +89,32 @@ class State:
     # speaking/listening behavior as per rough video analysis early december 2017
 
 
+# the things that move the overall state machine, which state they move it to is up to the transitions in r2_behavior_states.yaml
+class Trigger:
+    HAND         = 0  # a hand is seen
+    SALIENCY     = 1  # something salient is seen
+    CHAT         = 2  # someone starts talking to the robot
+    SPEECH_START = 3  # the robot starts talking
+    SPEECH_STOP  = 4  # the robot stops talking
+    HAND_LOST    = 5  # the hand was not seen for a while
+    TALK_LOST    = 6  # nobody talked for a while
+    ACTIVITY     = 7  # enough is going on around the robot
+
+
+# package cfg directory, with the defaults and schemas
+CFG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'cfg')
+
+
+# use the C YAML loader when PyYAML was built with libyaml
+YAML_LOADER = getattr(yaml,"CSafeLoader",yaml.SafeLoader)
+
+
 class YamlConfig:
     @staticmethod
     def parse(config_dir, filename):
         with open(os.path.join(config_dir, filename), 'r') as stream:
             try:
-                return json.dumps(yaml.load(stream))
+                return json.dumps(yaml.load(stream, Loader=YAML_LOADER))
             except yaml.YAMLError as exc:
                 return False
 
@@ -101,7 +122,7 @@ class YamlConfig:
     def load(config_dir, filename):
         with open(os.path.join(config_dir, filename), 'r') as stream:
             try:
-                return yaml.load(stream)
+                return yaml.load(stream, Loader=YAML_LOADER)
             except yaml.YAMLError as exc:
                 return exc
 
@@ -114,6 +135,1513 @@ class YamlConfig:
             return False
 
 
+class SaliencyBuffer:
+
+    # fixed-capacity ring buffer of saliency vectors, ordered by arrival (which is time order for a single wideangle pipeline)
+    # indices are absolute (they only ever increase), so the live vectors are tail..head-1 and a slot is found at index % capacity
+    # when the buffer is full, the oldest vector is overwritten, expiring old vectors is a tail advance and the current vector is just an index
+
+    def __init__(self,capacity):
+        self.capacity = capacity
+        self.ts = np.zeros(capacity,dtype=np.float64)  # timestamps (sec.)
+        self.direction = np.zeros((capacity,3),dtype=np.float64)  # direction vectors
+        self.head = 0  # index of the next vector to be added
+        self.tail = 0  # index of the oldest live vector
+        self.current = -1  # index of the current vector, or -1 if there is none
+
+
+    def __len__(self):
+        return self.head - self.tail
+
+
+    def Add(self,ts,direction):
+        slot = self.head % self.capacity
+        self.ts[slot] = ts
+        self.direction[slot,0] = direction.x
+        self.direction[slot,1] = direction.y
+        self.direction[slot,2] = direction.z
+        self.head += 1
+        if self.head - self.tail > self.capacity:
+            # the oldest vector was just overwritten
+            self.tail = self.head - self.capacity
+            self.Validate()
+        return self.head - 1
+
+
+    def Expire(self,before):
+        # drop vectors older than before (sec.)
+        while self.tail < self.head and self.ts[self.tail % self.capacity] < before:
+            self.tail += 1
+        self.Validate()
+
+
+    def Validate(self):
+        # make sure the current vector is always valid, like selecting the first vector when the current one is removed
+        if self.current < self.tail:
+            if self.tail < self.head:
+                self.current = self.tail
+            else:
+                self.current = -1
+
+
+    def Next(self):
+        # switch to the next (or first) saliency vector
+        if self.tail == self.head:
+            self.current = -1
+        elif self.current < 0:
+            self.current = self.tail
+        else:
+            self.current += 1
+            if self.current >= self.head:
+                self.current = self.tail
+
+
+    def Direction(self):
+        # direction of the current vector
+        return self.direction[self.current % self.capacity]
+
+
+    def Oldest(self):
+        # timestamp of the oldest vector (sec.), or infinity if there are none
+        if self.tail == self.head:
+            return float("inf")
+        return self.ts[self.tail % self.capacity]
+
+
+class MotionTracker:
+
+    # constant velocity (alpha-beta) tracker for a fixed number of slots
+    # measurements are only written into measured and measured_ts (which can be the arrays of a table that already holds them); Predict then corrects all slots that got a new measurement and extrapolates all of them to the tick time in one go, so the robot looks at where things are now instead of where they were when the camera saw them
+
+    def __init__(self,capacity,measured=None,measured_ts=None):
+        self.alpha = 0.5  # position correction gain
+        self.beta = 0.1  # velocity correction gain
+        self.horizon = 0.5  # maximum extrapolation (sec.)
+        self.measured = measured if measured is not None else np.zeros((capacity,3),dtype=np.float64)  # latest measured position
+        self.measured_ts = measured_ts if measured_ts is not None else np.zeros(capacity,dtype=np.float64)  # time of the latest measurement (sec.)
+        self.fresh = np.zeros(capacity,dtype=bool)  # slot starts a new track with its next measurement
+        self.position = np.zeros((capacity,3),dtype=np.float64)  # filtered position at ts
+        self.velocity = np.zeros((capacity,3),dtype=np.float64)
+        self.ts = np.zeros(capacity,dtype=np.float64)  # time of the last measurement that was folded in (sec.)
+        self.predicted = np.zeros((capacity,3),dtype=np.float64)  # positions at the last Predict
+        self.dt = np.zeros((capacity,1),dtype=np.float64)
+        self.residual = np.zeros((capacity,3),dtype=np.float64)
+
+
+    def Predict(self,now):
+        # fold in the new measurements and extrapolate all slots to now (sec.)
+        dt = self.dt[:,0]
+        np.subtract(self.measured_ts,self.ts,out=dt)
+        # after a gap longer than the horizon (an occlusion, or no Predict for a while) the old velocity means nothing, so start the track over
+        np.logical_or(self.fresh,dt > self.horizon,out=self.fresh)
+        dt[self.fresh] = 0.0
+        updated = dt > 0.0
+        if updated.any():
+            # predict to the measurement, and correct with the residual; slots without a newer measurement stay where they are
+            dt[~updated] = 0.0
+            self.position += self.velocity * self.dt
+            np.subtract(self.measured,self.position,out=self.residual)
+            self.residual[~updated] = 0.0
+            self.position += self.alpha * self.residual
+            dt[~updated] = 1.0
+            self.velocity += self.beta * self.residual / self.dt
+            self.ts[updated] = self.measured_ts[updated]
+        if self.fresh.any():
+            self.position[self.fresh] = self.measured[self.fresh]
+            self.velocity[self.fresh] = 0.0
+            self.ts[self.fresh] = self.measured_ts[self.fresh]
+            self.fresh[:] = False
+
+        np.subtract(now,self.ts,out=dt)
+        np.clip(self.dt,0.0,self.horizon,out=self.dt)
+        np.multiply(self.velocity,self.dt,out=self.predicted)
+        self.predicted += self.position
+        return self.predicted
+
+
+class FaceTable:
+
+    # preallocated table of face tracks, holding only what the behavior uses from each CandidateFace
+    # cface_id maps to a slot, the numeric fields are NumPy arrays indexed by slot, and two doubly linked lists run through the slots:
+    # the ring (in order of arrival, for round-robin selection) and the lru list (in order of last update, for expiry)
+    # the links are plain preallocated lists, because they are only accessed one element at a time
+
+    def __init__(self,capacity):
+        self.capacity = capacity
+        self.ids = [0] * capacity  # cface_id per slot
+        self.slots = {}  # cface_id -> slot
+        self.used = np.zeros(capacity,dtype=bool)  # slot holds a face
+        self.position = np.zeros((capacity,3),dtype=np.float64)  # face center
+        self.brows = np.zeros((capacity,2),dtype=np.float64)  # left, right brow
+        self.eyelids = np.zeros((capacity,2),dtype=np.float64)  # left, right eyelid
+        self.mouth_open = np.zeros(capacity,dtype=np.float64)
+        self.ts = np.zeros(capacity,dtype=np.float64)  # timestamp of last update (sec.)
+        self.tracker = MotionTracker(capacity,self.position,self.ts)  # tracked face centers
+        # linked lists, slot capacity is the sentinel of both
+        self.ring_next = list(range(1,capacity + 1)) + [0]
+        self.ring_prev = [capacity] + list(range(capacity))
+        self.lru_next = [capacity] * (capacity + 1)
+        self.lru_prev = [capacity] * (capacity + 1)
+        self.ring_next[capacity] = capacity
+        self.ring_prev[capacity] = capacity
+        self.free = list(range(capacity - 1,-1,-1))  # stack of free slots
+
+
+    def __len__(self):
+        return len(self.slots)
+
+
+    def __contains__(self,cface_id):
+        return cface_id in self.slots
+
+
+    def Slot(self,cface_id):
+        return self.slots[cface_id]
+
+
+    def First(self):
+        # cface_id of the first face in the ring, or 0 if there are no faces
+        first = self.ring_next[self.capacity]
+        if first == self.capacity:
+            return 0
+        return self.ids[first]
+
+
+    def Next(self,cface_id):
+        # cface_id of the face after cface_id in the ring (wrapping around), or the first face if cface_id is not in the table
+        if cface_id not in self.slots:
+            return self.First()
+        next = self.ring_next[self.slots[cface_id]]
+        if next == self.capacity:
+            next = self.ring_next[self.capacity]
+        return self.ids[next]
+
+
+    def Update(self,msg):
+        slot = self.slots.get(msg.cface_id)
+        if slot == None:
+            if len(self.free) == 0:
+                # table is full, drop the least recently updated face
+                self.Remove(self.lru_next[self.capacity])
+            slot = self.free.pop()
+            self.slots[msg.cface_id] = slot
+            self.tracker.fresh[slot] = True
+            self.ids[slot] = msg.cface_id
+            self.used[slot] = True
+            # append to the ring
+            last = self.ring_prev[self.capacity]
+            self.ring_next[last] = slot
+            self.ring_prev[slot] = last
+            self.ring_next[slot] = self.capacity
+            self.ring_prev[self.capacity] = slot
+        else:
+            # unlink from the lru list
+            self.lru_next[self.lru_prev[slot]] = self.lru_next[slot]
+            self.lru_prev[self.lru_next[slot]] = self.lru_prev[slot]
+        # append to the lru list
+        last = self.lru_prev[self.capacity]
+        self.lru_next[last] = slot
+        self.lru_prev[slot] = last
+        self.lru_next[slot] = self.capacity
+        self.lru_prev[self.capacity] = slot
+        # copy the fields
+        self.position[slot,0] = msg.position.x
+        self.position[slot,1] = msg.position.y
+        self.position[slot,2] = msg.position.z
+        self.brows[slot,0] = msg.left_brow
+        self.brows[slot,1] = msg.right_brow
+        self.eyelids[slot,0] = msg.left_eyelid
+        self.eyelids[slot,1] = msg.right_eyelid
+        self.mouth_open[slot] = msg.mouth_open
+        self.ts[slot] = msg.ts.to_sec()
+        return slot
+
+
+    def Remove(self,slot):
+        del self.slots[self.ids[slot]]
+        self.ids[slot] = 0
+        self.used[slot] = False
+        self.ring_next[self.ring_prev[slot]] = self.ring_next[slot]
+        self.ring_prev[self.ring_next[slot]] = self.ring_prev[slot]
+        self.lru_next[self.lru_prev[slot]] = self.lru_next[slot]
+        self.lru_prev[self.lru_next[slot]] = self.lru_prev[slot]
+        self.free.append(slot)
+
+
+    def Oldest(self):
+        # timestamp of the least recently updated face (sec.), or infinity if there are none
+        oldest = self.lru_next[self.capacity]
+        if oldest == self.capacity:
+            return float("inf")
+        return self.ts[oldest]
+
+
+    def Expire(self,before):
+        # remove faces that were not updated since before (sec.), oldest first
+        oldest = self.lru_next[self.capacity]
+        while oldest != self.capacity and self.ts[oldest] < before:
+            self.Remove(oldest)
+            oldest = self.lru_next[self.capacity]
+
+
+class AwarenessGrid:
+
+    # low resolution grid of directions (azimuth x elevation) in front of the robot, counting what was seen or moved where, with exponential decay
+    # instead of decaying every cell all the time, new observations are added with a weight that grows with time (relative to ts0), so nothing needs to happen between observations
+
+    def __init__(self,azimuth_bins,elevation_bins,azimuth_range,elevation_range):
+        self.decay = 2.0  # time constant (sec.)
+        self.azimuth_min = -azimuth_range
+        self.azimuth_step = 2.0 * azimuth_range / azimuth_bins
+        self.elevation_min = -elevation_range
+        self.elevation_step = 2.0 * elevation_range / elevation_bins
+        self.grid = np.zeros(elevation_bins * azimuth_bins)  # activity per cell, scaled by exp((ts - ts0) / decay)
+        self.total = 0.0  # sum of the grid
+        self.ts0 = 0.0  # reference time of the scale (sec.)
+        self.values = np.zeros(len(self.grid))
+        # direction of each cell center, and a small preference for cells closer to straight ahead (so an empty grid is avoided by looking ahead)
+        azimuth = self.azimuth_min + self.azimuth_step * (np.arange(azimuth_bins) + 0.5)
+        elevation = self.elevation_min + self.elevation_step * (np.arange(elevation_bins) + 0.5)
+        azimuth,elevation = np.meshgrid(azimuth,elevation)
+        self.directions = np.stack([np.cos(azimuth) * np.cos(elevation),np.sin(azimuth) * np.cos(elevation),np.sin(elevation)],axis=-1).reshape(-1,3)
+        self.bias = 1e-6 * (np.abs(azimuth) + np.abs(elevation)).reshape(-1)
+        self.azimuth_bins = azimuth_bins
+        self.elevation_bins = elevation_bins
+
+
+    def Add(self,x,y,z,weight,ts):
+        # add weight at the direction of (x,y,z) at time ts (sec.)
+        if ts - self.ts0 > 50.0 * self.decay:
+            # keep the scale from overflowing
+            scale = math.exp((self.ts0 - ts) / self.decay)
+            self.grid *= scale
+            self.total *= scale
+            self.ts0 = ts
+        i = int((math.atan2(y,x) - self.azimuth_min) / self.azimuth_step)
+        j = int((math.atan2(z,math.sqrt(x * x + y * y)) - self.elevation_min) / self.elevation_step)
+        i = min(max(i,0),self.azimuth_bins - 1)
+        j = min(max(j,0),self.elevation_bins - 1)
+        weight *= math.exp((ts - self.ts0) / self.decay)
+        self.grid[j * self.azimuth_bins + i] += weight
+        self.total += weight
+
+
+    def SetDecay(self,decay,now):
+        # the grid is scaled with the old decay, so move the scale to now before changing it
+        if decay == self.decay:
+            return
+        scale = math.exp((self.ts0 - now) / self.decay)
+        self.grid *= scale
+        self.total *= scale
+        self.ts0 = now
+        self.decay = decay
+
+
+    def Activity(self,now):
+        # everything seen so far, decayed to now
+        return self.total * math.exp((self.ts0 - now) / self.decay)
+
+
+    def Emptiest(self,now):
+        # direction where the least is going on
+        np.multiply(self.grid,math.exp((self.ts0 - now) / self.decay),out=self.values)
+        self.values += self.bias
+        return self.directions[np.argmin(self.values)]
+
+
+class AudienceModel:
+
+    # a few audience regions, kept up to date with online k-means over the directions of faces and saliency as they arrive
+    # a new direction moves the nearest region towards it, or claims a forgotten region when it is too far from all of them
+    # region weights decay over time the same way as in AwarenessGrid, by scaling new weight relative to ts0
+
+    def __init__(self,capacity):
+        self.capacity = capacity
+        self.radius = 0.3  # angle within which a direction joins a region (rad.)
+        self.decay = 10.0  # time constant with which regions are forgotten (sec.)
+        self.minimum = 0.1  # weight below which a region no longer counts
+        self.direction = np.zeros((capacity,3),dtype=np.float64)  # region centers (unit vectors)
+        self.weight = np.zeros(capacity,dtype=np.float64)  # weight of each region, scaled by exp((ts - ts0) / decay)
+        self.ts0 = None  # reference time of the scale (sec.), the time of the first direction
+        self.current = -1  # region being looked at, or -1 if there is none
+        self.point = np.zeros(3)
+        self.similarity = np.zeros(capacity)
+        self.forgotten = np.zeros(capacity,dtype=bool)
+
+
+    def Add(self,x,y,z,weight,ts):
+        length = math.sqrt(x * x + y * y + z * z)
+        if length == 0.0:
+            return
+        if self.ts0 == None:
+            self.ts0 = ts
+        elif ts - self.ts0 > 50.0 * self.decay:
+            # keep the scale from overflowing
+            self.weight *= math.exp((self.ts0 - ts) / self.decay)
+            self.ts0 = ts
+        scale = math.exp((ts - self.ts0) / self.decay)
+        weight *= scale
+        x /= length
+        y /= length
+        z /= length
+
+        # find the nearest region that is not forgotten
+        self.point[0] = x
+        self.point[1] = y
+        self.point[2] = z
+        self.direction.dot(self.point,out=self.similarity)
+        np.less(self.weight,self.minimum * scale,out=self.forgotten)
+        self.similarity[self.forgotten] = -2.0
+        slot = self.similarity.argmax()
+        if self.similarity[slot] < math.cos(self.radius):
+            # too far from every region, so start a new one in place of the weakest, unless they are all in use and the nearest one will have to do
+            weakest = self.weight.argmin()
+            if self.forgotten[weakest]:
+                slot = weakest
+                self.weight[slot] = 0.0
+                self.direction[slot] = self.point
+
+        # move the region towards the new direction by its share of the weight
+        total = self.weight[slot] + weight
+        share = weight / total
+        center = self.direction[slot]
+        cx = center[0] + share * (x - center[0])
+        cy = center[1] + share * (y - center[1])
+        cz = center[2] + share * (z - center[2])
+        length = math.sqrt(cx * cx + cy * cy + cz * cz)
+        center[0] = cx / length
+        center[1] = cy / length
+        center[2] = cz / length
+        self.weight[slot] = total
+
+
+    def SetDecay(self,decay,now):
+        # the weights are scaled with the old decay, so move the scale to now before changing it
+        if decay == self.decay:
+            return
+        if self.ts0 != None:
+            self.weight *= math.exp((self.ts0 - now) / self.decay)
+            self.ts0 = now
+        self.decay = decay
+
+
+    def Next(self,now):
+        # switch to the next (or first) region that is not forgotten
+        if self.ts0 != None:
+            # decay the weights to now rather than grow the minimum, which overflows long after ts0
+            scale = math.exp((self.ts0 - now) / self.decay)
+            for i in range(1,self.capacity + 1):
+                slot = (self.current + i) % self.capacity
+                if self.weight[slot] * scale >= self.minimum:
+                    self.current = slot
+                    return
+        self.current = -1
+
+
+    def Direction(self):
+        if self.current < 0:
+            return None
+        return self.direction[self.current]
+
+
+class SpeakerLocator:
+
+    # the last few AudioDirection samples in a fixed ring, matched against all faces at once to find who is speaking
+    # a face scores for every recent sample that comes from its direction, so a single stray sample does not switch faces
+
+    def __init__(self,size,capacity):
+        self.window = 1.0  # age of the samples that are used (sec.)
+        self.angle = 0.35  # angular spread of a speaker (rad.)
+        self.azimuth = np.zeros(size)  # audio direction (rad., around z)
+        self.ts = np.full(size,-np.inf)  # timestamps (sec.)
+        self.weight = np.zeros(size)  # confidence of each sample
+        self.head = 0  # index of the next sample
+        self.direction = np.zeros(3)  # latest audio direction as unit vector
+        self.face_azimuth = np.zeros((capacity,1))  # direction of each face slot
+        self.distance = np.zeros((capacity,size))  # angular distance between each face and each sample
+        self.score = np.zeros(capacity)
+
+
+    def Add(self,ts,azimuth,confidence):
+        slot = self.head % len(self.ts)
+        self.ts[slot] = ts
+        self.azimuth[slot] = azimuth
+        self.weight[slot] = confidence if confidence > 0.0 else 1.0
+        self.head += 1
+        self.direction[0] = math.cos(azimuth)
+        self.direction[1] = math.sin(azimuth)
+
+
+    def Active(self,now):
+        # there was sound recently
+        return self.head > 0 and self.ts[(self.head - 1) % len(self.ts)] >= now - self.window
+
+
+    def Locate(self,faces,now):
+        # cface_id of the face where the recent samples come from, or 0 if no face matches
+        weight = self.weight * (self.ts >= now - self.window)
+        total = np.sum(weight)
+        if total <= 0.0 or len(faces) == 0:
+            return 0
+        np.arctan2(faces.position[:,1:2],faces.position[:,0:1],out=self.face_azimuth)
+        # wrapped angle between every face and every sample
+        np.subtract(self.face_azimuth,self.azimuth,out=self.distance)
+        self.distance += math.pi
+        np.mod(self.distance,2.0 * math.pi,out=self.distance)
+        self.distance -= math.pi
+        self.distance /= self.angle
+        np.square(self.distance,out=self.distance)
+        np.negative(self.distance,out=self.distance)
+        np.exp(self.distance,out=self.distance)
+        np.dot(self.distance,weight,out=self.score)
+        self.score[~faces.used] = 0.0
+        best = np.argmax(self.score)
+        # on average, the samples should be within angle of the face
+        if self.score[best] < math.exp(-1.0) * total:
+            return 0
+        return faces.ids[best]
+
+
+class PipelineWorker(threading.Thread):
+
+    # connects to and reconfigures one vision pipeline in the background
+    # only the latest requested configuration is kept, and it is only sent when it differs from what was last applied
+    # requests made before the pipeline is connected are delivered as soon as it is
+
+    def __init__(self,name,connect,lazy,connected_callback):
+        threading.Thread.__init__(self,name="pipeline_" + name)
+        self.daemon = True
+        self.connect = connect  # creates the dynamic_reconfigure client
+        self.lazy = lazy  # only connect when the first request comes in
+        self.connected_callback = connected_callback
+        self.client = None
+        self.connected = threading.Event()
+        self.condition = threading.Condition()
+        self.desired = None  # latest requested configuration
+        self.applied = None  # configuration the pipeline was last successfully updated with
+        self.running = True
+        self.start()
+
+
+    def Pending(self):
+        if self.client == None:
+            return not self.lazy or self.desired != None
+        return self.desired != None and self.desired != self.applied
+
+
+    def Request(self,config):
+        with self.condition:
+            self.desired = config
+            if self.Pending():
+                self.condition.notify()
+
+
+    def Shutdown(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+
+    def run(self):
+        retry = None
+        while True:
+            with self.condition:
+                while self.running and not self.Pending():
+                    self.condition.wait()
+                if self.running and retry != None:
+                    # the previous attempt failed, wait a little (or for a newer request) before trying again
+                    self.condition.wait(retry)
+                if not self.running:
+                    return
+                config = self.desired
+            try:
+                if self.client == None:
+                    start = time.time()
+                    self.client = self.connect()
+                    self.connected.set()
+                    self.connected_callback(self.name,time.time() - start)
+                else:
+                    self.client.update_configuration(config)
+                    with self.condition:
+                        self.applied = config
+                retry = None
+            except Exception as e:
+                rospy.logwarn("{}: {}".format(self.name,e))
+                retry = 1.0
+
+
+class StateDisplay(threading.Thread):
+
+    # shows the current states in the dynamic_reconfigure server (and so in rqt) from the background, instead of a full reconfigure from the timer thread at every transition
+    # changes are collected, and sent at most max_rate times per second, with only the fields that differ from what the server has
+    # every config the server takes (also from rqt) is passed to Shown, so the display knows what the server has, and doesn't undo changes made there
+    # Shown also tells which fields were changed from outside, so the echo of an update the display sent is never applied as a new state, even when the robot moved on since
+
+    FIELDS = ["eyecontact_state","lookat_state","mirroring_state","gaze_state","state"]
+
+    def __init__(self,update,max_rate):
+        threading.Thread.__init__(self,name="state_display")
+        self.daemon = True
+        self.update = update  # sends a dict of changed fields to the server
+        self.max_rate = max_rate
+        self.condition = threading.Condition()
+        self.desired = {}  # field -> value to show
+        self.shown = {}  # field -> value the server has
+        self.sending = {}  # fields of the update being sent
+        self.running = True
+        self.sent = 0  # number of updates sent
+        self.start()
+
+
+    def Pending(self):
+        for field in self.desired:
+            if self.shown.get(field) != self.desired[field]:
+                return True
+        return False
+
+
+    def Show(self,fields):
+        with self.condition:
+            self.desired.update(fields)
+            if self.Pending():
+                self.condition.notify()
+
+
+    def Shown(self,config):
+        # a change made in the server is what the states will be set to, so it is desired from now on as well; returns the fields that were changed that way
+        changed = []
+        with self.condition:
+            for field in self.FIELDS:
+                value = getattr(config,field)
+                if self.shown.get(field) != value and self.sending.get(field) != value:
+                    self.shown[field] = value
+                    self.desired[field] = value
+                    changed.append(field)
+        return changed
+
+
+    def Shutdown(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.Pending():
+                    self.condition.wait()
+                if not self.running:
+                    return
+                changes = {}
+                for field in self.desired:
+                    if self.shown.get(field) != self.desired[field]:
+                        changes[field] = self.desired[field]
+                self.shown.update(changes)
+                self.sending = changes
+            try:
+                self.update(changes)
+                self.sent += 1
+            except Exception as e:
+                rospy.logwarn("state display: {}".format(e))
+            with self.condition:
+                self.sending = {}
+            time.sleep(1.0 / self.max_rate)
+
+
+class PipelineGovernor:
+
+    # connects to and sets vision pipeline rates without blocking the caller
+    # each pipeline has its own worker, so the pipelines are connected and reconfigured in parallel, and requests are coalesced per pipeline
+
+    def __init__(self,lazy=False):
+        self.lazy = lazy
+        self.workers = {}
+        self.start_time = time.time()
+        self.ready_callback = None  # called with the time it took to connect all pipelines (sec.)
+
+
+    def Add(self,name,connect):
+        self.workers[name] = PipelineWorker(name,connect,self.lazy,self.HandleConnected)
+
+
+    def HandleConnected(self,name,duration):
+        rospy.loginfo("{} connected in {:.3f} sec.".format(name,duration))
+        if self.ready_callback != None and all(worker.connected.is_set() for worker in self.workers.values()):
+            self.ready_callback(time.time() - self.start_time)
+
+
+    def WaitConnected(self,timeout):
+        # like the clients did when they were created one by one, give up after timeout sec. instead of waiting for a pipeline that never comes up
+        deadline = time.time() + timeout
+        for worker in self.workers.values():
+            worker.connected.wait(max(0.0,deadline - time.time()))
+        missing = sorted(name for name,worker in self.workers.items() if not worker.connected.is_set())
+        if len(missing) > 0:
+            rospy.logerr("vision pipelines not connected after {:.0f} sec.: {}".format(timeout,", ".join(missing)))
+            raise rospy.ROSException("timeout exceeded while waiting for vision pipelines: {}".format(", ".join(missing)))
+
+
+    def Request(self,name,pipeline_rate,detect_rate):
+        self.workers[name].Request({"pipeline_rate":pipeline_rate,"detect_rate":detect_rate})
+
+
+    def Shutdown(self):
+        for worker in self.workers.values():
+            worker.Shutdown()
+
+
+class AnimationCache:
+
+    # parsed and validated animation files, kept in memory by path and mtime, and on disk as binary snapshots by path and content hash
+    # a file that did not change is never parsed again, not even after a restart
+
+    SNAPSHOT_VERSION = 2
+
+    def __init__(self,snapshot_dir,validate,compile):
+        self.snapshot_dir = snapshot_dir
+        self.validate = validate  # checks the parsed data, raises ValueError if it is not valid
+        self.compile = compile  # turns the data into what the timer uses
+        self.entries = {}  # path -> (mtime, size, data, compiled)
+        self.lock = threading.Lock()  # robots in the same process share the cache, and so the compiled tables of files they have in common
+
+
+    def SnapshotPath(self,path):
+        return os.path.join(self.snapshot_dir,hashlib.sha1(path.encode("utf-8")).hexdigest() + ".pickle")
+
+
+    def Load(self,path):
+        # parsed contents of path, raises IOError if the file does not exist
+        return self.Entry(path)[2]
+
+
+    def Compiled(self,path):
+        # compiled contents of path
+        return self.Entry(path)[3]
+
+
+    def Entry(self,path):
+        with self.lock:
+            stat = os.stat(path)
+            entry = self.entries.get(path)
+            if entry != None and entry[0] == stat.st_mtime and entry[1] == stat.st_size:
+                return entry
+            entry = (stat.st_mtime,stat.st_size,self.Parse(path,stat),None)
+            entry = (entry[0],entry[1],entry[2],self.compile(entry[2]))
+            self.entries[path] = entry
+            return entry
+
+
+    def Parse(self,path,stat):
+
+        with open(path,'rb') as stream:
+            contents = stream.read()
+        digest = hashlib.sha1(contents).hexdigest()
+
+        # try the snapshot first
+        data = None
+        snapshot_path = self.SnapshotPath(path)
+        try:
+            with open(snapshot_path,'rb') as stream:
+                snapshot = pickle.load(stream)
+            if snapshot["version"] == AnimationCache.SNAPSHOT_VERSION and snapshot["path"] == path and snapshot["hash"] == digest:
+                data = snapshot["data"]
+        except Exception:
+            pass
+
+        # otherwise parse the file and store a new snapshot
+        if data == None:
+            data = self.validate(yaml.load(contents,Loader=YAML_LOADER))
+            snapshot = {"version":AnimationCache.SNAPSHOT_VERSION,"path":path,"mtime":stat.st_mtime,"hash":digest,"data":data}
+            try:
+                if not os.path.isdir(self.snapshot_dir):
+                    os.makedirs(self.snapshot_dir)
+                fd,temp_path = tempfile.mkstemp(dir=self.snapshot_dir)
+                with os.fdopen(fd,'wb') as stream:
+                    pickle.dump(snapshot,stream,pickle.HIGHEST_PROTOCOL)
+                os.rename(temp_path,snapshot_path)
+            except (IOError,OSError) as e:
+                rospy.logwarn("cannot write animation snapshot: {}".format(e))
+
+        return data
+
+
+class AnimationWatcher(threading.Thread):
+
+    # loads the first existing animation file in the background whenever it changes, and hands the compiled result to loaded_callback
+    # the timer never waits for a file to be read or parsed
+
+    def __init__(self,paths,cache,loaded_callback,interval):
+        threading.Thread.__init__(self,name="animation_watcher")
+        self.daemon = True
+        self.paths = paths  # candidate files, in order of preference
+        self.cache = cache
+        self.loaded_callback = loaded_callback
+        self.interval = interval  # time between checks (sec.)
+        self.loaded = None  # (path, mtime) of the loaded file
+        self.wake = threading.Event()
+        self.running = True
+
+
+    def Check(self):
+        # load the file if it is new or changed
+        for path in self.paths:
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            if self.loaded != (path,mtime):
+                # a file that fails to load is only tried again after it changed
+                self.loaded = (path,mtime)
+                self.loaded_callback(self.cache.Compiled(path))
+            return
+        raise IOError("none of {} exist".format(self.paths))
+
+
+    def Reload(self):
+        # check right away
+        self.wake.set()
+
+
+    def Shutdown(self):
+        self.running = False
+        self.wake.set()
+
+
+    def run(self):
+        while self.running:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            if not self.running:
+                return
+            try:
+                self.Check()
+            except Exception as e:
+                rospy.logwarn("animations: {}".format(e))
+
+
+class TargetPublisher:
+
+    # publishes gaze or head targets, but only when the target moved more than deadband (m) or the speed changed, and not more often than max_rate (Hz., 0 = no limit) either way
+    # a suppressed target is not queued, the next update (usually the next tick) sends it once the rate allows
+
+    def __init__(self,topic,deadband,max_rate):
+        self.publisher = rospy.Publisher(topic,Target,queue_size=1)
+        self.deadband = deadband
+        self.max_rate = max_rate
+        self.msg = Target()
+        self.last_pos = np.zeros(3)  # last sent target
+        self.last_speed = None  # last sent speed, or None if nothing was sent yet
+        self.last_ts = 0.0  # time of the last send (sec.)
+        self.sent = 0
+        self.suppressed = 0
+
+
+    def Publish(self,pos,speed,now):
+        if self.last_speed != None:
+            if self.last_speed == speed:
+                dx = pos[0] - self.last_pos[0]
+                dy = pos[1] - self.last_pos[1]
+                dz = pos[2] - self.last_pos[2]
+                if dx * dx + dy * dy + dz * dz <= self.deadband * self.deadband:
+                    self.suppressed += 1
+                    return
+            # a new speed is held back by the rate cap like a move, the next update sends it
+            if self.max_rate > 0.0 and now - self.last_ts < 1.0 / self.max_rate:
+                self.suppressed += 1
+                return
+        self.last_pos[:] = pos
+        self.last_speed = speed
+        self.last_ts = now
+        self.msg.x = float(pos[0])
+        self.msg.y = float(pos[1])
+        self.msg.z = float(pos[2])
+        self.msg.speed = speed
+        self.publisher.publish(self.msg)
+        self.sent += 1
+
+
+class MirroringEngine:
+
+    # turns the brow, eyelid and mouth values of a face into PAU shapekey coefficients
+    # for each mirroring mode, the shapekey names and a linear map from the features (left brow, right brow, left eyelid, right eyelid, mouth open) to the coefficients are set up once, and the message is reused
+
+    # shapekey, weight of each feature, offset
+    EYEBROWS = [
+        ("brow_outer_UP.L",[1.0,0.0,0.0,0.0,0.0],0.0),
+        ("brow_inner_UP.L",[0.8,0.0,0.0,0.0,0.0],0.0),
+        ("brow_outer_DN.L",[-1.0,0.0,0.0,0.0,0.0],1.0),
+        ("brow_outer_up.R",[0.0,1.0,0.0,0.0,0.0],0.0),
+        ("brow_inner_UP.R",[0.0,0.8,0.0,0.0,0.0],0.0),
+        ("brow_outer_DN.R",[0.0,-1.0,0.0,0.0,0.0],1.0)
+    ]
+    EYELIDS = [
+        ("eye-blink.UP.R",[0.0,0.0,-0.5,-0.5,0.0],1.0),
+        ("eye-blink.UP.L",[0.0,0.0,-0.5,-0.5,0.0],1.0),
+        ("eye-blink.LO.R",[0.0,0.0,-0.5,-0.5,0.0],1.0),
+        ("eye-blink.LO.L",[0.0,0.0,-0.5,-0.5,0.0],1.0)
+    ]
+    MOUTH = [
+        ("lip-JAW.DN",[0.0,0.0,0.0,0.0,1.0],0.0)
+    ]
+    MODES = {
+        Mirroring.EYEBROWS:EYEBROWS,
+        Mirroring.EYELIDS:EYELIDS,
+        Mirroring.EYES:EYEBROWS + EYELIDS,
+        Mirroring.MOUTH:MOUTH,
+        Mirroring.MOUTH_EYEBROWS:EYEBROWS + MOUTH,
+        Mirroring.MOUTH_EYELIDS:EYELIDS + MOUTH,
+        Mirroring.ALL:EYEBROWS + EYELIDS + MOUTH
+    }
+
+    def __init__(self):
+        self.features = np.zeros(5)  # left brow, right brow, left eyelid, right eyelid, mouth open
+        self.layouts = {}  # mode -> (weights, offsets, coefficients, message)
+        for mode in MirroringEngine.MODES:
+            channels = MirroringEngine.MODES[mode]
+            weights = np.array([channel[1] for channel in channels])
+            offsets = np.array([channel[2] for channel in channels])
+            coeffs = np.zeros(len(channels))
+            msg = pau()
+            msg.m_shapekeys = [channel[0] for channel in channels]
+            msg.m_coeffs = coeffs
+            self.layouts[mode] = (weights,offsets,coeffs,msg)
+
+
+    def SetFace(self,faces,slot):
+        # take the features of a face from the faces table
+        self.features[0:2] = faces.brows[slot]
+        self.features[2:4] = faces.eyelids[slot]
+        self.features[4] = faces.mouth_open[slot]
+
+
+    def Message(self,mode,features):
+        # PAU message with the coefficients for mode, calculated from features
+        weights,offsets,coeffs,msg = self.layouts[mode]
+        np.dot(weights,features,out=coeffs)
+        coeffs += offsets
+        return msg
+
+
+class MirroringFilter:
+
+    # smooths the mirroring features towards the latest face values, one step per mirroring output
+    # the face values only change at the perception rate, so the filter state moves towards them at the (higher) output rate
+
+    NONE     = 0  # no smoothing
+    EMA      = 1  # exponential moving average with a cutoff frequency
+    ONE_EURO = 2  # one-euro filter: less smoothing when the features move fast
+    SPRING   = 3  # critically damped spring
+
+    def __init__(self,size):
+        self.kind = MirroringFilter.EMA
+        self.cutoff = 4.0  # cutoff (EMA), minimum cutoff (ONE_EURO) or natural frequency (SPRING) (Hz.)
+        self.beta = 0.5  # how much the cutoff increases with speed (ONE_EURO)
+        self.derivative_cutoff = 1.0  # cutoff for the speed estimate (ONE_EURO) (Hz.)
+        self.value = np.zeros(size)  # filtered features
+        self.velocity = np.zeros(size)  # speed estimate (ONE_EURO) or spring velocity (SPRING)
+        self.previous = np.zeros(size)  # previous input (ONE_EURO)
+        self.alpha = np.zeros(size)
+        self.valid = False
+
+
+    def Reset(self):
+        self.valid = False
+
+
+    def Step(self,target,dt):
+        # move towards target over dt (sec.), returns the filtered features
+        if not self.valid or self.kind == MirroringFilter.NONE:
+            self.value[:] = target
+            self.previous[:] = target
+            self.velocity[:] = 0.0
+            self.valid = True
+            return self.value
+
+        if self.kind == MirroringFilter.EMA:
+            self.value += (1.0 - math.exp(-2.0 * math.pi * self.cutoff * dt)) * (target - self.value)
+
+        elif self.kind == MirroringFilter.ONE_EURO:
+            # speed estimate, smoothed
+            self.velocity += (1.0 - math.exp(-2.0 * math.pi * self.derivative_cutoff * dt)) * ((target - self.previous) / dt - self.velocity)
+            self.previous[:] = target
+            # cutoff per feature
+            np.abs(self.velocity,out=self.alpha)
+            self.alpha *= self.beta
+            self.alpha += self.cutoff
+            self.alpha *= -2.0 * math.pi * dt
+            np.exp(self.alpha,out=self.alpha)
+            self.value += (1.0 - self.alpha) * (target - self.value)
+
+        elif self.kind == MirroringFilter.SPRING:
+            # exact step of a critically damped spring with natural frequency cutoff
+            omega = 2.0 * math.pi * self.cutoff
+            decay = math.exp(-omega * dt)
+            error = self.value - target
+            temp = (self.velocity + omega * error) * dt
+            self.velocity -= omega * temp
+            self.velocity *= decay
+            self.value[:] = target + (error + temp) * decay
+
+        return self.value
+
+
+class PerceptionInbox:
+
+    # the perception and event callbacks run on rospy's subscriber threads, but the face table, saliency buffer, hand and states are only touched by the timer thread
+    # callbacks write into the back of the inbox (deque.append is atomic, so they never block or wait for a tick), and at the start of every tick the timer takes everything that arrived so far as one consistent snapshot and applies it in order
+    # messages arriving while the snapshot is applied are left for the next tick
+
+    def __init__(self):
+        self.queue = collections.deque()
+        self.wake = None  # called after every post, to have the synthesizer tick early
+
+
+    def __len__(self):
+        return len(self.queue)
+
+
+    def Post(self,apply,msg):
+        self.queue.append((apply,msg,rospy.get_rostime()))
+        wake = self.wake
+        if wake != None:
+            wake()
+
+
+    def Drain(self,profiler=None):
+        # with a profiler, the time each message waited in the inbox is recorded per callback
+        if profiler != None:
+            now = rospy.get_rostime().to_sec()
+        for i in range(len(self.queue)):
+            apply,msg,received = self.queue.popleft()
+            if profiler != None:
+                profiler.Add("queue." + apply.__name__,now - received.to_sec())
+            apply(msg,received)
+
+
+class RingHistogram:
+
+    # the last size samples of one metric (sec.), summarized into percentiles and a histogram per decade when reported
+
+    EDGES = [0.0,1e-5,1e-4,1e-3,1e-2,1e-1,float("inf")]  # <10us, <100us, <1ms, <10ms, <100ms, more
+
+    def __init__(self,size):
+        self.samples = np.zeros(size)
+        self.count = 0  # total number of samples
+
+
+    def Add(self,value):
+        self.samples[self.count % len(self.samples)] = value
+        self.count += 1
+
+
+    def Summary(self):
+        # one sort gives both the percentiles and the histogram
+        samples = np.sort(self.samples[:min(self.count,len(self.samples))])
+        last = len(samples) - 1
+        histogram = np.diff(np.searchsorted(np.sort(np.abs(samples)),RingHistogram.EDGES))
+        return "p50 {:.3f} p90 {:.3f} p99 {:.3f} max {:.3f} ms, per decade from 10us {}".format(
+            samples[last // 2] * 1000.0,samples[last * 9 // 10] * 1000.0,samples[last * 99 // 100] * 1000.0,samples[last] * 1000.0,"/".join(str(n) for n in histogram))
+
+
+class TickProfiler:
+
+    # section timings, timer jitter and inbox delays of the synthesizer, kept in ring histograms, plus counters
+    # a tick only takes a few time stamps and array writes, the summaries are only made when reported
+
+    def __init__(self,size):
+        self.size = size  # samples per histogram
+        self.enabled = False
+        self.histograms = {}  # name -> RingHistogram
+        self.counts = collections.defaultdict(int)  # name -> count since the last report
+        self.mark = 0.0
+
+
+    def Add(self,name,value):
+        histogram = self.histograms.get(name)
+        if histogram == None:
+            histogram = RingHistogram(self.size)
+            self.histograms[name] = histogram
+        histogram.Add(value)
+
+
+    def Count(self,name):
+        self.counts[name] += 1
+
+
+    def Start(self):
+        self.mark = time.time()
+        return self.mark
+
+
+    def Mark(self,section):
+        # time since the previous mark goes to section
+        now = time.time()
+        self.Add(section,now - self.mark)
+        self.mark = now
+
+
+    def Report(self):
+        # summaries and counts as KeyValue list, the counts start again
+        values = [KeyValue(name,self.histograms[name].Summary()) for name in sorted(self.histograms)]
+        values += [KeyValue(name,str(self.counts[name])) for name in sorted(self.counts)]
+        self.counts.clear()
+        return values
+
+
+class RandomSource:
+
+    # uniform random numbers for the timer thread, drawn from numpy in batches instead of one python random call at a time
+    # with a seed, a run picks the same timings, gestures and expressions every time
+
+    def __init__(self,seed=None,batch=1024):
+        self.batch = batch
+        self.Seed(seed)
+
+
+    def Seed(self,seed):
+        if hasattr(np.random,"default_rng"):
+            self.generator = np.random.default_rng(seed)
+            self.draw = self.generator.random
+        else:
+            # numpy before 1.17
+            self.generator = np.random.RandomState(seed)
+            self.draw = self.generator.random_sample
+        self.values = []
+        self.index = 0
+
+
+    def Random(self):
+        # in [0,1)
+        if self.index >= len(self.values):
+            self.values = self.draw(self.batch).tolist()
+            self.index = 0
+        value = self.values[self.index]
+        self.index += 1
+        return value
+
+
+    def Uniform(self,low,high):
+        return low + (high - low) * self.Random()
+
+
+class Scheduler:
+
+    # deadline events in ROS time (sec.), kept in a heap, so the timer only does work when something is actually due
+    # an event is a function; scheduling an event that is already pending moves it, and the old heap entry is skipped when it comes up
+
+    def __init__(self):
+        self.heap = []  # (deadline, sequence number, event)
+        self.deadlines = {}  # event -> deadline
+        self.sequence = 0
+
+
+    def __len__(self):
+        return len(self.deadlines)
+
+
+    def Schedule(self,event,deadline):
+        self.deadlines[event] = deadline
+        self.sequence += 1
+        heapq.heappush(self.heap,(deadline,self.sequence,event))
+        if len(self.heap) > 4 * len(self.deadlines) + 32:
+            # too many moved events, drop their old entries
+            self.heap = [entry for entry in self.heap if self.deadlines.get(entry[2]) == entry[0]]
+            heapq.heapify(self.heap)
+
+
+    def Cancel(self,event):
+        self.deadlines.pop(event,None)
+
+
+    def Pending(self,event):
+        return event in self.deadlines
+
+
+    def Pop(self,now):
+        # next event that is due at now, or None
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            deadline,sequence,event = heapq.heappop(self.heap)
+            if self.deadlines.get(event) == deadline:
+                del self.deadlines[event]
+                return event
+        return None
+
+
+    def Next(self):
+        # deadline of the first pending event (sec.), or None
+        while len(self.heap) > 0 and self.deadlines.get(self.heap[0][2]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        if len(self.heap) > 0:
+            return self.heap[0][0]
+        return None
+
+
+class TickClock:
+
+    # when one robot's synthesizer ticks: at a rate that can change any time, or at the next scheduled event, whichever comes first, and Wake (new perception in the inbox) makes it tick right away, but never faster than max_rate
+    # the tick gets a rospy.TimerEvent, like from a rospy.Timer; everything except Wake runs on the tick loop thread, so it needs no locking
+
+    def __init__(self,callback,next_event,rate,max_rate):
+        self.callback = callback
+        self.next_event = next_event  # returns the deadline of the next scheduled event (sec.), or None
+        self.rate = rate  # regular tick rate (Hz.)
+        self.max_rate = max_rate  # maximum tick rate (Hz.)
+        self.woken = False  # something is waiting to be handled
+        self.loop = None  # TickLoop this clock is in
+        self.last = rospy.get_rostime().to_sec()  # time of the last tick (sec.)
+        self.last_expected = None
+        self.last_real = None
+        self.last_duration = None
+
+
+    def Wake(self):
+        self.woken = True
+        if self.loop != None:
+            self.loop.event.set()
+
+
+    def Deadline(self,now):
+        # time of the next tick (sec.)
+        if now < self.last:
+            # time jumped back (like a restarted /clock), start counting from now instead of waiting for the old last tick to come round again
+            self.last = now
+        deadline = self.last + 1.0 / min(self.rate,self.max_rate)
+        next_event = self.next_event()
+        if next_event != None and next_event < deadline:
+            deadline = next_event
+        if self.woken and now < deadline:
+            deadline = now
+        return max(deadline,self.last + 1.0 / self.max_rate)
+
+
+    def Tick(self,expected,real):
+        self.woken = False
+        if real - expected > 2.0 / min(self.rate,self.max_rate):
+            # more than two periods behind (time jumped forward, or ticks took too long), like rospy.Rate, don't catch up on the missed ticks but continue from now
+            expected = real
+        start = time.time()
+        current_expected = rospy.Time.from_sec(expected)
+        current_real = rospy.Time.from_sec(real)
+        try:
+            self.callback(rospy.TimerEvent(self.last_expected,self.last_real,current_expected,current_real,self.last_duration))
+        finally:
+            # also when the callback raises, so the next tick still waits for its turn
+            self.last = expected
+            self.last_expected = current_expected
+            self.last_real = current_real
+            self.last_duration = time.time() - start
+
+
+class TickLoop(threading.Thread):
+
+    # one thread that ticks the synthesizers of all robots in the process, each when its clock says so
+    # between ticks the thread sleeps until the earliest deadline, or until a clock is woken
+
+    def __init__(self):
+        threading.Thread.__init__(self,name="synthesizer")
+        self.daemon = True
+        self.clocks = []
+        self.deadlines = []  # deadline of each clock (sec.)
+        self.event = threading.Event()
+        self.running = True
+
+
+    def Add(self,clock):
+        clock.loop = self
+        self.clocks.append(clock)
+        self.deadlines.append(0.0)
+        self.event.set()
+
+
+    def Shutdown(self):
+        self.running = False
+        self.event.set()
+
+
+    def run(self):
+        while self.running:
+            now = rospy.get_rostime().to_sec()
+            for i in range(len(self.clocks)):
+                self.deadlines[i] = self.clocks[i].Deadline(now)
+            deadline = min(self.deadlines) if len(self.deadlines) > 0 else now + 1.0
+            if deadline > now:
+                self.event.wait(deadline - now)
+                self.event.clear()
+                continue
+            for i in range(len(self.clocks)):
+                if self.deadlines[i] <= now:
+                    try:
+                        self.clocks[i].Tick(self.deadlines[i],now)
+                    except Exception as e:
+                        rospy.logerr("synthesizer: {}".format(e))
+
+
+# animation states in r2_behavior_anim.yaml, each one has <state>_gestures and <state>_expressions
+ANIMATION_STATES = ["sleeping","idle","interested","focused","speaking","listening","presenting"]
+
+
+# keys that older animation files use, and the lists they stand for now
+LEGACY_ANIMATION_NAMES = {"presenting__gestures":"presenting_gestures"}
+
+
+# YAML strings are str or unicode in python 2
+try:
+    STRING_TYPES = (str,unicode)
+except NameError:
+    STRING_TYPES = (str,)
+
+
+def CheckSchema(value,schema,where):
+    # check value against a (JSON) schema from cfg/, only the parts that the schemas there use; every property is required
+    kind = schema.get("type")
+    if kind == "array":
+        if not isinstance(value,list):
+            raise ValueError("{}: expected a list".format(where))
+        for i,item in enumerate(value):
+            CheckSchema(item,schema.get("items",{}),"{}[{}]".format(where,i))
+    elif kind == "object":
+        if not isinstance(value,dict):
+            raise ValueError("{}: expected a mapping".format(where))
+        properties = schema.get("properties",{})
+        for key in properties:
+            if key not in value:
+                raise ValueError("{}: missing {}".format(where,key))
+            CheckSchema(value[key],properties[key],"{}.{}".format(where,key))
+        for key in value:
+            if key not in properties:
+                raise ValueError("{}: unknown {}".format(where,key))
+    elif kind == "number":
+        if isinstance(value,bool) or not isinstance(value,(int,float)):
+            raise ValueError("{}: expected a number".format(where))
+    elif kind == "string":
+        if not isinstance(value,STRING_TYPES):
+            raise ValueError("{}: expected a string".format(where))
+
+
+def ValidateAnimations(animations,gestures_schema,expressions_schema):
+    # reject the whole file if any state is missing or misspelled (other than the legacy names), or if any entry does not match its schema
+    if not isinstance(animations,dict):
+        raise ValueError("animations: expected a mapping")
+    for legacy,name in LEGACY_ANIMATION_NAMES.items():
+        if legacy in animations:
+            # robot files copied from the old default still have the misspelled key, take it for the real one
+            rospy.logwarn("animations: {} is deprecated, rename it to {}".format(legacy,name))
+            animations = dict(animations)
+            value = animations.pop(legacy)
+            if name not in animations:
+                animations[name] = value
+    for state in ANIMATION_STATES:
+        for name in [state + "_gestures",state + "_expressions"]:
+            if name not in animations:
+                raise ValueError("animations: missing {}".format(name))
+    for name in animations:
+        if name.endswith("_gestures") and name[:-len("_gestures")] in ANIMATION_STATES:
+            CheckSchema(animations[name],gestures_schema,name)
+        elif name.endswith("_expressions") and name[:-len("_expressions")] in ANIMATION_STATES:
+            CheckSchema(animations[name],expressions_schema,name)
+        else:
+            raise ValueError("animations: unknown {}".format(name))
+    return animations
+
+
+class Gesture(object):
+
+    # one validated gesture entry
+    __slots__ = ["name","probability","magnitude_min","magnitude_max","speed_min","speed_max"]
+
+    def __init__(self,entry):
+        self.name = entry["name"]
+        self.probability = float(entry["probability"])
+        self.magnitude_min = float(entry["magnitude_min"])
+        self.magnitude_max = float(entry["magnitude_max"])
+        self.speed_min = float(entry["speed_min"])
+        self.speed_max = float(entry["speed_max"])
+
+
+class Expression(object):
+
+    # one validated expression entry
+    __slots__ = ["name","probability","magnitude_min","magnitude_max","duration_min","duration_max"]
+
+    def __init__(self,entry):
+        self.name = entry["name"]
+        self.probability = float(entry["probability"])
+        self.magnitude_min = float(entry["magnitude_min"])
+        self.magnitude_max = float(entry["magnitude_max"])
+        self.duration_min = float(entry["duration_min"])
+        self.duration_max = float(entry["duration_max"])
+
+
+class AnimationSampler:
+
+    # one list of gestures or expressions, compiled into records
+    # the tick used to roll every entry against its probability and then pick one of the entries that fired; the chance of each outcome (including nothing firing) is calculated here once, so that picking is a single alias table lookup
+
+    def __init__(self,records):
+        self.records = records
+        probability = np.clip(np.array([record.probability for record in records],dtype=np.float64),0.0,1.0)
+        n = len(records)
+
+        # prefix[i] is the distribution of the number of entries that fire among the first i entries, suffix[i] among entries i and up
+        prefix = np.zeros((n + 1,n + 1))
+        prefix[0,0] = 1.0
+        for i in range(n):
+            prefix[i + 1] = prefix[i] * (1.0 - probability[i])
+            prefix[i + 1,1:] += prefix[i,:-1] * probability[i]
+        suffix = np.zeros((n + 1,n + 1))
+        suffix[n,0] = 1.0
+        for i in range(n - 1,-1,-1):
+            suffix[i] = suffix[i + 1] * (1.0 - probability[i])
+            suffix[i,1:] += suffix[i + 1,:-1] * probability[i]
+
+        # entry i is picked when it fires, with chance 1 / (1 + number of other entries that fired)
+        outcome = np.zeros(n + 1)  # outcome n is nothing fires
+        share = 1.0 / np.arange(1,n + 1)
+        for i in range(n):
+            others = np.convolve(prefix[i,:i + 1],suffix[i + 1,:n - i])
+            outcome[i] = probability[i] * np.dot(others,share)
+        outcome[n] = prefix[n,0]
+        outcome /= np.sum(outcome)
+
+        # Vose's alias table
+        self.outcomes = n + 1
+        self.threshold = np.ones(n + 1)
+        self.alias = np.arange(n + 1)
+        scaled = outcome * (n + 1)
+        small = [i for i in range(n + 1) if scaled[i] < 1.0]
+        large = [i for i in range(n + 1) if scaled[i] >= 1.0]
+        while len(small) > 0 and len(large) > 0:
+            s = small.pop()
+            l = large.pop()
+            self.threshold[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        self.threshold = self.threshold.tolist()
+        self.alias = self.alias.tolist()
+
+
+    def __len__(self):
+        return len(self.records)
+
+
+    def Select(self,rng):
+        # record of the entry to start, or None if nothing fires
+        u = rng.Random() * self.outcomes
+        i = int(u)
+        if u - i >= self.threshold[i]:
+            i = self.alias[i]
+        if i == len(self.records):
+            return None
+        return self.records[i]
+
+
+def CompileAnimations(animations,suffix,record):
+    # compile all lists in (validated) animations that end with suffix into samplers of records
+    samplers = {}
+    for name in animations:
+        if name.endswith(suffix):
+            samplers[name] = AnimationSampler([record(entry) for entry in animations[name]])
+    return samplers
+
+
+class StateEntry(object):
+
+    # what happens when the robot enters one overall state
+    __slots__ = ["name","gestures","expressions","pipelines","eyecontact","lookat","mirroring","gaze","enter"]
+
+
+# things a state can start when it is entered
+STATE_ENTER_ACTIONS = ["hand_decay","talk_decay","all_faces"]
+
+
+def EnumValue(cls,name,where):
+    # value of an uppercase name in one of the state classes
+    if not isinstance(name,STRING_TYPES) or not isinstance(getattr(cls,name.upper(),None),int):
+        raise ValueError("{}: unknown {}".format(where,name))
+    return getattr(cls,name.upper())
+
+
+def CompileStates(data,pipelines):
+    # compile the states and transitions from r2_behavior_states.yaml into a list of StateEntry per State, and a flat list of new states, at trigger * number of states + state (-1 is no transition)
+    # pipelines are the names of the vision pipelines a state can set; gesture and expression lists must be ones every animation file has
+    if not isinstance(data,dict) or not isinstance(data.get("states"),dict) or not isinstance(data.get("transitions"),dict):
+        raise ValueError("states: expected states and transitions")
+    count = len([name for name in vars(State) if not name.startswith("_")])
+    entries = [None] * count
+    for name,spec in data["states"].items():
+        where = "states: " + str(name)
+        if not isinstance(spec,dict):
+            raise ValueError("{}: expected a mapping".format(where))
+        entry = StateEntry()
+        entry.name = name.upper()
+        entry.gestures = spec.get("gestures")
+        entry.expressions = spec.get("expressions")
+        if entry.gestures not in [state + "_gestures" for state in ANIMATION_STATES]:
+            raise ValueError("{}: unknown or missing gestures {}".format(where,entry.gestures))
+        if entry.expressions not in [state + "_expressions" for state in ANIMATION_STATES]:
+            raise ValueError("{}: unknown or missing expressions {}".format(where,entry.expressions))
+        entry.pipelines = []
+        for pipeline,rates in (spec.get("pipelines") or {}).items():
+            if pipeline not in pipelines:
+                raise ValueError("{}: unknown pipeline {}".format(where,pipeline))
+            if not isinstance(rates,list) or len(rates) != 2:
+                raise ValueError("{}: {} expects [pipeline rate, detection rate]".format(where,pipeline))
+            entry.pipelines.append((pipeline,float(rates[0]),float(rates[1])))
+        entry.eyecontact = EnumValue(EyeContact,spec["eyecontact"],where) if "eyecontact" in spec else None
+        entry.lookat = EnumValue(LookAt,spec["lookat"],where) if "lookat" in spec else None
+        entry.mirroring = EnumValue(Mirroring,spec["mirroring"],where) if "mirroring" in spec else None
+        entry.gaze = EnumValue(Gaze,spec["gaze"],where) if "gaze" in spec else None
+        entry.enter = spec.get("enter") or []
+        for action in entry.enter:
+            if action not in STATE_ENTER_ACTIONS:
+                raise ValueError("{}: unknown {}".format(where,action))
+        entries[EnumValue(State,name,"states")] = entry
+    if None in entries:
+        raise ValueError("states: missing {}".format(", ".join(name for name,value in vars(State).items() if not name.startswith("_") and entries[value] == None)))
+    transitions = [-1] * (count * len([name for name in vars(Trigger) if not name.startswith("_")]))
+    for trigger,moves in data["transitions"].items():
+        where = "transitions: " + str(trigger)
+        if not isinstance(moves,dict):
+            raise ValueError("{}: expected a mapping".format(where))
+        base = EnumValue(Trigger,trigger,"transitions") * count
+        for state,newstate in moves.items():
+            transitions[base + EnumValue(State,state,where)] = EnumValue(State,newstate,where)
+    return entries,transitions
+
+
+def CompileAnimationTables(animations):
+    # the animations and the samplers the timer picks gestures and expressions from, none of which change after this
+    return (animations,CompileAnimations(animations,"_gestures",Gesture),CompileAnimations(animations,"_expressions",Expression))
+
+
+def MakeAnimationCache(snapshot_dir):
+    # animation cache that validates against the schemas in the package
+    gestures_schema = YamlConfig.load(CFG_DIR,'gestures_schema.yaml')
+    expressions_schema = YamlConfig.load(CFG_DIR,'expressions_schema.yaml')
+    return AnimationCache(snapshot_dir,lambda animations: ValidateAnimations(animations,gestures_schema,expressions_schema),CompileAnimationTables)
+
+
+# minimum time between two prunes (sec.)
+PRUNE_INTERVAL_MIN = 0.01
+
+# minimum change of any mirroring feature before a new PAU message is sent
+MIRRORING_EPSILON = 0.001
+
+# how long a vision pipeline client waits for its pipeline, and how long a blocking start waits for all of them (sec.)
+PIPELINE_CONNECT_TIMEOUT = 30.0
+
+
+# eye and mouth positions relative to the center of a face: all are 5cm in front of the center, the left eye is 3cm to the left and 6cm above the center, the right eye is 3cm to the right and 6cm above the center, and the mouth is dead center and 4cm below the center
+LEFT_EYE_OFFSET = np.array([-0.05,0.03,0.06])
+RIGHT_EYE_OFFSET = np.array([-0.05,-0.03,0.06])
+MOUTH_OFFSET = np.array([-0.05,0.0,-0.04])
+
+
 class FakeConfigServer:
 
     def update_configuration(self,config,level=0):
@@ -122,70 +1650,122 @@ class FakeConfigServer:
 
 class Behavior:
 
-    def InitSaliencyCounter(self):
-        self.saliency_counter = random.randint(int(self.saliency_time_min * self.synthesizer_rate),int(self.saliency_time_max * self.synthesizer_rate))
+    def ScheduleIn(self,event,time_min,time_max):
+        self.scheduler.Schedule(event,self.now + self.rng.Uniform(time_min,time_max))
 
 
-    def InitFacesCounter(self):
-        self.faces_counter = random.randint(int(self.faces_time_min * self.synthesizer_rate),int(self.faces_time_max * self.synthesizer_rate))
+    def ScheduleSaliencySwitch(self):
+        self.ScheduleIn(self.HandleSaliencySwitch,self.saliency_time_min,self.saliency_time_max)
 
 
-    def InitEyesCounter(self):
-        self.eyes_counter = random.randint(int(self.eyes_time_min * self.synthesizer_rate),int(self.eyes_time_max * self.synthesizer_rate))
+    def ScheduleFaceSwitch(self):
+        self.ScheduleIn(self.HandleFaceSwitch,self.faces_time_min,self.faces_time_max)
 
 
-    def InitAudienceCounter(self):
-        self.audience_counter = random.randint(int(self.audience_time_min * self.synthesizer_rate),int(self.audience_time_max * self.synthesizer_rate))
+    def ScheduleEyeSwitch(self):
+        self.ScheduleIn(self.HandleEyeSwitch,self.eyes_time_min,self.eyes_time_max)
 
 
-    def InitGestureCounter(self):
-        self.gesture_counter = random.randint(int(self.gesture_time_min * self.synthesizer_rate),int(self.gesture_time_max * self.synthesizer_rate))
+    def ScheduleAudienceSwitch(self):
+        self.ScheduleIn(self.HandleAudienceSwitch,self.audience_time_min,self.audience_time_max)
 
 
-    def InitExpressionCounter(self):
-        self.expression_counter = random.randint(int(self.expression_time_min * self.synthesizer_rate),int(self.expression_time_max * self.synthesizer_rate))
+    def ScheduleGesture(self):
+        self.ScheduleIn(self.HandleGesture,self.gesture_time_min,self.gesture_time_max)
 
 
-    def InitAllFacesStartCounter(self):
-        self.all_faces_start_counter = random.randint(int(self.all_faces_start_time_min * self.synthesizer_rate),int(self.all_faces_start_time_max * self.synthesizer_rate))
+    def ScheduleExpression(self):
+        self.ScheduleIn(self.HandleExpression,self.expression_time_min,self.expression_time_max)
 
 
-    def InitAllFacesDurationCounter(self):
-        self.all_faces_duration_counter = random.randint(int(self.all_faces_duration_min * self.synthesizer_rate),int(self.all_faces_duration_max * self.synthesizer_rate))
+    def ScheduleAllFacesStart(self):
+        self.ScheduleIn(self.HandleAllFacesStart,self.all_faces_start_time_min,self.all_faces_start_time_max)
 
 
-    def __init__(self):
+    def ScheduleAllFacesEnd(self):
+        self.ScheduleIn(self.HandleAllFacesEnd,self.all_faces_duration_min,self.all_faces_duration_max)
 
-        # create lock
-        self.lock = threading.Lock()
 
-        self.robot_name = rospy.get_param("/robot_name")
+    def SchedulePrune(self,ts):
+        # make sure there is a prune when the observation at ts expires
+        if not self.scheduler.Pending(self.HandlePrune):
+            self.scheduler.Schedule(self.HandlePrune,max(ts + self.keep_time,self.now + PRUNE_INTERVAL_MIN))
+
+
+    def __init__(self,robot_name=None,tick_loop=None,animation_cache=None):
+
+        # with robot_name, this is one of several robots in the process: its topics and config server are in its own namespace, its parameters can be set per robot as ~<robot_name>/<param>, and tick_loop and animation_cache are shared
+
+        self.start_time = time.time()
+
+        # perception and events, applied by the timer
+        self.inbox = PerceptionInbox()
+
+        if robot_name == None:
+            self.robot_name = rospy.get_param("/robot_name")
+            self.namespace = ""
+        else:
+            self.robot_name = robot_name
+            self.namespace = "/" + robot_name
 
         self.config_dir = os.path.join(rospy.get_param("/robots_config_dir"), 'heads', self.robot_name)
         # setup face, hand and saliency structures
-        self.faces = {}  # index = cface_id, which should be relatively steady from vision_pipeline
+        self.faces = FaceTable(self.Param("face_capacity",64))  # index = cface_id, which should be relatively steady from vision_pipeline
         self.current_face_id = 0  # cface_id of current face
+        self.speaker_face_id = 0  # cface_id of the face the sound comes from, or 0 if it matches no face
         self.last_face_id = 0  # most recent cface_id of added face
-        self.last_talk_ts = 0  # ts of last seen face or talking
+        self.last_talk_ts = 0.0  # ts of last seen face or talking (sec.)
         self.hand = None  # current hand
-        self.last_hand_ts = 0  # ts of last seen hand
-        self.saliencies = {}  # index = ts, and old saliency vectors will be removed after time
-        self.current_saliency_ts = 0  # ts of current saliency vector
+        self.hand_tracker = MotionTracker(1)  # tracked hand position
+        self.awareness = AwarenessGrid(16,5,1.2,0.4)  # where things are happening
+        self.wake_threshold = 3.0  # awareness activity that wakes the robot, 0 = never
+        self.audience = AudienceModel(self.Param("audience_regions",6))  # where the audience is
+        self.speaker = SpeakerLocator(self.Param("audio_history",16),self.faces.capacity)  # recent audio directions
+        self.last_hand_ts = 0.0  # ts of last seen hand (sec.)
+        self.saliencies = SaliencyBuffer(self.Param("saliency_capacity",256))  # old saliency vectors will be removed after time, the current saliency vector is saliencies.current
         self.current_eye = 0  # current eye (0 = left, 1 = right, 2 = mouth)
 
-        self.gaze_delay_counter = 0  # delay counter after with gaze or head follows head or gaze
-        self.gaze_pos = None  # current gaze position
+        self.gaze_pos = np.zeros(3)  # current gaze position
+        self.gaze_pos_valid = False  # gaze_pos was set
+        self.left_eye_pos = np.zeros(3)  # left eye, right eye and mouth positions on the current face
+        self.right_eye_pos = np.zeros(3)
+        self.mouth_pos = np.zeros(3)
 
         # animations
         self.animations = None
+        self.gesture_samplers = {}  # gestures name -> AnimationSampler
+        self.expression_samplers = {}  # expressions name -> AnimationSampler
+        if animation_cache == None:
+            animation_cache = MakeAnimationCache(self.Param("animation_snapshot_dir",os.path.join(os.path.expanduser("~"),".ros","r2_behavior")))
+        self.animation_cache = animation_cache
+        self.animation_watcher = AnimationWatcher([os.path.join(self.config_dir,'r2_behavior_anim.yaml'),os.path.join(CFG_DIR,'r2_behavior_anim.default.yaml')],
+                                                  self.animation_cache,self.HandleAnimations,self.Param("animation_watch_interval",1.0))
         self.current_gestures_name = None
         self.current_expressions_name = None
 
-        self.tf_listener = tf.TransformListener(False, rospy.Duration(1))
+
+        # everything that happens after some time is a scheduler event, at random times from a (~seed for reproducible runs) random source
+        self.scheduler = Scheduler()
+        seed = self.Param("seed",None)
+        if seed != None and self.namespace != "" and rospy.get_param("~" + self.robot_name + "/seed",None) == None:
+            # hosted robots that share one seed each get their own stream, so they don't all gesture in lockstep
+            seed = (seed + int(hashlib.sha1(self.robot_name.encode("utf-8")).hexdigest()[:8],16)) % 4294967296
+        self.rng = RandomSource(seed)
+        self.now = rospy.get_rostime().to_sec()  # time of the current tick (sec.)
 
         # setup dynamic reconfigure parameters
         self.enable_flag = True
         self.synthesizer_rate = 10.0
+        self.state_rates = {  # tick rate per state (Hz.)
+            State.SLEEPING: 1.0,
+            State.IDLE: 2.0,
+            State.INTERESTED: 5.0,
+            State.FOCUSED: 10.0,
+            State.SPEAKING: 10.0,
+            State.LISTENING: 10.0,
+            State.PRESENTING: 5.0
+        }
+        self.perception_wakeup = True
         self.keep_time = 1.0
         self.saliency_time_min = 0.1
         self.saliency_time_max = 3.0
@@ -199,12 +1779,8 @@ class Behavior:
         self.gesture_time_max = 3.0
         self.expression_time_min = 0.1
         self.expression_time_max = 3.0
-        self.InitSaliencyCounter()
-        self.InitFacesCounter()
-        self.InitEyesCounter()
-        self.InitAudienceCounter()
-        self.InitGestureCounter()
-        self.InitExpressionCounter()
+        self.ScheduleGesture()
+        self.ScheduleExpression()
         self.hand_state_decay = 2.0
         self.face_state_decay = 2.0
         self.gaze_delay = 1.0
@@ -213,13 +1789,14 @@ class Behavior:
         self.all_faces_start_time_max = 6.0
         self.all_faces_duration_min = 2.0
         self.all_faces_duration_max = 4.0
-        self.InitAllFacesStartCounter()
-        self.InitAllFacesDurationCounter()
         self.eyecontact = EyeContact.IDLE
         self.lookat = LookAt.IDLE
+        self.all_faces_lookat = LookAt.AVOID  # lookat to go back to after looking at all faces
         self.mirroring = Mirroring.IDLE
         self.gaze = Gaze.GAZE_ONLY
         self.state = State.SLEEPING
+        self.next_state = State.SLEEPING  # state at the end of this tick
+        self.mirroring_rate = 30.0
 
         # take candidate streams exactly like RealSense Tracker until fusion is better defined and we can rely on combined camera stuff
         rospy.Subscriber('/{}/perception/realsense/cface'.format(self.robot_name), CandidateFace, self.HandleFace)
@@ -231,57 +1808,160 @@ class Behavior:
         rospy.Subscriber('/{}/chat_events'.format(self.robot_name), String, self.HandleChatEvents)
         rospy.Subscriber('/{}/speech_events'.format(self.robot_name), String, self.HandleSpeechEvents)
 
-        self.head_focus_pub = rospy.Publisher('/blender_api/set_face_target', Target, queue_size=1)
-        self.gaze_focus_pub = rospy.Publisher('/blender_api/set_gaze_target', Target, queue_size=1)
-        self.expressions_pub = rospy.Publisher('/blender_api/set_emotion_state', EmotionState, queue_size=1)
-        self.gestures_pub = rospy.Publisher('/blender_api/set_gesture', SetGesture, queue_size=1)
-        self.animationmode_pub = rospy.Publisher('/blender_api/set_animation_mode', UInt8, queue_size=1)
-        self.setpau_pub = rospy.Publisher('/blender_api/set_pau', pau, queue_size=1)
+        self.head_focus_pub = TargetPublisher(self.namespace + '/blender_api/set_face_target',0.005,20.0)
+        self.gaze_focus_pub = TargetPublisher(self.namespace + '/blender_api/set_gaze_target',0.005,20.0)
+        rospy.on_shutdown(self.HandleShutdown)
+        self.expressions_pub = rospy.Publisher(self.namespace + '/blender_api/set_emotion_state', EmotionState, queue_size=1)
+        self.gestures_pub = rospy.Publisher(self.namespace + '/blender_api/set_gesture', SetGesture, queue_size=1)
+        self.animationmode_pub = rospy.Publisher(self.namespace + '/blender_api/set_animation_mode', UInt8, queue_size=1)
+        self.setpau_pub = rospy.Publisher(self.namespace + '/blender_api/set_pau', pau, queue_size=1)
+        self.mirroring_engine = MirroringEngine()
+        self.mirroring_filter = MirroringFilter(5)
+        self.mirroring_lock = threading.Lock()  # between HandleTimer and HandleMirroringTimer
+        self.mirroring_active = False  # there is a face to mirror
+        self.mirroring_sent = np.full(5,np.inf)  # features of the last sent PAU message
+        self.mirroring_ts = None  # time of the last mirroring output (sec.)
+        self.mirroring_timer = None
+        self.mirroring_published = 0  # number of sent PAU messages
+
+        # instrumentation
+        self.profiler = TickProfiler(self.Param("profiling_samples",256))
+        self.profiling_period = 1.0
+        self.diagnostics_pub = rospy.Publisher('/diagnostics', DiagnosticArray, queue_size=1)
+        self.pau_mode = UInt8()  # animation mode that was last sent
         self.tts_pub = rospy.Publisher('/{}/tts'.format(self.robot_name), TTS, queue_size=1)  # for debug messages
 
-        self.hand_events_pub = rospy.Publisher('/hand_events', String, queue_size=1)
-
-        # dynamic reconfigure client to the vision pipelines
-        self.lefteye_config = dynamic_reconfigure.client.Client("/{}/perception/lefteye/vision_pipeline".format(self.robot_name),timeout=30,config_callback=self.HandleLeftEyeConfig)
-        self.righteye_config = dynamic_reconfigure.client.Client("/{}/perception/righteye/vision_pipeline".format(self.robot_name),timeout=30,config_callback=self.HandleRightEyeConfig)
-        self.wideangle_config = dynamic_reconfigure.client.Client("/{}/perception/wideangle/vision_pipeline".format(self.robot_name),timeout=30,config_callback=self.HandleWideAngleConfig)
-        self.realsense_config = dynamic_reconfigure.client.Client("/{}/perception/realsense/vision_pipeline".format(self.robot_name),timeout=30,config_callback=self.HandleRealSenseConfig)
+        self.hand_events_pub = rospy.Publisher(self.namespace + '/hand_events', String, queue_size=1)
+
+        # startup metrics: time until the node runs, and time until all vision pipelines are connected (sec.)
+        self.startup_time_pub = rospy.Publisher('/{}/behavior/startup_time'.format(self.robot_name), Float64, queue_size=1, latch=True)
+        self.pipelines_ready_time_pub = rospy.Publisher('/{}/behavior/pipelines_ready_time'.format(self.robot_name), Float64, queue_size=1, latch=True)
+
+        # dynamic reconfigure clients to the vision pipelines, connected in the background (~pipeline_connect = background), only when first needed (lazy) or before the node starts (blocking)
+        pipeline_connect = self.Param("pipeline_connect","background")
+        self.pipelines = PipelineGovernor(lazy=(pipeline_connect == "lazy"))
+        self.pipelines.ready_callback = self.HandlePipelinesReady
+        self.pipelines.Add("lefteye",lambda: dynamic_reconfigure.client.Client("/{}/perception/lefteye/vision_pipeline".format(self.robot_name),timeout=PIPELINE_CONNECT_TIMEOUT,config_callback=self.HandleLeftEyeConfig))
+        self.pipelines.Add("righteye",lambda: dynamic_reconfigure.client.Client("/{}/perception/righteye/vision_pipeline".format(self.robot_name),timeout=PIPELINE_CONNECT_TIMEOUT,config_callback=self.HandleRightEyeConfig))
+        self.pipelines.Add("wideangle",lambda: dynamic_reconfigure.client.Client("/{}/perception/wideangle/vision_pipeline".format(self.robot_name),timeout=PIPELINE_CONNECT_TIMEOUT,config_callback=self.HandleWideAngleConfig))
+        self.pipelines.Add("realsense",lambda: dynamic_reconfigure.client.Client("/{}/perception/realsense/vision_pipeline".format(self.robot_name),timeout=PIPELINE_CONNECT_TIMEOUT,config_callback=self.HandleRealSenseConfig))
+        rospy.on_shutdown(self.pipelines.Shutdown)
+
+        # overall states and the transitions between them
+        self.states = None  # StateEntry per State
+        self.transitions = None  # new State at trigger * number of states + State, or -1
+        for path in [os.path.join(self.config_dir,'r2_behavior_states.yaml'),os.path.join(CFG_DIR,'r2_behavior_states.yaml')]:
+            if os.path.exists(path):
+                try:
+                    self.states,self.transitions = CompileStates(YamlConfig.load(os.path.dirname(path),os.path.basename(path)),self.pipelines.workers)
+                    break
+                except ValueError as e:
+                    rospy.logerr("{}: {}".format(path,e))
+        if self.states == None:
+            # without states every trigger would fail, so don't start at all
+            raise ValueError("no valid r2_behavior_states.yaml")
+        self.enter_actions = {
+            "hand_decay": self.StartHandDecay,
+            "talk_decay": self.StartTalkDecay,
+            "all_faces": self.ScheduleAllFacesStart
+        }
+
+        if pipeline_connect == "blocking":
+            self.pipelines.WaitConnected(PIPELINE_CONNECT_TIMEOUT)
 
         # TEMP: set all pipelines to 1Hz
-        self.lefteye_config.update_configuration({"pipeline_rate":1.0,"detect_rate":1.0})
-        self.righteye_config.update_configuration({"pipeline_rate":1.0,"detect_rate":1.0})
-        self.wideangle_config.update_configuration({"pipeline_rate":1.0,"detect_rate":1.0})
-        self.realsense_config.update_configuration({"pipeline_rate":1.0,"detect_rate":1.0})
+        self.pipelines.Request("lefteye",1.0,1.0)
+        self.pipelines.Request("righteye",1.0,1.0)
+        self.pipelines.Request("wideangle",1.0,1.0)
+        self.pipelines.Request("realsense",1.0,1.0)
+
+        # load the animations, and watch them for changes from then on
+        try:
+            self.animation_watcher.Check()
+        except Exception as e:
+            rospy.logerr("animations: {}".format(e))
+        self.animation_watcher.start()
+        rospy.on_shutdown(self.animation_watcher.Shutdown)
 
-        # start timer
+        # start ticking
         self.config_server = FakeConfigServer()  # this is a workaround because self.HandleTimer could be triggered before the config_server actually exists
-        self.timer = rospy.Timer(rospy.Duration(1.0 / self.synthesizer_rate),self.HandleTimer)
+        self.state_display = StateDisplay(lambda fields: self.config_server.update_configuration(fields),self.Param("state_display_rate",5.0))
+        rospy.on_shutdown(self.state_display.Shutdown)
+        self.tick_clock = TickClock(self.HandleTimer,self.scheduler.Next,self.state_rates[self.state],self.synthesizer_rate)
+        self.inbox.wake = self.tick_clock.Wake
+        if tick_loop == None:
+            tick_loop = TickLoop()
+            tick_loop.start()
+            rospy.on_shutdown(tick_loop.Shutdown)
+        tick_loop.Add(self.tick_clock)
 
         # start dynamic reconfigure server
-        self.config_server = Server(BehaviorConfig, self.HandleConfig)
+        if self.namespace == "":
+            self.config_server = Server(BehaviorConfig, self.HandleConfig)
+        else:
+            self.config_server = Server(BehaviorConfig, self.HandleConfig, namespace=rospy.get_name() + self.namespace)
+
+        startup_time = time.time() - self.start_time
+        rospy.loginfo("behavior started in {:.3f} sec.".format(startup_time))
+        self.startup_time_pub.publish(Float64(startup_time))
+
+
+    def Param(self,name,default):
+        # private parameter, per robot when there are several
+        if self.namespace != "":
+            return rospy.get_param("~" + self.robot_name + "/" + name,rospy.get_param("~" + name,default))
+        return rospy.get_param("~" + name,default)
 
 
     def UpdateStateDisplay(self):
 
-        self.config_server.update_configuration({
+        # sent later by the state display, the new config then comes back through HandleConfig, where it changes nothing
+        self.state_display.Show({
             "eyecontact_state":self.eyecontact,
             "lookat_state":self.lookat,
             "mirroring_state":self.mirroring,
             "gaze_state":self.gaze,
-            "eyecontact_state":self.eyecontact
+            "state":self.state
         })
 
 
     def HandleConfig(self, config, level):
 
-        # Load gestures and expressions from configs first time loaded
-        if config.reload_animations or (self.animations == None):
-            try:
-                self.animations = YamlConfig.load(self.config_dir, 'r2_behavior_anim.yaml')
-            except IOError:
-                self.animations = YamlConfig.load(os.path.join(os.path.dirname(os.path.dirname(__file__)),'cfg'),
-                                                    'r2_behavior_anim.default.yaml')
-            config.reload_animations = False
+        # make sure the ranges are valid
+        if config.saliency_time_max < config.saliency_time_min:
+            config.saliency_time_max = config.saliency_time_min
+        if config.faces_time_max < config.faces_time_min:
+            config.faces_time_max = config.faces_time_min
+        if config.eyes_time_max < config.eyes_time_min:
+            config.eyes_time_max = config.eyes_time_min
+        if config.audience_time_max < config.audience_time_min:
+            config.audience_time_max = config.audience_time_min
+        if config.gesture_time_max < config.gesture_time_min:
+            config.gesture_time_max = config.gesture_time_min
+        if config.expression_time_max < config.expression_time_min:
+            config.expression_time_max = config.expression_time_min
+        if config.all_faces_start_time_max < config.all_faces_start_time_min:
+            config.all_faces_start_time_max = config.all_faces_start_time_min
+        if config.all_faces_duration_max < config.all_faces_duration_min:
+            config.all_faces_duration_max = config.all_faces_duration_min
+
+        changed_states = self.state_display.Shown(config)
+
+        # the config is applied by the timer thread
+        reload_animations = config.reload_animations
+        config.reload_animations = False
+        self.inbox.Post(self.ApplyConfig,(config,reload_animations,changed_states))
+
+        return config
+
+
+    def ApplyConfig(self, new_config, received):
+
+        config,reload_animations,changed_states = new_config
+
+        # gestures and expressions are loaded by the watcher, have it check for changes now
+        if reload_animations:
+            self.animation_watcher.Reload()
 
         if self.current_gestures_name == None:
             self.current_gestures_name = "idle_gestures"
@@ -293,95 +1973,168 @@ class Behavior:
             self.enable_flag = config.enable_flag
             # TODO: enable or disable the behaviors
 
-        if self.synthesizer_rate != config.synthesizer_rate:
-            self.synthesizer_rate = config.synthesizer_rate
-            self.timer.shutdown()
-            self.timer = rospy.Timer(rospy.Duration(1.0 / self.synthesizer_rate),self.HandleTimer)
-            self.InitSaliencyCounter()
-            self.InitFacesCounter()
-            self.InitEyesCounter()
-            self.InitAudienceCounter()
-            self.InitGestureCounter()
-            self.InitExpressionCounter()
-            self.InitAllFacesStartCounter()
-            self.InitAllFacesDurationCounter()
+        # tick rates, the next tick is planned after this one, so they take effect right away
+        self.synthesizer_rate = config.synthesizer_rate
+        self.tick_clock.max_rate = self.synthesizer_rate
+        self.state_rates[State.SLEEPING] = config.sleeping_rate
+        self.state_rates[State.IDLE] = config.idle_rate
+        self.state_rates[State.INTERESTED] = config.interested_rate
+        self.state_rates[State.FOCUSED] = config.focused_rate
+        self.state_rates[State.SPEAKING] = config.speaking_rate
+        self.state_rates[State.LISTENING] = config.listening_rate
+        self.state_rates[State.PRESENTING] = config.presenting_rate
+        self.tick_clock.rate = self.state_rates[self.state]
+        if self.perception_wakeup != config.perception_wakeup:
+            self.perception_wakeup = config.perception_wakeup
+            if self.perception_wakeup:
+                self.inbox.wake = self.tick_clock.Wake
+            else:
+                self.inbox.wake = None
 
         # keep time
-        self.keep_time = config.keep_time
+        if self.keep_time != config.keep_time:
+            self.keep_time = config.keep_time
+            if self.scheduler.Pending(self.HandlePrune):
+                self.scheduler.Schedule(self.HandlePrune,self.now)
 
-        # update the counter ranges (and counters if the ranges changed)
-        if config.saliency_time_max < config.saliency_time_min:
-            config.saliency_time_max = config.saliency_time_min
+        # update the time ranges (and reschedule pending events if the ranges changed)
         if config.saliency_time_min != self.saliency_time_min or config.saliency_time_max != self.saliency_time_max:
             self.saliency_time_min = config.saliency_time_min
             self.saliency_time_max = config.saliency_time_max
-            self.InitSaliencyCounter()
+            if self.scheduler.Pending(self.HandleSaliencySwitch):
+                self.ScheduleSaliencySwitch()
 
-        if config.faces_time_max < config.faces_time_min:
-            config.faces_time_max = config.faces_time_min
         if config.faces_time_min != self.faces_time_min or config.faces_time_max != self.faces_time_max:
             self.faces_time_min = config.faces_time_min
             self.faces_time_max = config.faces_time_max
-            self.InitFacesCounter()
+            if self.scheduler.Pending(self.HandleFaceSwitch):
+                self.ScheduleFaceSwitch()
 
-        if config.eyes_time_max < config.eyes_time_min:
-            config.eyes_time_max = config.eyes_time_min
         if config.eyes_time_min != self.eyes_time_min or config.eyes_time_max != self.eyes_time_max:
             self.eyes_time_min = config.eyes_time_min
             self.eyes_time_max = config.eyes_time_max
-            self.InitEyesCounter()
+            if self.scheduler.Pending(self.HandleEyeSwitch):
+                self.ScheduleEyeSwitch()
 
-        if config.audience_time_max < config.audience_time_min:
-            config.audience_time_max = config.audience_time_min
         if config.audience_time_min != self.audience_time_min or config.audience_time_max != self.audience_time_max:
             self.audience_time_min = config.audience_time_min
             self.audience_time_max = config.audience_time_max
-            self.InitAudienceCounter()
+            if self.scheduler.Pending(self.HandleAudienceSwitch):
+                self.ScheduleAudienceSwitch()
 
-        if config.gesture_time_max < config.gesture_time_min:
-            config.gesture_time_max = config.gesture_time_min
         if config.gesture_time_min != self.gesture_time_min or config.gesture_time_max != self.gesture_time_max:
             self.gesture_time_min = config.gesture_time_min
             self.gesture_time_max = config.gesture_time_max
-            self.InitGestureCounter()
+            self.ScheduleGesture()
 
-        if config.expression_time_max < config.expression_time_min:
-            config.expression_time_max = config.expression_time_min
         if config.expression_time_min != self.expression_time_min or config.expression_time_max != self.expression_time_max:
             self.expression_time_min = config.expression_time_min
             self.expression_time_max = config.expression_time_max
-            self.InitExpressionCounter()
-
-        self.hand_state_decay = config.hand_state_decay
-        self.face_state_decay = config.face_state_decay
+            self.ScheduleExpression()
+
+        # decay times are checked again with the new values
+        if self.hand_state_decay != config.hand_state_decay:
+            self.hand_state_decay = config.hand_state_decay
+            if self.scheduler.Pending(self.HandleHandDecay):
+                self.scheduler.Schedule(self.HandleHandDecay,self.now)
+        if self.face_state_decay != config.face_state_decay:
+            self.face_state_decay = config.face_state_decay
+            if self.scheduler.Pending(self.HandleTalkDecay):
+                self.scheduler.Schedule(self.HandleTalkDecay,self.now)
 
         self.gaze_delay = config.gaze_delay
         self.gaze_speed = config.gaze_speed
 
-        if config.all_faces_start_time_max < config.all_faces_start_time_min:
-            config.all_faces_start_time_max = config.all_faces_start_time_min
+        # instrumentation
+        self.profiling_period = config.profiling_period
+        if self.profiler.enabled != config.profiling:
+            self.profiler.enabled = config.profiling
+            if self.profiler.enabled:
+                self.scheduler.Schedule(self.HandleDiagnostics,self.now + self.profiling_period)
+            else:
+                self.scheduler.Cancel(self.HandleDiagnostics)
+
+        # mirroring output
+        with self.mirroring_lock:
+            if self.mirroring_filter.kind != config.mirroring_filter:
+                self.mirroring_filter.Reset()
+            self.mirroring_filter.kind = config.mirroring_filter
+            self.mirroring_filter.cutoff = config.mirroring_cutoff
+            self.mirroring_filter.beta = config.mirroring_beta
+        if self.mirroring_rate != config.mirroring_rate:
+            self.mirroring_rate = config.mirroring_rate
+            if self.mirroring_timer != None:
+                self.StopMirroringTimer()
+                self.StartMirroringTimer()
+
+        # awareness
+        self.awareness.SetDecay(config.awareness_decay,self.now)
+        self.wake_threshold = config.wake_threshold
+
+        # audience regions
+        self.audience.radius = config.audience_radius
+        self.audience.SetDecay(config.audience_decay,self.now)
+
+        # speaker localization
+        self.speaker.window = config.speaker_window
+        self.speaker.angle = config.speaker_angle
+
+        # face and hand tracking
+        for tracker in [self.faces.tracker,self.hand_tracker]:
+            tracker.alpha = config.tracker_alpha
+            tracker.beta = config.tracker_beta
+            tracker.horizon = config.tracker_horizon
+
+        # gaze and head target output
+        self.gaze_focus_pub.deadband = config.target_deadband
+        self.gaze_focus_pub.max_rate = config.target_max_rate
+        self.head_focus_pub.deadband = config.target_deadband
+        self.head_focus_pub.max_rate = config.target_max_rate
+
         if config.all_faces_start_time_min != self.all_faces_start_time_min or config.all_faces_start_time_max != self.all_faces_start_time_max:
             self.all_faces_start_time_min = config.all_faces_start_time_min
             self.all_faces_start_time_max = config.all_faces_start_time_max
-            self.InitAllFacesStartCounter()
+            if self.scheduler.Pending(self.HandleAllFacesStart):
+                self.ScheduleAllFacesStart()
 
-        if config.all_faces_duration_max < config.all_faces_duration_min:
-            config.all_faces_duration_max = config.all_faces_duration_min
         if config.all_faces_duration_min != self.all_faces_duration_min or config.all_faces_duration_max != self.all_faces_duration_max:
             self.all_faces_duration_min = config.all_faces_duration_min
             self.all_faces_duration_max = config.all_faces_duration_max
-            self.InitAllFacesDurationCounter()
-
-        # and set the states for each state machine
-        self.SetEyeContact(config.eyecontact_state)
-        self.SetLookAt(config.lookat_state)
-        self.SetMirroring(config.mirroring_state)
-        self.SetGaze(config.gaze_state)
+            if self.scheduler.Pending(self.HandleAllFacesEnd):
+                self.ScheduleAllFacesEnd()
+
+        # and set the states for each state machine, only the ones that were changed in the server (not the display's own updates coming back), so an unrelated change or an echo never undoes a transition the robot made by itself since
+        if "eyecontact_state" in changed_states:
+            self.SetEyeContact(config.eyecontact_state)
+        if "lookat_state" in changed_states:
+            self.SetLookAt(config.lookat_state)
+        if "mirroring_state" in changed_states:
+            self.SetMirroring(config.mirroring_state)
+        if "gaze_state" in changed_states:
+            self.SetGaze(config.gaze_state)
 
         # and finally the overall state
-        self.SetState(config.state)
+        if "state" in changed_states:
+            self.SetState(config.state)
+
+
+    def HandleAnimations(self,compiled):
+        # the new animations are compiled by the cache, only swap them in on the timer thread
+        self.inbox.Post(self.ApplyAnimations,compiled)
 
-        return config
+
+    def ApplyAnimations(self,compiled,received):
+        self.animations,self.gesture_samplers,self.expression_samplers = compiled
+
+
+    def HandleShutdown(self):
+        rospy.loginfo("gaze targets: {} sent, {} suppressed".format(self.gaze_focus_pub.sent,self.gaze_focus_pub.suppressed))
+        rospy.loginfo("head targets: {} sent, {} suppressed".format(self.head_focus_pub.sent,self.head_focus_pub.suppressed))
+
+
+    def HandlePipelinesReady(self,duration):
+        rospy.loginfo("all vision pipelines connected {:.3f} sec. after start".format(duration))
+        self.pipelines_ready_time_pub.publish(Float64(duration))
 
 
     def HandleLeftEyeConfig(self,config):
@@ -409,26 +2162,17 @@ class Behavior:
 
 
     def SetGazeFocus(self,pos,speed):
-        msg = Target()
-        msg.x = pos.x
-        msg.y = pos.y
-        msg.z = pos.z
-        msg.speed = speed
-        self.gaze_focus_pub.publish(msg)
+        self.gaze_focus_pub.Publish(pos,speed,self.now)
 
 
     def SetHeadFocus(self,pos,speed):
-        msg = Target()
-        msg.x = pos.x
-        msg.y = pos.y
-        msg.z = pos.z
-        msg.speed = speed
-        self.head_focus_pub.publish(msg)
+        self.head_focus_pub.Publish(pos,speed,self.now)
 
 
     def UpdateGaze(self,pos):
 
-        self.gaze_pos = pos
+        self.gaze_pos[:] = pos
+        self.gaze_pos_valid = True
 
         if self.gaze == Gaze.GAZE_ONLY:
             self.SetGazeFocus(pos,5.0)
@@ -449,50 +2193,251 @@ class Behavior:
 
     def SelectNextFace(self):
         # switch to the next (or first) face
-        if len(self.faces) == 0:
-            # there are no faces, so select none
-            self.current_face_id = 0
-            return
-        if self.current_face_id == 0:
-            self.current_face_id = self.faces.keys()[0]
-        else:
-            if self.current_face_id in self.faces:
-                next = self.faces.keys().index(self.current_face_id) + 1
-                if next >= len(self.faces.keys()):
-                    next = 0
-            else:
-                next = 0
-            self.current_face_id = self.faces.keys()[next]
+        # (if there are no faces, this selects none)
+        self.current_face_id = self.faces.Next(self.current_face_id)
 
 
     def SelectNextSaliency(self):
         # switch to the next (or first) saliency vector
-        if len(self.saliencies) == 0:
-            # there are no saliency vectors, so select none
-            self.current_saliency_ts = 0
+        self.saliencies.Next()
+
+
+    def SelectNextAudience(self):
+        # switch to the next (or first) audience region
+        self.audience.Next(self.now)
+
+
+    def HandleSaliencySwitch(self):
+        # switch to the next saliency vector
+        if self.lookat == LookAt.SALIENCY:
+            self.ScheduleSaliencySwitch()
+            self.SelectNextSaliency()
+
+
+    def HandleFaceSwitch(self):
+        # switch to the next face
+        if self.lookat == LookAt.ALL_FACES:
+            self.ScheduleFaceSwitch()
+            self.SelectNextFace()
+
+
+    def HandleEyeSwitch(self):
+        # switch between eyes (and mouth)
+        if self.lookat != LookAt.ONE_FACE and self.lookat != LookAt.ALL_FACES:
             return
-        if self.current_saliency_ts == 0:
-            self.current_saliency_ts = self.saliencies.keys()[0]
-        else:
-            if self.current_saliency_ts in self.saliencies:
-                next = self.saliencies.keys().index(self.current_saliency_ts) + 1
-                if next >= len(self.saliencies):
-                    next = 0
+
+        if self.eyecontact == EyeContact.BOTH_EYES:
+            # switch between eyes back and forth
+            self.ScheduleEyeSwitch()
+            if self.current_eye == 1:
+                self.current_eye = 0
             else:
-                next = 0
-            self.current_saliency_ts = self.saliencies.keys()[next]
+                self.current_eye = 1
 
+        elif self.eyecontact == EyeContact.TRIANGLE:
+            # cycle between eyes and mouth
+            self.ScheduleEyeSwitch()
+            if self.current_eye == 2:
+                self.current_eye = 0
+            else:
+                self.current_eye += 1
+
+
+    def HandleAudienceSwitch(self):
+        # switch to the next audience
+        if self.lookat == LookAt.AUDIENCE:
+            self.ScheduleAudienceSwitch()
+            self.SelectNextAudience()
+
+
+    def HandleGesture(self):
+        # start random gestures
+        self.ScheduleGesture()
+
+        if self.animations != None:
+
+            # pick one of the gestures that would fire right now according to probability
+            g = self.gesture_samplers[self.current_gestures_name].Select(self.rng)
+            if g != None:
+                msg = SetGesture()
+                msg.name = g.name
+                msg.repeat = False
+                msg.speed = self.rng.Uniform(g.speed_min,g.speed_max)
+                msg.magnitude = self.rng.Uniform(g.magnitude_min,g.magnitude_max)
+                self.gestures_pub.publish(msg)
+                if self.profiler.enabled:
+                    self.profiler.Count("published.gestures")
 
-    def SelectNextAudience(self):
-        # TODO: switch to next audience (according to audience ROI)
-        ()
+
+    def HandleExpression(self):
+        # start random expressions
+        self.ScheduleExpression()
+
+        if self.animations != None:
+
+            # pick one of the expressions that would fire right now according to probability
+            g = self.expression_samplers[self.current_expressions_name].Select(self.rng)
+            if g != None:
+                msg = EmotionState()
+                msg.name = g.name
+                msg.magnitude = self.rng.Uniform(g.magnitude_min,g.magnitude_max)
+                msg.duration = rospy.Duration(self.rng.Uniform(g.duration_min,g.duration_max))
+                self.expressions_pub.publish(msg)
+                if self.profiler.enabled:
+                    self.profiler.Count("published.expressions")
+
+
+    def HandlePrune(self):
+
+        prune_before_time = self.now - self.keep_time
+
+        # flush faces table, update current face accordingly
+        self.faces.Expire(prune_before_time)
+        # make sure the selected face is always valid
+        if self.current_face_id != 0 and self.current_face_id not in self.faces:
+            self.SelectNextFace()
+
+        # remove hand if it is too old
+        if self.hand != None:
+            if self.hand.ts.to_sec() < prune_before_time:
+                self.hand = None
+
+        # flush saliency buffer, this also keeps the selected saliency valid
+        self.saliencies.Expire(prune_before_time)
+
+        # and come back when the next observation expires
+        oldest = min(self.faces.Oldest(),self.saliencies.Oldest())
+        if self.hand != None:
+            oldest = min(oldest,self.hand.ts.to_sec())
+        if oldest != float("inf"):
+            self.SchedulePrune(oldest)
+
+
+    def HandleHandDecay(self):
+        # decay (from FOCUSED to IDLE in the default table) if hand was not seen for a while, in states that start hand_decay
+        if "hand_decay" not in self.states[self.state].enter:
+            return
+        deadline = self.last_hand_ts + self.hand_state_decay
+        if deadline <= self.now:
+            self.Fire(Trigger.HAND_LOST)
+        else:
+            self.scheduler.Schedule(self.HandleHandDecay,deadline)
+
+
+    def HandleTalkDecay(self):
+        # decay (from SPEAKING or LISTENING to IDLE in the default table) when talking stopped for a while, in states that start talk_decay
+        if "talk_decay" not in self.states[self.state].enter:
+            return
+        deadline = self.last_talk_ts + self.face_state_decay
+        if deadline <= self.now:
+            self.Fire(Trigger.TALK_LOST)
+        else:
+            self.scheduler.Schedule(self.HandleTalkDecay,deadline)
+
+
+    def StartHandDecay(self):
+        self.scheduler.Schedule(self.HandleHandDecay,self.last_hand_ts + self.hand_state_decay)
+
+
+    def StartTalkDecay(self):
+        self.last_talk_ts = rospy.get_rostime().to_sec()
+        self.scheduler.Schedule(self.HandleTalkDecay,self.last_talk_ts + self.face_state_decay)
+
+
+    def HandleGazeFollow(self):
+        # have gaze or head follow head or gaze after a while
+        if self.gaze == Gaze.GAZE_LEADS_HEAD:
+            if self.gaze_pos_valid:
+                self.SetHeadFocus(self.gaze_pos,self.gaze_speed)
+
+        elif self.gaze == Gaze.HEAD_LEADS_GAZE:
+            if self.gaze_pos_valid:
+                self.SetGazeFocus(self.gaze_pos,self.gaze_speed)
+
+        else:
+            return
+
+        self.scheduler.Schedule(self.HandleGazeFollow,self.now + self.gaze_delay)
+
+
+    def HandleAllFacesStart(self):
+        # in states that start all_faces (SPEAKING in the default table), sometimes look at all faces instead of where the state looks
+        entry = self.states[self.state]
+        if "all_faces" in entry.enter and self.lookat != LookAt.ALL_FACES and (entry.lookat == None or self.lookat == entry.lookat):
+            self.all_faces_lookat = self.lookat
+            self.SetLookAt(LookAt.ALL_FACES)
+            self.UpdateStateDisplay()
+            self.ScheduleAllFacesEnd()
+
+
+    def HandleAllFacesEnd(self):
+        # and go back after a while
+        if "all_faces" in self.states[self.state].enter and self.lookat == LookAt.ALL_FACES:
+            self.SetLookAt(self.all_faces_lookat)
+            self.UpdateStateDisplay()
+            self.ScheduleAllFacesStart()
+
+
+    def HandleDiagnostics(self):
+        # low rate summary of the instrumentation
+        self.scheduler.Schedule(self.HandleDiagnostics,self.now + self.profiling_period)
+
+        status = DiagnosticStatus()
+        status.name = "r2_behavior: {} synthesizer".format(self.robot_name)  # robots hosted in one process each have their own status
+        status.hardware_id = self.robot_name
+        status.level = DiagnosticStatus.OK
+        status.message = "OK"
+        tick = self.profiler.histograms.get("tick")
+        if tick != None and np.max(tick.samples) > 1.0 / self.tick_clock.max_rate:
+            status.level = DiagnosticStatus.WARN
+            status.message = "ticks take longer than the synthesizer period"
+        status.values = self.profiler.Report()
+        status.values.append(KeyValue("published.gaze","{} sent, {} suppressed".format(self.gaze_focus_pub.sent,self.gaze_focus_pub.suppressed)))
+        status.values.append(KeyValue("published.head","{} sent, {} suppressed".format(self.head_focus_pub.sent,self.head_focus_pub.suppressed)))
+        status.values.append(KeyValue("published.pau",str(self.mirroring_published)))
+        status.values.append(KeyValue("inbox",str(len(self.inbox))))
+        status.values.append(KeyValue("scheduled",str(len(self.scheduler))))
+
+        msg = DiagnosticArray()
+        msg.header.stamp = rospy.Time.from_sec(self.now)
+        msg.status = [status]
+        self.diagnostics_pub.publish(msg)
 
 
     def HandleTimer(self,data):
 
         # this is the heart of the synthesizer, here the lookat and eyecontact state machines take care of where the robot is looking, and random expressions and gestures are triggered to look more alive (like RealSense Tracker)
 
-        ts = data.current_expected
+        self.now = data.current_expected.to_sec()
+
+        profiler = None
+        if self.profiler.enabled:
+            profiler = self.profiler
+            start = profiler.Start()
+            if data.current_real != None:
+                profiler.Add("jitter",data.current_real.to_sec() - self.now)
+
+        # apply perception and events that came in since the last tick
+        self.inbox.Drain(profiler)
+        if profiler != None:
+            profiler.Mark("section.inbox")
+
+        mirror_slot = -1  # slot of the face to mirror
+
+        # handle everything that is due: switching saliency, faces, eyes or audience, random gestures and expressions, pruning, state decay and gaze following
+        event = self.scheduler.Pop(self.now)
+        while event != None:
+            event()
+            if profiler != None:
+                profiler.Mark("event." + event.__name__)
+            event = self.scheduler.Pop(self.now)
+
+        # enter the state this tick ended up in, once
+        if self.next_state != self.state:
+            self.SetState(self.next_state)
+            self.UpdateStateDisplay()
+            if profiler != None:
+                profiler.Mark("section.state")
 
         # ==== handle lookat
         if self.lookat == LookAt.IDLE:
@@ -500,66 +2445,40 @@ class Behavior:
             ()
 
         elif self.lookat == LookAt.AVOID:
-            # TODO: find out where there is no saliency, hand or face
-            # TODO: head_focus_pub
-            ()
+            # look where there is no saliency, hand or face
+            self.UpdateGaze(self.awareness.Emptiest(self.now))
 
         elif self.lookat == LookAt.SALIENCY:
-            self.saliency_counter -= 1
-            if self.saliency_counter == 0:
-                self.InitSaliencyCounter()
-                self.SelectNextSaliency()
-            if self.current_saliency_ts != 0:
-                cursaliency = self.saliencies[self.current_saliency_ts]
-                self.UpdateGaze(cursaliency.direction)
+            if self.saliencies.current >= 0:
+                self.UpdateGaze(self.saliencies.Direction())
 
         elif self.lookat == LookAt.HAND:
             # stare at hand
             if self.hand != None:
-                self.UpdateGaze(self.hand.position)
+                self.UpdateGaze(self.hand_tracker.Predict(self.now)[0])
 
         elif self.lookat == LookAt.AUDIENCE:
-            self.audience_counter -= 1
-            if self.audience_counter == 0:
-                self.InitAudienceCounter()
-                self.SelectNextAudience()
-                # TODO: self.UpdateGaze()
+            # look at the current audience region
+            audience_pos = self.audience.Direction()
+            if audience_pos is not None:
+                self.UpdateGaze(audience_pos)
 
-        elif self.lookat == LookAt.SPEAKER:
-            ()
-            # TODO: look at the speaker, according to speaker ROI
+        elif self.lookat == LookAt.SPEAKER and self.speaker_face_id == 0 and self.speaker.Active(self.now):
+            # no face goes with the sound, so look where the sound comes from, even when there are other faces
+            self.UpdateGaze(self.speaker.direction)
 
         else:
-            if self.lookat == LookAt.ALL_FACES:
-                self.faces_counter -= 1
-                if self.faces_counter == 0:
-                    self.InitFacesCounter()
-                    self.SelectNextFace()
-
-            # take the current face
+            # take the current face (for LookAt.SPEAKER this is the face ApplyAudioDirection found, or the last one while it is quiet)
             if self.current_face_id != 0:
-                curface = self.faces[self.current_face_id]
-                face_pos = curface.position
+                curface = self.faces.Slot(self.current_face_id)
+                face_pos = self.faces.tracker.Predict(self.now)[curface]
 
-                # ==== handle eyecontact (only for LookAt.ONE_FACE and LookAt.ALL_FACES)
+                # ==== handle eyecontact (only for LookAt.ONE_FACE, LookAt.ALL_FACES and LookAt.SPEAKER)
 
                 # calculate where left eye, right eye and mouth are on the current face
-                left_eye_pos = Float32XYZ()
-                right_eye_pos = Float32XYZ()
-                mouth_pos = Float32XYZ()
-
-                # all are 5cm in front of the center of the face
-                left_eye_pos.x = face_pos.x - 0.05
-                right_eye_pos.x = face_pos.x - 0.05
-                mouth_pos.x = face_pos.x - 0.05
-
-                left_eye_pos.y = face_pos.y + 0.03  # left eye is 3cm to the left of the center
-                right_eye_pos.y = face_pos.y - 0.03  # right eye is 3cm to the right of the center
-                mouth_pos.y = face_pos.y  # mouth is dead center
-
-                left_eye_pos.z = face_pos.z + 0.06  # left eye is 6cm above the center
-                right_eye_pos.z = face_pos.z + 0.06  # right eye is 6cm above the center
-                mouth_pos.z = face_pos.z - 0.04  # mouth is 4cm below the center
+                left_eye_pos = np.add(face_pos,LEFT_EYE_OFFSET,out=self.left_eye_pos)
+                right_eye_pos = np.add(face_pos,RIGHT_EYE_OFFSET,out=self.right_eye_pos)
+                mouth_pos = np.add(face_pos,MOUTH_OFFSET,out=self.mouth_pos)
 
                 if self.eyecontact == EyeContact.IDLE:
                     # look at center of the head
@@ -574,15 +2493,7 @@ class Behavior:
                     self.UpdateGaze(right_eye_pos)
 
                 elif self.eyecontact == EyeContact.BOTH_EYES:
-                    # switch between eyes back and forth
-                    self.eyes_counter -= 1
-                    if self.eyes_counter == 0:
-                        self.InitEyesCounter()
-                        if self.current_eye == 1:
-                            self.current_eye = 0
-                        else:
-                            self.current_eye = 1
-                    # look at that eye
+                    # look at the current eye, HandleEyeSwitch switches between them
                     if self.current_eye == 0:
                         cur_eye_pos = left_eye_pos
                     else:
@@ -590,15 +2501,7 @@ class Behavior:
                     self.UpdateGaze(cur_eye_pos)
 
                 elif self.eyecontact == EyeContact.TRIANGLE:
-                    # cycle between eyes and mouth
-                    self.eyes_counter -= 1
-                    if self.eyes_counter == 0:
-                        self.InitEyesCounter()
-                        if self.current_eye == 2:
-                            self.current_eye = 0
-                        else:
-                            self.current_eye += 1
-                    # look at that eye
+                    # look at the current eye or mouth, HandleEyeSwitch cycles between them
                     if self.current_eye == 0:
                         cur_eye_pos = left_eye_pos
                     elif self.current_eye == 1:
@@ -607,170 +2510,59 @@ class Behavior:
                         cur_eye_pos = mouth_pos
                     self.UpdateGaze(cur_eye_pos)
 
-                # mirroring
-                msg = pau()
-                msg.m_coeffs = [ ]
-                msg.m_shapekeys = [ ]
-
-                if self.mirroring == Mirroring.EYEBROWS or self.mirroring == Mirroring.EYES or self.mirroring == Mirroring.MOUTH_EYEBROWS or self.mirroring == Mirroring.ALL:
-                    # mirror eyebrows
-                    left_brow = curface.left_brow
-                    right_brow = curface.right_brow
-                    msg.m_coeffs.append("brow_outer_UP.L")
-                    msg.m_shapekeys.append(left_brow)
-                    msg.m_coeffs.append("brow_inner_UP.L")
-                    msg.m_shapekeys.append(left_brow * 0.8)
-                    msg.m_coeffs.append("brow_outer_DN.L")
-                    msg.m_shapekeys.append(1.0 - left_brow)
-                    msg.m_coeffs.append("brow_outer_up.R")
-                    msg.m_shapekeys.append(right_brow)
-                    msg.m_coeffs.append("brow_inner_UP.R")
-                    msg.m_shapekeys.append(right_brow * 0.8)
-                    msg.m_coeffs.append("brow_outer_DN.R")
-                    msg.m_shapekeys.append(1.0 - right_brow)
-
-                if self.mirroring == Mirroring.EYELIDS or self.mirroring == Mirroring.EYES or self.mirroring == Mirroring.MOUTH_EYELIDS or self.mirroring == Mirroring.ALL:
-                    # mirror eyelids
-                    eyes_closed = ((1.0 - curface.left_eyelid) + (1.0 - curface.right_eyelid)) / 2.0
-                    msg.m_coeffs.append("eye-blink.UP.R")
-                    msg.m_shapekeys.append(eyes_closed)
-                    msg.m_coeffs.append("eye-blink.UP.L")
-                    msg.m_shapekeys.append(eyes_closed)
-                    msg.m_coeffs.append("eye-blink.LO.R")
-                    msg.m_shapekeys.append(eyes_closed)
-                    msg.m_coeffs.append("eye-blink.LO.L")
-                    msg.m_shapekeys.append(eyes_closed)
-
-                if self.mirroring == Mirroring.MOUTH or self.mirroring == Mirroring.MOUTH_EYEBROWS or self.mirroring == Mirroring.MOUTH_EYELIDS:
-                    # mirror mouth
-                    mouth_open = curface.mouth_open
-                    msg.m_coeffs.append("lip-JAW.DN")
-                    msg.m_shapekeys.append(mouth_open)
-
-                if self.mirroring != Mirroring.IDLE:
-                    self.StartPauMode()
-                    self.setpau_pub.publish(msg)
+                mirror_slot = curface
 
+        if profiler != None:
+            profiler.Mark("section.lookat")
 
-        # start random gestures
-        self.gesture_counter -= 1
-        if self.gesture_counter == 0:
-            self.InitGestureCounter()
-
-            if self.animations != None:
-
-                # list all gestures that would fire right now according to probability
-                firing = []
-                for g in self.animations[self.current_gestures_name]:
-                    if random.uniform(0.0,1.0) <= g["probability"]:
-                        firing.append(g)
-
-                # start randomly from that list
-                if len(firing) > 0:
-                    g = firing[random.randint(0,len(firing) - 1)]
-                    msg = SetGesture()
-                    msg.name = g["name"]
-                    msg.repeat = False
-                    msg.speed = random.uniform(g["speed_min"],g["speed_max"])
-                    msg.magnitude = random.uniform(g["magnitude_min"],g["magnitude_max"])
-                    self.gestures_pub.publish(msg)
+        # hand the face to mirror over to HandleMirroringTimer
+        if self.mirroring != Mirroring.IDLE:
+            with self.mirroring_lock:
+                if mirror_slot >= 0:
+                    self.mirroring_engine.SetFace(self.faces,mirror_slot)
+                self.mirroring_active = mirror_slot >= 0
+            if profiler != None:
+                profiler.Mark("section.mirroring")
 
-        # start random expressions
-        self.expression_counter -= 1
-        if self.expression_counter == 0:
-            self.InitExpressionCounter()
-
-            if self.animations != None:
-
-                # list all expressions that would fire right now according to probability
-                firing = []
-                for g in self.animations[self.current_expressions_name]:
-                    if random.uniform(0.0,1.0) <= g["probability"]:
-                        firing.append(g)
-
-                # start randomly from that list
-                if len(firing) > 0:
-                    g = firing[random.randint(0,len(firing) - 1)]
-                    msg = EmotionState()
-                    msg.name = g["name"]
-                    msg.magnitude = random.uniform(g["magnitude_min"],g["magnitude_max"])
-                    msg.duration = rospy.Duration(random.uniform(g["duration_min"],g["duration_max"]))
-                    self.expressions_pub.publish(msg)
-
-        prune_before_time = ts - rospy.Duration.from_sec(self.keep_time)
-
-        # flush faces dictionary, update current face accordingly
-        to_be_removed = []
-        for face in self.faces.values():
-            if face.ts < prune_before_time:
-                to_be_removed.append(face.cface_id)
-        # remove the elements
-        for key in to_be_removed:
-            del self.faces[key]
-            # make sure the selected face is always valid
-            if self.current_face_id == key:
-                self.SelectNextFace()
-                
-        # remove hand if it is too old
-        if self.hand != None:
-            if self.hand.ts < prune_before_time:
-                self.hand = None
-
-        # flush saliency dictionary
-        to_be_removed = []
-        for key in self.saliencies.keys():
-            if key < prune_before_time:
-                to_be_removed.append(key)
-        # remove the elements
-        for key in to_be_removed:
-            del self.saliencies[key]
-            # make sure the selected saliency is always valid
-            if self.current_saliency_ts == key:
-                self.SelectNextSaliency()
-
-        # decay from FOCUSED to IDLE if hand was not seen for a while
-        if self.state == State.FOCUSED and self.last_hand_ts < ts - rospy.Duration.from_sec(self.hand_state_decay):
-            self.SetState(State.IDLE)
-            self.UpdateStateDisplay()
-
-        # decay from SPEAKING or LISTENING to IDLE
-        if ((self.state == State.SPEAKING) or (self.state == State.LISTENING)) and self.last_talk_ts < ts - rospy.Duration.from_sec(self.face_state_decay):
-            self.SetState(State.IDLE)
-            self.UpdateStateDisplay()
+        if profiler != None:
+            profiler.Add("tick",profiler.mark - start)
 
-        # have gaze or head follow head or gaze after a while
-        if self.gaze_delay_counter > 0 and self.gaze_pos != None:
-
-            self.gaze_delay_counter -= 1
-            if self.gaze_delay_counter == 0:
-
-                if self.gaze == Gaze.GAZE_LEADS_HEAD:
-                    self.SetHeadFocus(self.gaze_pos,self.gaze_speed)
-                    self.gaze_delay_counter = int(self.gaze_delay * self.synthesizer_rate)
 
-                elif self.gaze == Gaze.HEAD_LEADS_GAZE:
-                    self.SetGazeFocus(self.gaze_pos,self.gaze_speed)
-                    self.gaze_delay_counter = int(self.gaze_delay * self.synthesizer_rate)
+    def HandleMirroringTimer(self,data):
 
+        # send the smoothed mirroring features at mirroring_rate, independent of the synthesizer
+        now = data.current_expected.to_sec()
+        if self.mirroring_ts == None or now <= self.mirroring_ts:
+            dt = 1.0 / self.mirroring_rate
+        else:
+            dt = now - self.mirroring_ts
+        self.mirroring_ts = now
 
-        # when speaking, sometimes look at all faces
-        if self.state == State.SPEAKING:
+        with self.mirroring_lock:
+            if not self.mirroring_active:
+                self.mirroring_filter.Reset()
+                return
+            features = self.mirroring_filter.Step(self.mirroring_engine.features,dt)
+            if np.max(np.abs(features - self.mirroring_sent)) < MIRRORING_EPSILON:
+                return
+            self.mirroring_sent[:] = features
+            self.setpau_pub.publish(self.mirroring_engine.Message(self.mirroring,features))
+            self.mirroring_published += 1
 
-            if self.lookat == LookAt.AVOID:
 
-                self.all_faces_start_counter -= 1
-                if self.all_faces_start_counter == 0:
-                    self.InitAllFacesStartCounter()
-                    self.SetLookAt(LookAt.ALL_FACES)
-                    self.UpdateStateDisplay()
+    def StartMirroringTimer(self):
+        if self.mirroring_timer == None:
+            self.mirroring_ts = None
+            self.mirroring_sent[:] = np.inf
+            self.mirroring_timer = rospy.Timer(rospy.Duration(1.0 / self.mirroring_rate),self.HandleMirroringTimer)
 
-            elif self.lookat == LookAt.ALL_FACES:
 
-                self.all_faces_duration_counter -= 1
-                if self.all_faces_duration_counter == 0:
-                    self.InitAllFacesDurationCounter()
-                    self.SetLookAt(LookAt.AVOID)
-                    self.UpdateStateDisplay()
+    def StopMirroringTimer(self):
+        if self.mirroring_timer != None:
+            self.mirroring_timer.shutdown()
+            self.mirroring_timer = None
+        with self.mirroring_lock:
+            self.mirroring_active = False
 
 
     def SetEyeContact(self, neweyecontact):
@@ -781,7 +2573,7 @@ class Behavior:
         self.eyecontact = neweyecontact
 
         if self.eyecontact == EyeContact.BOTH_EYES or self.eyecontact == EyeContact.TRIANGLE:
-            self.InitEyesCounter()
+            self.ScheduleEyeSwitch()
 
 
     def SetLookAt(self, newlookat):
@@ -792,31 +2584,32 @@ class Behavior:
         self.lookat = newlookat
 
         if self.lookat == LookAt.SALIENCY:
-            self.InitSaliencyCounter()
+            self.ScheduleSaliencySwitch()
 
         elif self.lookat == LookAt.ONE_FACE:
-            self.InitEyesCounter()
+            self.ScheduleEyeSwitch()
 
         elif self.lookat == LookAt.ALL_FACES:
-            self.InitFacesCounter()
-            self.InitEyesCounter()
+            self.ScheduleFaceSwitch()
+            self.ScheduleEyeSwitch()
 
         elif self.lookat == LookAt.AUDIENCE:
-            self.InitAudienceCounter()
+            self.ScheduleAudienceSwitch()
 
 
     def StartPauMode(self):
 
-        mode = UInt8()
-        mode.data = 148
-        self.animationmode_pub.publish(mode)
+        # only send the switch when the mode actually changes
+        if self.pau_mode.data != 148:
+            self.pau_mode.data = 148
+            self.animationmode_pub.publish(self.pau_mode)
 
 
     def StopPauMode(self):
 
-        mode = UInt8()
-        mode.data = 0
-        self.animationmode_pub.publish(mode)
+        if self.pau_mode.data != 0:
+            self.pau_mode.data = 0
+            self.animationmode_pub.publish(self.pau_mode)
 
 
     def SetMirroring(self, newmirroring):
@@ -824,12 +2617,18 @@ class Behavior:
         if newmirroring == self.mirroring:
             return
 
-        self.mirroring = newmirroring
+        # HandleMirroringTimer reads the mode under the lock, so change it together with mirroring_active, and it never sends a message for IDLE
+        with self.mirroring_lock:
+            self.mirroring = newmirroring
+            if self.mirroring == Mirroring.IDLE:
+                self.mirroring_active = False
 
         if self.mirroring == Mirroring.IDLE:
             self.StopPauMode()
+            self.StopMirroringTimer()
         else:
             self.StartPauMode()
+            self.StartMirroringTimer()
 
 
     def SetGaze(self, newgaze):
@@ -840,7 +2639,7 @@ class Behavior:
         self.gaze = newgaze
 
         if self.gaze == Gaze.GAZE_LEADS_HEAD or self.gaze == Gaze.HEAD_LEADS_GAZE:
-            self.gaze_delay_counter = int(self.gaze_delay * self.synthesizer_rate)
+            self.scheduler.Schedule(self.HandleGazeFollow,self.now + self.gaze_delay)
 
 
     # ==== MAIN STATE MACHINE
@@ -848,199 +2647,176 @@ class Behavior:
     def SetState(self, newstate):
 
         # this is where the new main state is initialized, it sets up lookat and eyecontact states appropriately, manage perception system refresh rates and load random gesture and expression probabilities to be processed by HandleTimer
+        # what each state does is in r2_behavior_states.yaml
+
+        self.next_state = newstate
 
         if newstate == self.state:
             return
 
         self.state = newstate
+        self.tick_clock.rate = self.state_rates[self.state]
 
         # initialize new state
-        if self.state == State.SLEEPING:
-            # the robot sleeps
-            print("State.SLEEPING")
-            self.current_gestures_name = "sleeping_gestures"
-            self.current_expressions_name = "sleeping_expressions"
-            #self.lefteye_config.update_configuration({"pipeline_rate":1.0,"detect_rate":1.0})
-            #self.righteye_config.update_configuration({"pipeline_rate":1.0,"detect_rate":1.0})
-            #self.wideangle_config.update_configuration({"pipeline_rate":1.0,"detect_rate":1.0})
-            #self.realsense_config.update_configuration({"pipeline_rate":1.0,"detect_rate":1.0})
-            #self.SetEyeContact(EyeContact.IDLE)
-            #self.SetLookAt(LookAt.IDLE)
-            #self.SetMirroring(Mirroring.IDLE)
-            #self.SetGaze(Gaze.GAZE_ONLY)
-            # IDEA: at SLEEPING, wakeup by ROS message and transition to IDLE
-            # IDEA: at SLEEPING, wakeup by loud noise
-            
-        elif self.state == State.IDLE:
-            # the robot is idle
-            print("State.IDLE")
-            self.current_gestures_name = "idle_gestures"
-            self.current_expressions_name = "idle_expressions"
-            self.lefteye_config.update_configuration({"pipeline_rate":1.0,"detect_rate":1.0})
-            self.righteye_config.update_configuration({"pipeline_rate":1.0,"detect_rate":1.0})
-            self.wideangle_config.update_configuration({"pipeline_rate":10.0,"detect_rate":10.0})
-            self.realsense_config.update_configuration({"pipeline_rate":10.0,"detect_rate":20.0})
-            self.SetEyeContact(EyeContact.IDLE)
-            self.SetLookAt(LookAt.IDLE)
-            self.SetMirroring(Mirroring.IDLE)
-            self.SetGaze(Gaze.GAZE_ONLY)
-
-        elif self.state == State.INTERESTED:
-            # the robot is actively idle
-            print("State.INTERESTED")
-            self.current_gestures_name = "interested_gestures"
-            self.current_expressions_name = "interested_expressions"
-            self.lefteye_config.update_configuration({"pipeline_rate":1.0,"detect_rate":1.0})
-            self.righteye_config.update_configuration({"pipeline_rate":1.0,"detect_rate":1.0})
-            self.wideangle_config.update_configuration({"pipeline_rate":20.0,"detect_rate":10.0})
-            self.realsense_config.update_configuration({"pipeline_rate":20.0,"detect_rate":20.0})
-            self.SetEyeContact(EyeContact.IDLE)
-            self.SetLookAt(LookAt.SALIENCY)
-            self.SetMirroring(Mirroring.IDLE)
-            self.SetGaze(Gaze.GAZE_ONLY)
-
-        elif self.state == State.FOCUSED:
-            # the robot is very interested at something specific
-            print("State.FOCUSED")
-            self.current_gestures_name = "focused_gestures"
-            self.current_expressions_name = "focused_expressions"
-            self.lefteye_config.update_configuration({"pipeline_rate":1.0,"detect_rate":1.0})
-            self.righteye_config.update_configuration({"pipeline_rate":1.0,"detect_rate":1.0})
-            self.wideangle_config.update_configuration({"pipeline_rate":20.0,"detect_rate":20.0})
-            self.realsense_config.update_configuration({"pipeline_rate":20.0,"detect_rate":20.0})
-            self.SetEyeContact(EyeContact.IDLE)
-            self.SetLookAt(LookAt.HAND)
-            self.SetMirroring(Mirroring.IDLE)
-            self.SetGaze(Gaze.GAZE_AND_HEAD)
-
-        elif self.state == State.SPEAKING:
-            # the robot is speaking (directly/intimately) to people
-            print("State.SPEAKING")
-            self.current_gestures_name = "speaking_gestures"
-            self.current_expressions_name = "speaking_expressions"
-            self.lefteye_config.update_configuration({"pipeline_rate":1.0,"detect_rate":1.0})
-            self.righteye_config.update_configuration({"pipeline_rate":1.0,"detect_rate":1.0})
-            self.wideangle_config.update_configuration({"pipeline_rate":20.0,"detect_rate":10.0})
-            self.realsense_config.update_configuration({"pipeline_rate":20.0,"detect_rate":20.0})
-            self.SetEyeContact(EyeContact.IDLE)
-            self.SetLookAt(LookAt.AVOID)
-            self.SetMirroring(Mirroring.IDLE)
-            self.SetGaze(Gaze.GAZE_LEADS_HEAD)
-            self.last_talk_ts = rospy.get_rostime()
-
-        elif self.state == State.LISTENING:
-            # the robot is listening to whoever is speaking
-            print("State.LISTENING")
-            self.current_gestures_name = "listening_gestures"
-            self.current_expressions_name = "listening_expressions"
-            self.lefteye_config.update_configuration({"pipeline_rate":1.0,"detect_rate":1.0})
-            self.righteye_config.update_configuration({"pipeline_rate":1.0,"detect_rate":1.0})
-            self.wideangle_config.update_configuration({"pipeline_rate":20.0,"detect_rate":20.0})
-            self.realsense_config.update_configuration({"pipeline_rate":20.0,"detect_rate":20.0})
-            self.SetEyeContact(EyeContact.BOTH_EYES)
-            self.SetLookAt(LookAt.ONE_FACE)
-            self.SetMirroring(Mirroring.IDLE)
-            self.SetGaze(Gaze.HEAD_LEADS_GAZE)
-            self.last_talk_ts = rospy.get_rostime()
-
-        elif self.state == State.PRESENTING:
-            # the robot is presenting to the audience
-            print("State.PRESENTING")
-            self.current_gestures_name = "presenting_gestures"
-            self.current_expressions_name = "presenting_expressions"
-            self.lefteye_config.update_configuration({"pipeline_rate":1.0,"detect_rate":1.0})
-            self.righteye_config.update_configuration({"pipeline_rate":1.0,"detect_rate":1.0})
-            self.wideangle_config.update_configuration({"pipeline_rate":20.0,"detect_rate":10.0})
-            self.realsense_config.update_configuration({"pipeline_rate":20.0,"detect_rate":20.0})
-            self.SetEyeContact(EyeContact.IDLE)
-            self.SetLookAt(LookAt.AUDIENCE)
-            self.SetMirroring(Mirroring.IDLE)
-            self.SetGaze(Gaze.GAZE_AND_HEAD)
+        entry = self.states[self.state]
+        print("State." + entry.name)
+        self.current_gestures_name = entry.gestures
+        self.current_expressions_name = entry.expressions
+        for name,pipeline_rate,detect_rate in entry.pipelines:
+            self.pipelines.Request(name,pipeline_rate,detect_rate)
+        if entry.eyecontact != None:
+            self.SetEyeContact(entry.eyecontact)
+        if entry.lookat != None:
+            self.SetLookAt(entry.lookat)
+        if entry.mirroring != None:
+            self.SetMirroring(entry.mirroring)
+        if entry.gaze != None:
+            self.SetGaze(entry.gaze)
+        for action in entry.enter:
+            self.enter_actions[action]()
 
 
     def HandleFace(self, msg):
+        self.inbox.Post(self.ApplyFace,msg)
+
+
+    def HandleHand(self, msg):
+        self.inbox.Post(self.ApplyHand,msg)
+
+
+    def HandleSaliency(self, msg):
+        self.inbox.Post(self.ApplySaliency,msg)
+
+
+    def HandleChatEvents(self, msg):
+        self.inbox.Post(self.ApplyChatEvents,msg)
+
+
+    def HandleSpeechEvents(self, msg):
+        self.inbox.Post(self.ApplySpeechEvents,msg)
+
+
+    def HandleAudioDirection(self, msg):
+        self.inbox.Post(self.ApplyAudioDirection,msg)
+
+
+    def HandleMotion(self, msg):
+        self.inbox.Post(self.ApplyMotion,msg)
+
 
-        self.faces[msg.cface_id] = msg
+    def ApplyFace(self, msg, received):
+
+        self.faces.Update(msg)
         self.last_face = msg.cface_id
-        self.last_talk_ts = msg.ts
+        self.last_talk_ts = msg.ts.to_sec()
+        self.SchedulePrune(self.last_talk_ts)
+        self.Notice(msg.position,1.0,self.last_talk_ts)
+        self.audience.Add(msg.position.x,msg.position.y,msg.position.z,1.0,self.last_talk_ts)
 
         # TEMP: if there is no current face, make this the current face
         if self.current_face_id == 0:
             self.current_face_id = msg.cface_id
 
 
-    def HandleHand(self, msg):
+    def ApplyHand(self, msg, received):
 
+        if self.hand == None:
+            self.hand_tracker.fresh[0] = True
+        self.hand_tracker.measured[0,0] = msg.position.x
+        self.hand_tracker.measured[0,1] = msg.position.y
+        self.hand_tracker.measured[0,2] = msg.position.z
+        self.hand_tracker.measured_ts[0] = msg.ts.to_sec()
         self.hand = msg
 
-        self.last_hand_ts = msg.ts
+        self.last_hand_ts = msg.ts.to_sec()
+        self.SchedulePrune(self.last_hand_ts)
+        self.Notice(msg.position,1.0,self.last_hand_ts)
 
-        # transition from IDLE or INTERESTED to FOCUSED
-        if self.state == State.IDLE or self.state == State.INTERESTED:
-            self.SetState(State.FOCUSED)
-            self.UpdateStateDisplay()
+        self.Fire(Trigger.HAND)
 
 
-    def HandleSaliency(self, msg):
+    def ApplySaliency(self, msg, received):
 
-        self.saliencies[msg.ts] = msg
+        ts = msg.ts.to_sec()
+        index = self.saliencies.Add(ts,msg.direction)
+        self.SchedulePrune(ts)
+        self.Notice(msg.direction,0.5 * msg.confidence,ts)
+        self.audience.Add(msg.direction.x,msg.direction.y,msg.direction.z,0.5 * msg.confidence,ts)
 
         # TEMP: if there is no current saliency vector, make this the current saliency vector
-        if self.current_saliency_ts == 0:
-            self.saliency_counter = 1
-            self.current_saliency_ts = msg.ts
+        if self.saliencies.current < 0:
+            self.saliencies.current = index
+            if self.lookat == LookAt.SALIENCY:
+                self.scheduler.Schedule(self.HandleSaliencySwitch,self.now)
 
-        # transition from IDLE to INTERESTED
-        if self.state == State.IDLE:
-            self.SetState(State.INTERESTED)
-            self.UpdateStateDisplay()
+        self.Fire(Trigger.SALIENCY)
 
 
-    def HandleChatEvents(self, msg):
+    def ApplyChatEvents(self, msg, received):
 
         # triggered when someone starts talking to the robot
 
-        self.last_talk_ts = rospy.get_rostime()
-
-        # transition from IDLE, INTERESTED or FOCUSED to LISTENING
-        if self.state == State.IDLE or self.state == State.INTERESTED or self.state == State.FOCUSED:
-            self.SetState(State.LISTENING)
-            self.UpdateStateDisplay()
+        self.last_talk_ts = received.to_sec()
+        self.Fire(Trigger.CHAT)
 
 
-    def HandleSpeechEvents(self, msg):
+    def ApplySpeechEvents(self, msg, received):
 
         # triggered when the robot starts or stops talking
 
-        self.last_talk_ts = rospy.get_rostime()
+        self.last_talk_ts = received.to_sec()
 
         if msg.data == "start":
-            # transition from IDLE, INTERESTED, FOCUSED or LISTENING to SPEAKING
-            if self.state == State.IDLE or self.state == State.INTERESTED or self.state == State.FOCUSED or self.state == State.LISTENING:
-                self.SetState(State.SPEAKING)
-                self.UpdateStateDisplay()
+            self.Fire(Trigger.SPEECH_START)
 
         elif msg.data == "stop":
-            # transition from SPEAKING to IDLE
-            if self.state == State.SPEAKING:
-                self.SetState(State.IDLE)
-                self.UpdateStateDisplay()
+            self.Fire(Trigger.SPEECH_STOP)
 
 
+    def ApplyAudioDirection(self, msg, received):
 
-    def HandleAudioDirection(self, msg):
+        # correlate with the faces to select the person speaking as current face, when looking at the speaker or listening
+        self.speaker.Add(msg.ts.to_sec(),msg.direction,msg.confidence)
+        if self.lookat == LookAt.SPEAKER or self.state == State.LISTENING:
+            self.speaker_face_id = self.speaker.Locate(self.faces,self.now)
+            if self.speaker_face_id != 0:
+                self.current_face_id = self.speaker_face_id
 
-        # use to correlate with person speaking to select correct current face
-        ()
 
-
-    def HandleMotion(self, msg):
+    def ApplyMotion(self, msg, received):
 
         # use to trigger awareness of people even without seeing them
-        ()
+        self.Notice(msg.direction,msg.magnitude,msg.ts.to_sec())
+
+
+    def Notice(self, direction, weight, ts):
+
+        # add something seen or moving to the awareness grid
+        self.awareness.Add(direction.x,direction.y,direction.z,weight,ts)
+
+        # wake up when enough is going on
+        if self.wake_threshold > 0.0 and self.awareness.Activity(ts) >= self.wake_threshold:
+            self.Fire(Trigger.ACTIVITY)
+
+
+    def Fire(self, trigger):
+
+        # move the state this tick will end up in, the state itself is only entered at the end of the tick
+        newstate = self.transitions[trigger * len(self.states) + self.next_state]
+        if newstate >= 0:
+            self.next_state = newstate
 
 
 if __name__ == "__main__":
     rospy.init_node('behavior')
-    node = Behavior()
+    robots = rospy.get_param("~robots",[])
+    if len(robots) == 0:
+        node = Behavior()
+    else:
+        # several robots in one process, ticked by one loop and sharing the animation tables
+        tick_loop = TickLoop()
+        animation_cache = MakeAnimationCache(rospy.get_param("~animation_snapshot_dir",os.path.join(os.path.expanduser("~"),".ros","r2_behavior")))
+        nodes = [Behavior(robot_name,tick_loop,animation_cache) for robot_name in robots]
+        tick_loop.start()
+        rospy.on_shutdown(tick_loop.Shutdown)
     rospy.spin()
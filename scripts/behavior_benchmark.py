@@ -0,0 +1,834 @@
+#!/usr/bin/env python
+# offline replay and benchmark harness for the behavior synthesizer
+#
+# this drives Behavior from behavior.py without a robot: rospy, dynamic_reconfigure and the blender_api,
+# r2_perception, hr_msgs and pau2motors message types are replaced by small local stand-ins, time is simulated,
+# and synthetic (or recorded) CandidateFace/CandidateHand/CandidateSaliency streams are replayed into the
+# subscriber callbacks while the synthesizer tick loop and the timers are fired when they are due
+#
+# for every State and LookAt combination it reports tick latency percentiles, allocations per tick (blocks that
+# the tick allocated and kept, and peak KB it allocated) and
+# publish counts per topic, so a change to HandleTimer can be judged by numbers instead of by watching the head
+#
+# examples:
+#   behavior_benchmark.py                                     # full State x LookAt matrix, 5 faces, 30 sec. each
+#   behavior_benchmark.py --faces 40 --rate 100 --states PRESENTING --lookats ALL_FACES,AUDIENCE
+#   behavior_benchmark.py --record session.jsonl              # write the synthetic streams to a recording
+#   behavior_benchmark.py --replay session.jsonl --json out.json
+#
+# recordings are JSON lines, one message per line: {"t": <sec.>, "topic": "cface", "msg": {<fields>}}, where
+# "topic" is one of the keys in TOPICS, nested Float32XYZ fields are {"x": .., "y": .., "z": ..} and time fields
+# (like "ts") are floating point seconds
+
+import argparse
+import ast
+import gc
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+from perception_scenarios import SCENARIOS, TOPICS, SyntheticStreams
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # python 2: allocations are not reported
+
+if hasattr(time, "perf_counter"):
+    perf_counter = time.perf_counter
+else:
+    perf_counter = time.time
+
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+CFG_DIR = os.path.join(os.path.dirname(SCRIPTS_DIR), 'cfg')
+
+ROBOT_NAME = "bench"
+
+# short names of the topics Behavior publishes to (the ones it subscribes to are in perception_scenarios.TOPICS)
+PUBLISHED_TOPICS = {
+    "/blender_api/set_face_target":    "head",
+    "/blender_api/set_gaze_target":    "gaze",
+    "/blender_api/set_emotion_state":  "expr",
+    "/blender_api/set_gesture":        "gest",
+    "/blender_api/set_animation_mode": "mode",
+    "/blender_api/set_pau":            "pau",
+    "/diagnostics":                    "diag",
+}
+
+# per State tick rates in Behavior.cfg, overridden by --fixed-rate
+STATE_RATES = ["sleeping_rate", "idle_rate", "interested_rate", "focused_rate", "speaking_rate", "listening_rate", "presenting_rate"]
+
+
+# ==== stand-in for rospy
+
+class _Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+
+_clock = _Clock()
+
+
+class _TimeBase(object):
+    __slots__ = ('_sec',)
+
+    def __init__(self, secs=0, nsecs=0):
+        self._sec = float(secs) + float(nsecs) * 1e-9
+
+    @classmethod
+    def from_sec(cls, sec):
+        return cls(sec)
+
+    def to_sec(self):
+        return self._sec
+
+    def to_nsec(self):
+        return int(self._sec * 1e9)
+
+    @property
+    def secs(self):
+        return int(math.floor(self._sec))
+
+    @property
+    def nsecs(self):
+        return int((self._sec - math.floor(self._sec)) * 1e9)
+
+    def __lt__(self, other):
+        return self._sec < other._sec
+
+    def __le__(self, other):
+        return self._sec <= other._sec
+
+    def __gt__(self, other):
+        return self._sec > other._sec
+
+    def __ge__(self, other):
+        return self._sec >= other._sec
+
+    def __eq__(self, other):
+        return isinstance(other, _TimeBase) and self._sec == other._sec
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self._sec)
+
+    def __nonzero__(self):
+        return self._sec != 0.0
+
+    __bool__ = __nonzero__
+
+    def __repr__(self):
+        return "{}({:.6f})".format(type(self).__name__, self._sec)
+
+
+class Duration(_TimeBase):
+    __slots__ = ()
+
+    def __add__(self, other):
+        return Duration(self._sec + other._sec)
+
+    def __sub__(self, other):
+        return Duration(self._sec - other._sec)
+
+    def __neg__(self):
+        return Duration(-self._sec)
+
+    def __mul__(self, factor):
+        return Duration(self._sec * factor)
+
+
+class Time(_TimeBase):
+    __slots__ = ()
+
+    @staticmethod
+    def now():
+        return Time(_clock.now)
+
+    def __add__(self, other):
+        return Time(self._sec + other._sec)
+
+    def __sub__(self, other):
+        if isinstance(other, Time):
+            return Duration(self._sec - other._sec)
+        return Time(self._sec - other._sec)
+
+
+class TimerEvent(object):
+
+    def __init__(self, last_expected, last_real, current_expected, current_real, last_duration):
+        self.last_expected = last_expected
+        self.last_real = last_real
+        self.current_expected = current_expected
+        self.current_real = current_real
+        self.last_duration = last_duration
+
+
+class _Registry:
+
+    # everything the stand-ins create, so the harness can drive and inspect one Behavior instance
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.params = {}
+        self.subscribers = {}  # topic -> [callback]
+        self.publishers = {}  # topic -> publish count
+        self.timers = []
+        self.servers = []
+        self.clients = []
+        self.shutdown_handlers = []
+        self.reconfigure_latency = 0.0
+
+
+_registry = _Registry()
+
+
+def _get_param(name, default=KeyError):
+    if name in _registry.params:
+        return _registry.params[name]
+    if name.startswith("~") and ("/behavior/" + name[1:]) in _registry.params:
+        return _registry.params["/behavior/" + name[1:]]
+    if default is KeyError:
+        raise KeyError(name)
+    return default
+
+
+class Publisher(object):
+
+    def __init__(self, name, data_class, queue_size=None, latch=False):
+        self.name = name
+        self.data_class = data_class
+        _registry.publishers.setdefault(name, 0)
+
+    def publish(self, *args, **kwargs):
+        _registry.publishers[self.name] += 1
+
+    def get_num_connections(self):
+        return 1
+
+    def unregister(self):
+        ()
+
+
+class Subscriber(object):
+
+    def __init__(self, name, data_class, callback=None, callback_args=None, queue_size=None, buff_size=65536, tcp_nodelay=False):
+        self.name = name
+        self.callback = callback
+        _registry.subscribers.setdefault(name, []).append(callback)
+
+    def unregister(self):
+        _registry.subscribers[self.name].remove(self.callback)
+
+
+class Timer(object):
+
+    def __init__(self, period, callback, oneshot=False, reset=False):
+        self.period = period.to_sec()
+        self.callback = callback
+        self.oneshot = oneshot
+        self.active = True
+        self.last_expected = None
+        self.next_expected = _clock.now + self.period
+        _registry.timers.append(self)
+
+    def shutdown(self):
+        self.active = False
+
+
+def _log(msg, *args):
+    if args:
+        msg = msg % args
+    sys.stderr.write(msg + "\n")
+
+
+def _make_rospy():
+    rospy = types.ModuleType("rospy")
+    rospy.Time = Time
+    rospy.Duration = Duration
+    rospy.Timer = Timer
+    rospy.TimerEvent = TimerEvent
+    rospy.Publisher = Publisher
+    rospy.Subscriber = Subscriber
+    rospy.get_param = _get_param
+    rospy.has_param = lambda name: name in _registry.params
+    rospy.set_param = lambda name, value: _registry.params.__setitem__(name, value)
+    rospy.get_rostime = Time.now
+    rospy.get_time = lambda: _clock.now
+    rospy.init_node = lambda *args, **kwargs: None
+    rospy.is_shutdown = lambda: False
+    rospy.spin = lambda: None
+    rospy.sleep = lambda duration: None
+    rospy.on_shutdown = lambda handler: _registry.shutdown_handlers.append(handler)
+    rospy.get_name = lambda: "/behavior"
+    rospy.loginfo = lambda *args: None
+    rospy.logdebug = lambda *args: None
+    rospy.logwarn = _log
+    rospy.logerr = _log
+    rospy.ROSException = Exception
+    rospy.ROSInterruptException = Exception
+    return rospy
+
+
+# ==== stand-in for dynamic_reconfigure
+
+class Config(dict):
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+def ParseConfigDefaults(filename):
+    # collect the defaults of every gen.add() in a dynamic_reconfigure .cfg file
+    defaults = {}
+    pattern = re.compile(r'^gen\.add\(\s*"(\w+)"\s*,\s*\w+\s*,\s*\w+\s*,\s*"[^"]*"\s*,\s*([^,\)]+)')
+    with open(filename, 'r') as stream:
+        for line in stream:
+            match = pattern.match(line.strip())
+            if match:
+                defaults[match.group(1)] = ast.literal_eval(match.group(2).strip())
+    return defaults
+
+
+class Server(object):
+
+    def __init__(self, type, callback, namespace=""):
+        self.callback = callback
+        self.config = Config(ParseConfigDefaults(os.path.join(CFG_DIR, 'Behavior.cfg')))
+        _registry.servers.append(self)
+        self.config = self.callback(self.config, ~0)
+
+    def update_configuration(self, changes):
+        config = Config(self.config)
+        config.update(changes)
+        self.config = self.callback(config, 0)
+        return self.config
+
+
+class Client(object):
+
+    def __init__(self, name, timeout=None, config_callback=None, description_callback=None):
+        self.name = name
+        self.config_callback = config_callback
+        self.config = Config()
+        self.updates = 0
+        _registry.clients.append(self)
+
+    def update_configuration(self, changes):
+        # optionally simulate the round trip to the vision pipeline node
+        if _registry.reconfigure_latency > 0.0:
+            time.sleep(_registry.reconfigure_latency)
+        self.updates += 1
+        self.config.update(changes)
+        if self.config_callback != None:
+            self.config_callback(self.config)
+        return self.config
+
+    def get_configuration(self, timeout=None):
+        return self.config
+
+    def close(self):
+        ()
+
+
+def _make_dynamic_reconfigure():
+    package = types.ModuleType("dynamic_reconfigure")
+    server = types.ModuleType("dynamic_reconfigure.server")
+    server.Server = Server
+    client = types.ModuleType("dynamic_reconfigure.client")
+    client.Client = Client
+    encoding = types.ModuleType("dynamic_reconfigure.encoding")
+    encoding.Config = Config
+    package.server = server
+    package.client = client
+    package.encoding = encoding
+    return [package, server, client, encoding]
+
+
+# ==== stand-in message types
+
+def _message(name, fields):
+
+    # fields is a list of (name, default factory)
+    slots = tuple(field for field, factory in fields)
+
+    def __init__(self, *args, **kwargs):
+        # like genpy messages: positional arguments in field order, or keyword arguments
+        kwargs.update(zip(slots, args))
+        for field, factory in fields:
+            setattr(self, field, kwargs[field] if field in kwargs else factory())
+
+    def __repr__(self):
+        return "{}({})".format(name, ", ".join("{}={!r}".format(field, getattr(self, field)) for field in slots))
+
+    return type(name, (object,), {"__slots__": slots, "__init__": __init__, "__repr__": __repr__})
+
+
+Float32XYZ = _message("Float32XYZ", [("x", float), ("y", float), ("z", float)])
+
+CandidateFace = _message("CandidateFace", [
+    ("session_tag", str), ("camera_id", int), ("cface_id", int), ("ts", Time), ("position", Float32XYZ),
+    ("confidence", float), ("smile", float), ("frown", float), ("expressions", list), ("landmarks", list),
+    ("age", float), ("age_confidence", float), ("gender", int), ("gender_confidence", float), ("identity", int),
+    ("identity_confidence", float), ("left_brow", float), ("right_brow", float), ("left_eyelid", float),
+    ("right_eyelid", float), ("mouth_open", float),
+])
+CandidateHand = _message("CandidateHand", [
+    ("session_tag", str), ("camera_id", int), ("chand_id", int), ("ts", Time), ("position", Float32XYZ),
+    ("confidence", float),
+])
+CandidateSaliency = _message("CandidateSaliency", [
+    ("session_tag", str), ("camera_id", int), ("csaliency_id", int), ("ts", Time), ("direction", Float32XYZ),
+    ("confidence", float),
+])
+AudioDirection = _message("AudioDirection", [("ts", Time), ("direction", float), ("confidence", float)])
+MotionVector = _message("MotionVector", [("ts", Time), ("direction", Float32XYZ), ("magnitude", float)])
+
+Target = _message("Target", [("x", float), ("y", float), ("z", float), ("speed", float)])
+EmotionState = _message("EmotionState", [("name", str), ("magnitude", float), ("duration", Duration)])
+SetGesture = _message("SetGesture", [("name", str), ("repeat", int), ("speed", float), ("magnitude", float)])
+String = _message("String", [("data", str)])
+Float64 = _message("Float64", [("data", float)])
+UInt8 = _message("UInt8", [("data", int)])
+TTS = _message("TTS", [("text", str), ("lang", str)])
+Header = _message("Header", [("seq", int), ("stamp", Time), ("frame_id", str)])
+KeyValue = _message("KeyValue", [("key", str), ("value", str)])
+DiagnosticStatus = _message("DiagnosticStatus", [("level", int), ("name", str), ("message", str), ("hardware_id", str), ("values", list)])
+DiagnosticStatus.OK = 0
+DiagnosticStatus.WARN = 1
+DiagnosticStatus.ERROR = 2
+DiagnosticArray = _message("DiagnosticArray", [("header", Header), ("status", list)])
+pau = _message("pau", [("m_headRotation", object), ("m_headTranslation", object), ("m_neckRotation", object),
+                       ("m_eyeGazeLeftPitch", float), ("m_eyeGazeLeftYaw", float), ("m_eyeGazeRightPitch", float),
+                       ("m_eyeGazeRightYaw", float), ("m_shapekeys", list), ("m_coeffs", list)])
+
+
+def _make_messages():
+    modules = []
+
+    def module(name, **attributes):
+        m = types.ModuleType(name)
+        for key, value in attributes.items():
+            setattr(m, key, value)
+        modules.append(m)
+        return m
+
+    module("blender_api_msgs")
+    module("blender_api_msgs.msg", Target=Target, EmotionState=EmotionState, SetGesture=SetGesture)
+    module("std_msgs")
+    module("std_msgs.msg", String=String, Float64=Float64, UInt8=UInt8)
+    module("diagnostic_msgs")
+    module("diagnostic_msgs.msg", DiagnosticArray=DiagnosticArray, DiagnosticStatus=DiagnosticStatus, KeyValue=KeyValue)
+    module("r2_perception")
+    module("r2_perception.msg", Float32XYZ=Float32XYZ, CandidateFace=CandidateFace, CandidateHand=CandidateHand,
+           CandidateSaliency=CandidateSaliency, AudioDirection=AudioDirection, MotionVector=MotionVector)
+    module("hr_msgs")
+    module("hr_msgs.msg", TTS=TTS)
+    module("pau2motors")
+    module("pau2motors.msg", pau=pau)
+    module("r2_behavior")
+    module("r2_behavior.cfg", BehaviorConfig=object)
+    return modules
+
+
+def InstallStandIns():
+    # put the stand-ins in sys.modules, so behavior.py imports them instead of the real ROS modules
+    modules = [_make_rospy()] + _make_dynamic_reconfigure() + _make_messages()
+    for m in modules:
+        sys.modules[m.__name__] = m
+    for m in modules:
+        if "." in m.__name__:
+            parent, child = m.__name__.rsplit(".", 1)
+            setattr(sys.modules[parent], child, m)
+
+
+# ==== perception streams (the synthetic ones are in perception_scenarios.py)
+
+MESSAGE_TYPES = {
+    "cface": CandidateFace,
+    "chand": CandidateHand,
+    "csaliency": CandidateSaliency,
+    "audiodir": AudioDirection,
+    "motion": MotionVector,
+    "chat": String,
+    "speech": String,
+}
+
+
+def _encode(value):
+    if isinstance(value, _TimeBase):
+        return value.to_sec()
+    if hasattr(value, "__slots__"):
+        return dict((field, _encode(getattr(value, field))) for field in value.__slots__)
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    return value
+
+
+def _decode(data_class, data, start):
+    msg = data_class()
+    for field, value in data.items():
+        current = getattr(msg, field)
+        if isinstance(current, Time):
+            value = Time(start + value)
+        elif isinstance(current, Duration):
+            value = Duration(value)
+        elif isinstance(value, dict):
+            value = _decode(type(current), value, 0.0)
+        setattr(msg, field, value)
+    return msg
+
+
+class RecordedStreams:
+
+    # replays a JSON lines recording; message times and ts fields are shifted so the recording starts at start
+
+    def __init__(self, filename):
+        self.records = []
+        with open(filename, 'r') as stream:
+            for line in stream:
+                line = line.strip()
+                if line:
+                    self.records.append(json.loads(line))
+        self.records.sort(key=lambda record: record["t"])
+
+    def Events(self, start, duration):
+        if len(self.records) == 0:
+            return
+        first = self.records[0]["t"]
+        for record in self.records:
+            t = record["t"] - first
+            if t >= duration:
+                break
+            yield (t, record["topic"], _decode(MESSAGE_TYPES[record["topic"]], record["msg"], start - first))
+
+
+def Record(streams, filename, duration):
+    with open(filename, 'w') as stream:
+        for t, topic, msg in streams.Events(0.0, duration):
+            stream.write(json.dumps({"t": t, "topic": topic, "msg": _encode(msg)}) + "\n")
+
+
+# ==== measurement
+
+def Percentile(sorted_values, fraction):
+    if len(sorted_values) == 0:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Run:
+
+    # one benchmark run: a fresh Behavior in a given State and LookAt, fed with the streams for duration seconds
+
+    START = 1.7e9  # simulated ROS time at which each run starts, a realistic epoch so time arithmetic is exercised at full magnitude
+
+    def __init__(self, behavior_module, args, streams, state, lookat, trace_allocations):
+        self.behavior_module = behavior_module
+        self.args = args
+        self.streams = streams
+        self.state = state
+        self.lookat = lookat
+        self.trace_allocations = trace_allocations
+        self.tick_times = []
+        self.callback_times = []
+        self.alloc_bytes = []
+        self.alloc_blocks = []
+        self.errors = 0
+        self.first_error = None
+        self.publishes = {}
+        self.final_state = None
+        self.final_lookat = None
+
+    def Setup(self):
+        _registry.reset()
+        _registry.params["/robot_name"] = ROBOT_NAME
+        _registry.params["/robots_config_dir"] = self.args.config_dir
+        _registry.params["/behavior/seed"] = self.args.seed
+        _registry.params["/behavior/animation_snapshot_dir"] = self.args.snapshot_dir
+        _registry.reconfigure_latency = self.args.reconfigure_latency / 1000.0
+        _clock.now = self.START
+        node = self.behavior_module.Behavior()
+        server = _registry.servers[-1]
+        changes = {"synthesizer_rate": self.args.rate, "keep_time": self.args.keep_time, "state": self.state, "profiling": self.args.profiling}
+        if self.args.fixed_rate:
+            # tick at synthesizer_rate in every State, and only then, like a plain rospy.Timer
+            for name in STATE_RATES:
+                changes[name] = self.args.rate
+            changes["perception_wakeup"] = False
+        server.update_configuration(changes)
+        if self.lookat != None:
+            server.update_configuration({"lookat_state": self.lookat})
+        if self.args.mirroring != None:
+            server.update_configuration({"mirroring_state": self.args.mirroring})
+        if not self.args.transitions:
+            # stay in the State being measured: no triggers, activity or decays move the robot elsewhere
+            server.update_configuration({"wake_threshold": 0.0})
+            node.transitions = [-1] * len(node.transitions)
+        for topic in _registry.publishers:
+            _registry.publishers[topic] = 0
+        return node
+
+    def Guard(self, function, *args):
+        try:
+            function(*args)
+        except Exception as exc:
+            self.errors += 1
+            if self.first_error == None:
+                self.first_error = "{}: {}".format(type(exc).__name__, exc)
+
+    def Tick(self, timer, t):
+        expected = timer.next_expected
+        event = TimerEvent(
+            Time(timer.last_expected) if timer.last_expected != None else None,
+            Time(timer.last_expected) if timer.last_expected != None else None,
+            Time(expected),
+            Time(t),
+            None)
+        timer.last_expected = expected
+        timer.next_expected = expected + timer.period
+        if timer.oneshot:
+            timer.active = False
+        self.Guard(timer.callback, event)
+
+    def Snapshot(self):
+        # traced blocks, without the ones of the snapshots themselves
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+    def TickClock(self, clock, t):
+        # one synthesizer tick, measured
+        if self.trace_allocations:
+            # blocks: allocated during the tick and still alive after it, summed over the allocation sites that grew
+            # (sys.getallocatedblocks only gives the net change, which goes negative when the tick frees more than it allocates)
+            # bytes: the peak of traced memory during the tick above what was traced before it
+            before = self.Snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            self.Guard(clock.Tick, t, t)
+            after, peak = tracemalloc.get_traced_memory()
+            self.alloc_bytes.append(max(0, peak - current))
+            stats = self.Snapshot().compare_to(before, "lineno")
+            self.alloc_blocks.append(sum(stat.count_diff for stat in stats if stat.count_diff > 0))
+        else:
+            start = perf_counter()
+            self.Guard(clock.Tick, t, t)
+            self.tick_times.append(perf_counter() - start)
+
+    def Deliver(self, topic, msg):
+        callbacks = _registry.subscribers.get(TOPICS[topic].format(ROBOT_NAME), [])
+        start = perf_counter()
+        for callback in callbacks:
+            self.Guard(callback, msg)
+        if not self.trace_allocations:
+            self.callback_times.append(perf_counter() - start)
+
+    def Execute(self):
+        # the node prints its state transitions, keep those out of the report
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            return self.Measure()
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+    def Measure(self):
+        node = self.Setup()
+        events = self.streams.Events(self.START, self.args.duration)
+        pending = next(events, None)
+        end = self.START + self.args.duration
+        gc.collect()
+        if self.trace_allocations:
+            tracemalloc.start()
+        while True:
+            # earliest active timer
+            timer = None
+            for candidate in _registry.timers:
+                if candidate.active and (timer == None or candidate.next_expected < timer.next_expected):
+                    timer = candidate
+            timer_t = timer.next_expected if timer != None else end
+            loop_t = node.tick_clock.Deadline(_clock.now)
+            message_t = self.START + pending[0] if pending != None else end
+            if min(timer_t, loop_t, message_t) >= end:
+                break
+            if pending != None and message_t <= min(timer_t, loop_t):
+                _clock.now = message_t
+                self.Deliver(pending[1], pending[2])
+                pending = next(events, None)
+            elif timer_t < loop_t:
+                _clock.now = timer_t
+                self.Tick(timer, timer_t)
+            else:
+                _clock.now = loop_t
+                self.TickClock(node.tick_clock, loop_t)
+        if self.trace_allocations:
+            tracemalloc.stop()
+        for handler in _registry.shutdown_handlers:
+            handler()
+        self.publishes = dict(_registry.publishers)
+        self.reconfigures = sum(client.updates for client in _registry.clients)
+        self.final_state = node.state
+        self.final_lookat = node.lookat
+        return self
+
+    def Result(self, names):
+        ticks = sorted(self.tick_times)
+        callbacks = sorted(self.callback_times)
+        result = {
+            "state": names["state"].get(self.state, self.state),
+            "lookat": names["lookat"].get(self.lookat, "-") if self.lookat != None else "-",
+            "final_state": names["state"].get(self.final_state, self.final_state),
+            "final_lookat": names["lookat"].get(self.final_lookat, self.final_lookat),
+            "ticks": len(ticks),
+            "tick_us": {
+                "mean": 1e6 * sum(ticks) / len(ticks) if len(ticks) > 0 else 0.0,
+                "p50": 1e6 * Percentile(ticks, 0.5),
+                "p90": 1e6 * Percentile(ticks, 0.9),
+                "p99": 1e6 * Percentile(ticks, 0.99),
+                "max": 1e6 * (ticks[-1] if len(ticks) > 0 else 0.0),
+            },
+            "callback_us": {
+                "p50": 1e6 * Percentile(callbacks, 0.5),
+                "p99": 1e6 * Percentile(callbacks, 0.99),
+            },
+            "publishes": self.publishes,
+            "reconfigures": self.reconfigures,
+            "errors": self.errors,
+            "first_error": self.first_error,
+        }
+        return result
+
+
+def EnumNames(cls):
+    return dict((value, name) for name, value in vars(cls).items() if not name.startswith("_") and isinstance(value, int))
+
+
+def ParseList(text, names):
+    if text == None:
+        return sorted(names.keys())
+    lookup = dict((name, value) for value, name in names.items())
+    return [lookup[name.strip().upper()] for name in text.split(",")]
+
+
+def Report(results, args, stream):
+    stream.write("behavior benchmark: {} sec. per run at {} Hz, keep_time {} sec.\n".format(args.duration, args.rate, args.keep_time))
+    header = "{:<11} {:<10} {:<21} {:>6} {:>8} {:>8} {:>8} {:>8} {:>8} {:>9} {:>7}  {}\n"
+    row = "{:<11} {:<10} {:<21} {:>6} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>8} {:>9} {:>7}  {}\n"
+    stream.write(header.format("state", "lookat", "final", "ticks", "p50 us", "p90 us", "p99 us", "max us", "blk/tick", "KB/tick", "errors", "publishes/tick"))
+    for result in results:
+        tick = result["tick_us"]
+        ticks = max(1, result["ticks"])
+        publishes = " ".join("{}={:.2f}".format(PUBLISHED_TOPICS[topic], float(count) / ticks)
+                             for topic, count in sorted(result["publishes"].items()) if topic in PUBLISHED_TOPICS and count > 0)
+        stream.write(row.format(
+            result["state"], result["lookat"], "{}/{}".format(result["final_state"], result["final_lookat"]), result["ticks"],
+            tick["p50"], tick["p90"], tick["p99"], tick["max"],
+            "{:.1f}".format(result["alloc_blocks"]) if result.get("alloc_blocks") != None else "n/a",
+            "{:.2f}".format(result["alloc_kb"]) if result.get("alloc_kb") != None else "n/a",
+            result["errors"], publishes))
+        if result["first_error"] != None:
+            stream.write("    first error: {}\n".format(result["first_error"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="offline replay and benchmark harness for Behavior.HandleTimer")
+    parser.add_argument("--duration", type=float, default=30.0, help="simulated seconds per run")
+    parser.add_argument("--rate", type=float, default=10.0, help="synthesizer_rate, the maximum tick rate (Hz.)")
+    parser.add_argument("--fixed-rate", action="store_true", help="tick at --rate in every State and ignore perception wake-ups, instead of the per State rates")
+    parser.add_argument("--keep-time", type=float, default=1.0, help="keep_time (sec.)")
+    parser.add_argument("--faces", type=int, default=5, help="number of synthetic faces")
+    parser.add_argument("--face-rate", type=float, default=20.0, help="CandidateFace frames per second (one message per face per frame)")
+    parser.add_argument("--hand-rate", type=float, default=10.0, help="CandidateHand messages per second")
+    parser.add_argument("--saliency-rate", type=float, default=20.0, help="CandidateSaliency messages per second")
+    parser.add_argument("--audio-rate", type=float, default=0.0, help="AudioDirection messages per second")
+    parser.add_argument("--motion-rate", type=float, default=0.0, help="MotionVector messages per second")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="steady", help="what the synthetic streams show (see perception_scenarios.py)")
+    parser.add_argument("--arrival-time", type=float, default=10.0, help="time over which the faces arrive in the crowd_arrival scenario (sec.)")
+    parser.add_argument("--states", help="comma separated State names (default: all)")
+    parser.add_argument("--lookats", help="comma separated LookAt names (default: all), or 'state' to keep the LookAt each State selects")
+    parser.add_argument("--transitions", action="store_true", help="let perception, activity and decays move the robot out of the State it starts in (default: hold the State, so each row measures the State it is labelled with)")
+    parser.add_argument("--mirroring", help="Mirroring name to set after the State (default: keep the one each State selects)")
+    parser.add_argument("--profiling", action="store_true", help="enable the behavior's own instrumentation (published on /diagnostics)")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the synthetic streams and the behavior's random source")
+    parser.add_argument("--reconfigure-latency", type=float, default=0.0, help="simulated vision pipeline reconfigure round trip (msec.)")
+    parser.add_argument("--config-dir", default=None, help="robots config dir (default: empty, so the default animations are used)")
+    parser.add_argument("--replay", help="replay a JSON lines recording instead of synthetic streams")
+    parser.add_argument("--record", help="write the synthetic streams to a JSON lines recording and exit")
+    parser.add_argument("--no-alloc", action="store_true", help="skip the allocation tracing pass")
+    parser.add_argument("--json", help="also write the results to this file as JSON")
+    args = parser.parse_args()
+
+    if args.record:
+        Record(SyntheticStreams(args, args.seed, sys.modules[__name__]), args.record, args.duration)
+        return
+
+    if args.config_dir == None:
+        args.config_dir = tempfile.mkdtemp(prefix="behavior_benchmark_")
+    # animation snapshots go to a directory of their own, not into ~/.ros or the robots config
+    args.snapshot_dir = tempfile.mkdtemp(prefix="behavior_benchmark_snapshots_")
+
+    InstallStandIns()
+    sys.path.insert(0, SCRIPTS_DIR)
+    import behavior
+    behavior.TickLoop.start = lambda self: None  # the tick clock is driven by Run.Measure, on simulated time
+    behavior.StateDisplay.start = lambda self: None  # and the states are not pushed back into the config server
+
+    names = {"state": EnumNames(behavior.State), "lookat": EnumNames(behavior.LookAt)}
+    if args.mirroring != None:
+        args.mirroring = ParseList(args.mirroring, EnumNames(behavior.Mirroring))[0]
+    states = ParseList(args.states, names["state"])
+    if args.lookats != None and args.lookats.strip().lower() == "state":
+        lookats = [None]
+    else:
+        lookats = ParseList(args.lookats, names["lookat"])
+
+    results = []
+    for state in states:
+        for lookat in lookats:
+
+            def streams():
+                if args.replay:
+                    return RecordedStreams(args.replay)
+                return SyntheticStreams(args, args.seed, sys.modules[__name__])
+
+            run = Run(behavior, args, streams(), state, lookat, False).Execute()
+            result = run.Result(names)
+            result["alloc_blocks"] = None
+            result["alloc_kb"] = None
+            if tracemalloc != None and not args.no_alloc:
+                traced = Run(behavior, args, streams(), state, lookat, True).Execute()
+                if len(traced.alloc_bytes) > 0:
+                    result["alloc_kb"] = sum(traced.alloc_bytes) / 1024.0 / len(traced.alloc_bytes)
+                if len(traced.alloc_blocks) > 0:
+                    result["alloc_blocks"] = float(sum(traced.alloc_blocks)) / len(traced.alloc_blocks)
+            results.append(result)
+
+    shutil.rmtree(args.snapshot_dir)
+
+    Report(results, args, sys.stdout)
+    if args.json:
+        with open(args.json, 'w') as stream:
+            json.dump({"args": vars(args), "results": results}, stream, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
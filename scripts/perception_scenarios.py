@@ -0,0 +1,199 @@
+# synthetic perception for the behavior node: faces, a hand, saliency, audio direction, motion and chat events as
+# one time-ordered stream of messages, following a scenario
+#
+# used by perception_simulator.py, which publishes the messages on the real topics, and by behavior_benchmark.py,
+# which feeds them to Behavior offline; each passes in its own message types (messages is anything that has
+# Float32XYZ, CandidateFace, CandidateHand, CandidateSaliency, AudioDirection, MotionVector, String and Time)
+#
+# scenarios:
+#   steady          faces slowly wandering around in front of the robot, a waving hand, random saliency, audio from
+#                   the first face and random motion, at the configured rates
+#   crowd_arrival   the faces walk in one by one over arrival_time seconds, with motion where they walk
+#   single_speaker  one face close in front that keeps talking to the robot (audio from it and chat events), the
+#                   other faces are quiet bystanders
+#   hand_waving     someone waving a hand wide and fast in front of the robot, with lots of motion around it
+#   silence         nobody there, only a little saliency and motion noise
+
+import heapq
+import math
+import random
+
+
+SCENARIOS = ["steady", "crowd_arrival", "single_speaker", "hand_waving", "silence"]
+
+# short topic names (used in recordings and reports) and the topics Behavior subscribes to
+TOPICS = {
+    "cface":     "/{}/perception/realsense/cface",
+    "chand":     "/{}/perception/realsense/chand",
+    "csaliency": "/{}/perception/wideangle/csaliency",
+    "audiodir":  "/{}/perception/acousticmagic/raw_audiodir",
+    "motion":    "/{}/perception/motion/raw_motion",
+    "chat":      "/{}/chat_events",
+    "speech":    "/{}/speech_events",
+}
+
+
+class SyntheticStreams:
+
+    # settings has the rates (faces, face_rate, hand_rate, saliency_rate, audio_rate, motion_rate), and optionally
+    # scenario and arrival_time; faces publish one CandidateFace per face per frame
+
+    def __init__(self, settings, seed, messages):
+        self.settings = settings
+        self.messages = messages
+        self.scenario = getattr(settings, "scenario", "steady")
+        if self.scenario not in SCENARIOS:
+            raise ValueError("unknown scenario {}".format(self.scenario))
+        self.arrival_time = getattr(settings, "arrival_time", 10.0)
+        self.faces = settings.faces
+        self.random = random.Random(seed)
+        self.face_phase = [self.random.uniform(0.0, 2.0 * math.pi) for i in range(self.faces)]
+        self.face_base = [(self.random.uniform(0.8, 2.5), self.random.uniform(-1.0, 1.0), self.random.uniform(-0.2, 0.3)) for i in range(self.faces)]
+        if self.scenario == "single_speaker" and self.faces > 0:
+            self.face_base[0] = (1.0, 0.0, 0.1)
+        self.start = 0.0
+
+    def Streams(self):
+        # (topic, rate, function generating the messages at time t)
+        settings = self.settings
+        streams = []
+        if self.scenario == "silence":
+            streams.append(("csaliency", 1.0, self.Saliency))
+            streams.append(("motion", 2.0, self.Motion))
+            return streams
+        if self.faces > 0 and settings.face_rate > 0.0:
+            streams.append(("cface", settings.face_rate, self.Faces))
+        if self.scenario == "hand_waving":
+            streams.append(("chand", settings.hand_rate or 30.0, self.Hand))
+        elif settings.hand_rate > 0.0 and self.scenario != "single_speaker":
+            streams.append(("chand", settings.hand_rate, self.Hand))
+        if settings.saliency_rate > 0.0:
+            streams.append(("csaliency", settings.saliency_rate, self.Saliency))
+        if self.scenario == "single_speaker":
+            streams.append(("audiodir", settings.audio_rate or 10.0, self.Audio))
+            streams.append(("chat", 0.2, self.Chat))
+        elif settings.audio_rate > 0.0:
+            streams.append(("audiodir", settings.audio_rate, self.Audio))
+        if self.scenario in ["crowd_arrival", "hand_waving"]:
+            streams.append(("motion", settings.motion_rate or 20.0, self.Motion))
+        elif settings.motion_rate > 0.0:
+            streams.append(("motion", settings.motion_rate, self.Motion))
+        return streams
+
+    def Arrived(self, t):
+        # number of faces that are there at time t, and how far (0..1) the last one has walked in
+        if self.scenario != "crowd_arrival" or self.faces == 0:
+            return self.faces, 1.0
+        interval = self.arrival_time / self.faces
+        arrived = min(self.faces, int((t - self.start) / interval) + 1)
+        return arrived, min(1.0, ((t - self.start) - (arrived - 1) * interval) / 2.0)
+
+    def FacePosition(self, i, t, walked):
+        x, y, z = self.face_base[i]
+        phase = self.face_phase[i] + 0.3 * t
+        if walked < 1.0:
+            # still walking in from the side
+            y += (1.0 - walked) * (2.0 if y > 0.0 else -2.0)
+        return x + 0.1 * math.sin(phase), y + 0.2 * math.sin(0.7 * phase), z
+
+    def Faces(self, t):
+        messages = []
+        arrived, walked = self.Arrived(t)
+        for i in range(arrived):
+            phase = self.face_phase[i] + 0.3 * t
+            x, y, z = self.FacePosition(i, t, walked if i == arrived - 1 else 1.0)
+            msg = self.messages.CandidateFace()
+            msg.cface_id = i + 1
+            msg.ts = self.messages.Time.from_sec(t)
+            msg.position = self.messages.Float32XYZ(x=x, y=y, z=z)
+            msg.confidence = 0.9
+            msg.left_brow = 0.5 + 0.3 * math.sin(2.0 * phase)
+            msg.right_brow = 0.5 + 0.3 * math.sin(2.0 * phase + 0.2)
+            msg.left_eyelid = 0.8 + 0.2 * math.sin(5.0 * phase)
+            msg.right_eyelid = 0.8 + 0.2 * math.sin(5.0 * phase + 0.1)
+            if self.scenario == "single_speaker":
+                # only the speaker moves their mouth, at speaking pace
+                msg.mouth_open = max(0.0, math.sin(20.0 * t)) if i == 0 else 0.0
+            else:
+                msg.mouth_open = max(0.0, math.sin(3.0 * phase))
+            messages.append(msg)
+        return messages
+
+    def HandPosition(self, t):
+        if self.scenario == "hand_waving":
+            return 0.6, 0.3 * math.sin(12.0 * t), 0.3
+        return 0.6, 0.2 * math.sin(4.0 * t), 0.1
+
+    def Hand(self, t):
+        x, y, z = self.HandPosition(t)
+        msg = self.messages.CandidateHand()
+        msg.chand_id = 1
+        msg.ts = self.messages.Time.from_sec(t)
+        msg.position = self.messages.Float32XYZ(x=x, y=y, z=z)
+        msg.confidence = 0.8
+        return [msg]
+
+    def Saliency(self, t):
+        azimuth = self.random.uniform(-1.0, 1.0)
+        elevation = self.random.uniform(-0.3, 0.3)
+        msg = self.messages.CandidateSaliency()
+        msg.ts = self.messages.Time.from_sec(t)
+        msg.direction = self.messages.Float32XYZ(x=math.cos(azimuth) * math.cos(elevation), y=math.sin(azimuth) * math.cos(elevation), z=math.sin(elevation))
+        if self.scenario == "silence":
+            msg.confidence = self.random.uniform(0.0, 0.2)
+        else:
+            msg.confidence = self.random.uniform(0.1, 1.0)
+        return [msg]
+
+    def Audio(self, t):
+        msg = self.messages.AudioDirection()
+        msg.ts = self.messages.Time.from_sec(t)
+        if self.faces > 0:
+            x, y, z = self.face_base[0]
+            msg.direction = math.atan2(y, x) + self.random.gauss(0.0, 0.05)
+        else:
+            msg.direction = self.random.uniform(-1.0, 1.0)
+        msg.confidence = 0.8
+        return [msg]
+
+    def Motion(self, t):
+        msg = self.messages.MotionVector()
+        msg.ts = self.messages.Time.from_sec(t)
+        if self.scenario == "crowd_arrival" and self.faces > 0:
+            # where the last face is walking in
+            arrived, walked = self.Arrived(t)
+            x, y, z = self.FacePosition(arrived - 1, t, walked)
+            msg.direction = self.messages.Float32XYZ(x=x, y=y, z=z)
+            msg.magnitude = 1.0 - walked + self.random.uniform(0.0, 0.2)
+        elif self.scenario == "hand_waving":
+            x, y, z = self.HandPosition(t)
+            msg.direction = self.messages.Float32XYZ(x=x, y=y + self.random.gauss(0.0, 0.05), z=z)
+            msg.magnitude = self.random.uniform(0.7, 1.0)
+        elif self.scenario == "silence":
+            msg.direction = self.messages.Float32XYZ(x=1.0, y=self.random.uniform(-1.0, 1.0), z=self.random.uniform(-0.3, 0.3))
+            msg.magnitude = self.random.uniform(0.0, 0.05)
+        else:
+            msg.direction = self.messages.Float32XYZ(x=1.0, y=self.random.uniform(-1.0, 1.0), z=self.random.uniform(-0.3, 0.3))
+            msg.magnitude = self.random.uniform(0.0, 1.0)
+        return [msg]
+
+    def Chat(self, t):
+        msg = self.messages.String()
+        msg.data = "hello robot"
+        return [msg]
+
+    def Events(self, start, duration):
+        # merge all streams into one time-ordered sequence of (t, topic, msg), with t relative to start
+        self.start = start
+        heap = []
+        streams = self.Streams()
+        for index, (topic, rate, generate) in enumerate(streams):
+            heapq.heappush(heap, (self.random.uniform(0.0, 1.0 / rate), index))
+        while len(heap) > 0:
+            t, index = heapq.heappop(heap)
+            if t >= duration:
+                continue
+            topic, rate, generate = streams[index]
+            for msg in generate(start + t):
+                yield (t, topic, msg)
+            heapq.heappush(heap, (t + 1.0 / rate, index))
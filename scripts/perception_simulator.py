@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# perception simulator for stress tests of the behavior node
+#
+# publishes synthetic CandidateFace, CandidateHand, CandidateSaliency, AudioDirection, MotionVector and chat event
+# streams (see perception_scenarios.py) on the topics the behavior node subscribes to, in real time, and logs how
+# many messages per second actually went out and how far behind schedule publishing got
+#
+# the behavior side reports its own throughput and latency on /diagnostics when profiling is enabled in its config
+# (tick times, inbox delays per callback, and a warning when ticks take longer than the synthesizer period), so
+# raising ~faces and ~face_rate until that warning shows finds the load at which HandleTimer misses its deadline
+#
+# parameters:
+#   ~scenario       steady, crowd_arrival, single_speaker, hand_waving or silence (default steady)
+#   ~faces          number of faces (default 5)
+#   ~face_rate      CandidateFace frames per second, one message per face per frame (default 20)
+#   ~hand_rate, ~saliency_rate, ~audio_rate, ~motion_rate   messages per second (default 10, 20, 0, 0)
+#   ~arrival_time   time over which the faces arrive in crowd_arrival (default 10 sec.)
+#   ~duration       stop after this many seconds, 0 is never (default 0)
+#   ~seed           seed for the random parts of the streams (default 1)
+#   ~report_period  time between throughput reports (default 5 sec.)
+#
+# examples:
+#   rosrun r2_behavior perception_simulator.py _scenario:=crowd_arrival _faces:=200 _face_rate:=30
+#   rosrun r2_behavior perception_simulator.py _scenario:=single_speaker _audio_rate:=100
+
+import collections
+import rospy
+from std_msgs.msg import String
+from r2_perception.msg import Float32XYZ, CandidateFace, CandidateHand, CandidateSaliency, AudioDirection, MotionVector
+
+from perception_scenarios import SCENARIOS, TOPICS, SyntheticStreams
+
+
+# message types for the scenarios
+class Messages:
+    Float32XYZ = Float32XYZ
+    CandidateFace = CandidateFace
+    CandidateHand = CandidateHand
+    CandidateSaliency = CandidateSaliency
+    AudioDirection = AudioDirection
+    MotionVector = MotionVector
+    String = String
+    Time = rospy.Time
+
+
+MESSAGE_TYPES = {
+    "cface": CandidateFace,
+    "chand": CandidateHand,
+    "csaliency": CandidateSaliency,
+    "audiodir": AudioDirection,
+    "motion": MotionVector,
+    "chat": String,
+    "speech": String,
+}
+
+
+class Settings:
+
+    # the stream settings, from the private parameters
+
+    def __init__(self):
+        self.scenario = rospy.get_param("~scenario", "steady")
+        self.faces = rospy.get_param("~faces", 5)
+        self.face_rate = rospy.get_param("~face_rate", 20.0)
+        self.hand_rate = rospy.get_param("~hand_rate", 10.0)
+        self.saliency_rate = rospy.get_param("~saliency_rate", 20.0)
+        self.audio_rate = rospy.get_param("~audio_rate", 0.0)
+        self.motion_rate = rospy.get_param("~motion_rate", 0.0)
+        self.arrival_time = rospy.get_param("~arrival_time", 10.0)
+
+
+class PerceptionSimulator:
+
+    def __init__(self):
+        self.robot_name = rospy.get_param("/robot_name")
+        self.settings = Settings()
+        if self.settings.scenario not in SCENARIOS:
+            raise ValueError("unknown scenario {}, use one of {}".format(self.settings.scenario, ", ".join(SCENARIOS)))
+        self.duration = rospy.get_param("~duration", 0.0)
+        self.report_period = rospy.get_param("~report_period", 5.0)
+        self.streams = SyntheticStreams(self.settings, rospy.get_param("~seed", 1), Messages)
+        self.publishers = {}
+        for topic in MESSAGE_TYPES:
+            self.publishers[topic] = rospy.Publisher(TOPICS[topic].format(self.robot_name), MESSAGE_TYPES[topic], queue_size=100)
+        self.counts = collections.defaultdict(int)  # topic -> messages published since the last report
+        self.lag = 0.0  # largest delay behind schedule since the last report (sec.)
+
+    def Report(self, period):
+        rates = ", ".join("{} {:.0f}/s".format(topic, self.counts[topic] / period) for topic in sorted(self.counts))
+        rospy.loginfo("perception simulator: {} ({:.1f} msec. behind at most)".format(rates or "nothing published", 1000.0 * self.lag))
+        self.counts.clear()
+        self.lag = 0.0
+
+    def Run(self):
+        # messages that are due at the same time (like all faces in one frame) go out back to back, and when
+        # publishing can't keep up, messages are sent late instead of dropped, so the lag shows the limit
+        duration = self.duration if self.duration > 0.0 else float("inf")
+        start = rospy.get_time()
+        last_report = start
+        for t, topic, msg in self.streams.Events(start, duration):
+            if rospy.is_shutdown():
+                break
+            now = rospy.get_time()
+            if start + t > now:
+                rospy.sleep(start + t - now)
+            else:
+                self.lag = max(self.lag, now - (start + t))
+            self.publishers[topic].publish(msg)
+            self.counts[topic] += 1
+            if now - last_report >= self.report_period:
+                self.Report(now - last_report)
+                last_report = now
+
+
+if __name__ == "__main__":
+    rospy.init_node('perception_simulator')
+    simulator = PerceptionSimulator()
+    rospy.sleep(1.0)  # give the subscribers time to connect
+    try:
+        simulator.Run()
+    except rospy.ROSInterruptException:
+        pass
@@ -0,0 +1,905 @@
+#!/usr/bin/env python
+# unit tests for the behavior synthesizer's data structures and state table
+#
+# behavior.py is imported with the stand-ins from behavior_benchmark.py instead of the real ROS modules, so these run
+# without a robot or a ROS master:
+#
+#   python -m unittest discover -s test
+#
+# or as part of the package tests with catkin_make run_tests
+
+import math
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+import yaml
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts')
+sys.path.insert(0, SCRIPTS_DIR)
+
+import behavior_benchmark
+behavior_benchmark.InstallStandIns()
+
+import behavior
+from behavior_benchmark import Time, Float32XYZ, CandidateFace, AudioDirection
+from perception_scenarios import TOPICS
+
+PIPELINES = ["lefteye", "righteye", "wideangle", "realsense"]
+
+
+def Face(cface_id, ts, azimuth=0.0):
+    return CandidateFace(cface_id=cface_id, ts=Time(ts), position=Float32XYZ(math.cos(azimuth), math.sin(azimuth), 0.0))
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_pops_due_events_in_deadline_order(self):
+        scheduler = behavior.Scheduler()
+        a, b, c = object(), object(), object()
+        scheduler.Schedule(b, 2.0)
+        scheduler.Schedule(a, 1.0)
+        scheduler.Schedule(c, 3.0)
+        self.assertEqual(scheduler.Next(), 1.0)
+        self.assertIs(scheduler.Pop(2.5), a)
+        self.assertIs(scheduler.Pop(2.5), b)
+        self.assertIsNone(scheduler.Pop(2.5))
+        self.assertEqual(len(scheduler), 1)
+
+    def test_rescheduling_moves_the_event(self):
+        scheduler = behavior.Scheduler()
+        a = object()
+        scheduler.Schedule(a, 1.0)
+        scheduler.Schedule(a, 3.0)
+        self.assertEqual(len(scheduler), 1)
+        self.assertIsNone(scheduler.Pop(2.0))
+        self.assertEqual(scheduler.Next(), 3.0)
+        self.assertIs(scheduler.Pop(3.0), a)
+        self.assertIsNone(scheduler.Pop(10.0))
+
+    def test_rescheduling_back_to_the_old_deadline_fires_once(self):
+        scheduler = behavior.Scheduler()
+        a = object()
+        scheduler.Schedule(a, 1.0)
+        scheduler.Schedule(a, 2.0)
+        scheduler.Schedule(a, 1.0)
+        self.assertIs(scheduler.Pop(5.0), a)
+        self.assertIsNone(scheduler.Pop(5.0))
+
+    def test_cancel(self):
+        scheduler = behavior.Scheduler()
+        a = object()
+        scheduler.Schedule(a, 1.0)
+        scheduler.Cancel(a)
+        self.assertFalse(scheduler.Pending(a))
+        self.assertIsNone(scheduler.Next())
+        self.assertIsNone(scheduler.Pop(5.0))
+
+    def test_heap_is_compacted(self):
+        scheduler = behavior.Scheduler()
+        a = object()
+        for i in range(1000):
+            scheduler.Schedule(a, float(i))
+        self.assertLess(len(scheduler.heap), 100)
+        self.assertEqual(scheduler.Next(), 999.0)
+
+
+class SaliencyBufferTest(unittest.TestCase):
+
+    def test_expire(self):
+        buffer = behavior.SaliencyBuffer(8)
+        for ts in [1.0, 2.0, 3.0]:
+            buffer.Add(ts, Float32XYZ(1.0, 0.0, 0.0))
+        buffer.Next()
+        buffer.Expire(2.5)
+        self.assertEqual(len(buffer), 1)
+        self.assertEqual(buffer.Oldest(), 3.0)
+        self.assertEqual(buffer.current, buffer.tail)
+        buffer.Expire(4.0)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(buffer.current, -1)
+        self.assertEqual(buffer.Oldest(), float("inf"))
+
+    def test_full_buffer_overwrites_the_oldest(self):
+        buffer = behavior.SaliencyBuffer(2)
+        for ts in [1.0, 2.0, 3.0]:
+            buffer.Add(ts, Float32XYZ(ts, 0.0, 0.0))
+        self.assertEqual(len(buffer), 2)
+        self.assertEqual(buffer.Oldest(), 2.0)
+        # the current vector stays valid when its slot is overwritten
+        self.assertEqual(buffer.Direction()[0], 2.0)
+        buffer.Next()
+        self.assertEqual(buffer.Direction()[0], 3.0)
+        buffer.Next()
+        self.assertEqual(buffer.Direction()[0], 2.0)
+
+
+class FaceTableTest(unittest.TestCase):
+
+    def test_round_robin_in_order_of_arrival(self):
+        faces = behavior.FaceTable(8)
+        for cface_id in [5, 3, 9]:
+            faces.Update(Face(cface_id, 1.0))
+        self.assertEqual(faces.First(), 5)
+        self.assertEqual(faces.Next(5), 3)
+        self.assertEqual(faces.Next(3), 9)
+        self.assertEqual(faces.Next(9), 5)
+        self.assertEqual(faces.Next(42), 5)
+
+    def test_expire_removes_faces_not_updated_since(self):
+        faces = behavior.FaceTable(8)
+        for cface_id in [1, 2, 3]:
+            faces.Update(Face(cface_id, float(cface_id)))
+        faces.Update(Face(1, 10.0))
+        faces.Expire(5.0)
+        self.assertEqual(len(faces), 1)
+        self.assertIn(1, faces)
+        self.assertEqual(faces.Oldest(), 10.0)
+        faces.Expire(11.0)
+        self.assertEqual(len(faces), 0)
+        self.assertEqual(faces.First(), 0)
+
+    def test_full_table_drops_the_least_recently_updated(self):
+        faces = behavior.FaceTable(2)
+        faces.Update(Face(1, 1.0))
+        faces.Update(Face(2, 2.0))
+        faces.Update(Face(1, 3.0))
+        faces.Update(Face(3, 4.0))
+        self.assertEqual(sorted(faces.slots), [1, 3])
+
+
+class MotionTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tracker = behavior.MotionTracker(2)
+        self.tracker.fresh[0] = True
+
+    def Measure(self, ts, y):
+        self.tracker.measured[0] = (1.0, y, 0.0)
+        self.tracker.measured_ts[0] = ts
+        return self.tracker.Predict(ts)[0, 1]
+
+    def Walk(self, until):
+        # 0.25 m/s sideways at 20 Hz
+        for i in range(int(until * 20) + 1):
+            self.Measure(0.05 * i, 0.25 * 0.05 * i)
+
+    def test_follows_constant_velocity(self):
+        self.Walk(3.0)
+        self.assertAlmostEqual(self.tracker.velocity[0, 1], 0.25, delta=0.02)
+        self.assertAlmostEqual(self.tracker.Predict(3.2)[0, 1], 0.8, delta=0.02)
+
+    def test_extrapolation_is_limited_to_the_horizon(self):
+        self.Walk(3.0)
+        self.assertAlmostEqual(self.tracker.Predict(13.0)[0, 1], 0.75 + 0.25 * self.tracker.horizon, delta=0.02)
+
+    def test_track_starts_over_after_a_gap(self):
+        self.Walk(3.8)
+        self.assertAlmostEqual(self.Measure(13.8, 0.95), 0.95)
+        self.assertEqual(self.tracker.velocity[0, 1], 0.0)
+
+    def test_out_of_order_measurements_are_ignored(self):
+        self.Walk(3.0)
+        position = self.tracker.position[0].copy()
+        # while another slot gets a newer measurement
+        self.tracker.fresh[1] = True
+        self.tracker.measured_ts[1] = 3.0
+        self.tracker.Predict(3.0)
+        self.tracker.measured_ts[1] = 3.05
+        self.Measure(2.5, 0.0)
+        self.assertTrue((self.tracker.position[0] == position).all())
+
+
+class TargetPublisherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.publisher = behavior.TargetPublisher('/test/target', 0.005, 20.0)
+        self.publisher.Publish([1.0, 0.0, 0.0], 3.0, 100.0)
+
+    def test_first_target_is_sent(self):
+        self.assertEqual(self.publisher.sent, 1)
+        self.assertEqual((self.publisher.msg.x, self.publisher.msg.speed), (1.0, 3.0))
+
+    def test_small_moves_are_suppressed(self):
+        self.publisher.Publish([1.0, 0.004, 0.0], 3.0, 101.0)
+        self.assertEqual((self.publisher.sent, self.publisher.suppressed), (1, 1))
+        self.publisher.Publish([1.0, 0.006, 0.0], 3.0, 102.0)
+        self.assertEqual(self.publisher.sent, 2)
+
+    def test_moves_are_rate_capped(self):
+        self.publisher.Publish([1.0, 0.1, 0.0], 3.0, 100.01)
+        self.assertEqual(self.publisher.sent, 1)
+        self.publisher.Publish([1.0, 0.1, 0.0], 3.0, 100.06)
+        self.assertEqual(self.publisher.sent, 2)
+        self.assertEqual(self.publisher.msg.y, 0.1)
+
+    def test_speed_changes_are_rate_capped(self):
+        for now in [100.01, 100.02, 100.03]:
+            self.publisher.Publish([1.0, 0.0, 0.0], 5.0 if now < 100.025 else 3.0, now)
+        self.assertEqual(self.publisher.sent, 1)
+        self.publisher.Publish([1.0, 0.0, 0.0], 5.0, 100.06)
+        self.assertEqual(self.publisher.sent, 2)
+        self.assertEqual(self.publisher.msg.speed, 5.0)
+
+
+class MirroringFilterTest(unittest.TestCase):
+
+    def Filter(self, kind):
+        mirroring_filter = behavior.MirroringFilter(2)
+        mirroring_filter.kind = kind
+        mirroring_filter.Step([0.0, 1.0], 0.01)
+        return mirroring_filter
+
+    def Ramp(self, kind):
+        # the lag behind a feature moving at 1 per sec.
+        mirroring_filter = self.Filter(kind)
+        for i in range(1, 101):
+            value = mirroring_filter.Step([0.01 * i, 1.0], 0.01)
+        return 1.0 - value[0]
+
+    def test_first_step_takes_the_target(self):
+        for kind in [behavior.MirroringFilter.EMA, behavior.MirroringFilter.ONE_EURO, behavior.MirroringFilter.SPRING]:
+            mirroring_filter = self.Filter(kind)
+            np.testing.assert_array_equal(mirroring_filter.value, [0.0, 1.0])
+            mirroring_filter.Reset()
+            np.testing.assert_array_equal(mirroring_filter.Step([0.5, 0.5], 0.01), [0.5, 0.5])
+
+    def test_none_follows_the_target(self):
+        mirroring_filter = self.Filter(behavior.MirroringFilter.NONE)
+        np.testing.assert_array_equal(mirroring_filter.Step([1.0, 0.0], 0.01), [1.0, 0.0])
+
+    def test_ema_step(self):
+        mirroring_filter = self.Filter(behavior.MirroringFilter.EMA)
+        alpha = 1.0 - math.exp(-2.0 * math.pi * mirroring_filter.cutoff * 0.01)
+        np.testing.assert_allclose(mirroring_filter.Step([1.0, 1.0], 0.01), [alpha, 1.0])
+
+    def test_one_euro_lags_less_than_ema_on_fast_moves(self):
+        ema = self.Ramp(behavior.MirroringFilter.EMA)
+        one_euro = self.Ramp(behavior.MirroringFilter.ONE_EURO)
+        self.assertGreater(ema, 0.0)
+        self.assertLess(one_euro, ema)
+
+    def test_spring_settles_without_overshoot(self):
+        mirroring_filter = self.Filter(behavior.MirroringFilter.SPRING)
+        previous = 0.0
+        for i in range(200):
+            value = mirroring_filter.Step([1.0, 1.0], 0.01)[0]
+            self.assertGreaterEqual(value, previous)
+            self.assertLessEqual(value, 1.0)
+            previous = value
+        self.assertAlmostEqual(previous, 1.0, places=6)
+
+    def test_spring_steps_do_not_depend_on_the_rate(self):
+        coarse = self.Filter(behavior.MirroringFilter.SPRING)
+        fine = self.Filter(behavior.MirroringFilter.SPRING)
+        coarse.Step([1.0, 0.0], 0.1)
+        for i in range(10):
+            fine.Step([1.0, 0.0], 0.01)
+        np.testing.assert_allclose(fine.value, coarse.value)
+        np.testing.assert_allclose(fine.velocity, coarse.velocity)
+
+
+class TickClockTest(unittest.TestCase):
+
+    def setUp(self):
+        behavior_benchmark._clock.now = 100.0
+        self.next_event = None
+        self.events = []
+        self.clock = behavior.TickClock(self.events.append, lambda: self.next_event, 2.0, 10.0)
+
+    def test_ticks_at_the_rate(self):
+        self.assertAlmostEqual(self.clock.Deadline(100.1), 100.5)
+        self.clock.rate = 5.0
+        self.assertAlmostEqual(self.clock.Deadline(100.1), 100.2)
+
+    def test_ticks_for_the_next_event(self):
+        self.next_event = 100.3
+        self.assertAlmostEqual(self.clock.Deadline(100.1), 100.3)
+        self.next_event = 100.01
+        self.assertAlmostEqual(self.clock.Deadline(100.001), 100.1)
+
+    def test_wake_ticks_right_away_but_not_faster_than_max_rate(self):
+        self.clock.Wake()
+        self.assertAlmostEqual(self.clock.Deadline(100.3), 100.3)
+        self.assertAlmostEqual(self.clock.Deadline(100.05), 100.1)
+        self.clock.Tick(100.3, 100.3)
+        self.assertFalse(self.clock.woken)
+        self.assertAlmostEqual(self.clock.Deadline(100.31), 100.8)
+
+    def test_time_jumping_back_restarts_the_period(self):
+        self.assertAlmostEqual(self.clock.Deadline(50.0), 50.5)
+
+    def test_missed_ticks_are_not_caught_up(self):
+        self.clock.Tick(100.5, 100.6)
+        self.assertAlmostEqual(self.clock.last, 100.5)
+        self.clock.Tick(101.0, 105.0)
+        self.assertAlmostEqual(self.clock.last, 105.0)
+        self.assertEqual(self.events[-1].current_expected.to_sec(), 105.0)
+        self.assertEqual(self.events[-1].last_expected.to_sec(), 100.5)
+
+    def test_failed_tick_still_counts(self):
+        def Fail(event):
+            raise RuntimeError("tick")
+        self.clock.callback = Fail
+        self.assertRaises(RuntimeError, self.clock.Tick, 100.5, 100.5)
+        self.assertAlmostEqual(self.clock.Deadline(100.5), 101.0)
+
+
+class AnimationSamplerTest(unittest.TestCase):
+
+    def Sampler(self, probabilities):
+        return behavior.AnimationSampler([behavior.Gesture({"name": str(i), "probability": p, "magnitude_min": 0.0, "magnitude_max": 1.0, "speed_min": 1.0, "speed_max": 1.0})
+                                          for i, p in enumerate(probabilities)])
+
+    def Frequencies(self, sampler, count):
+        rng = behavior.RandomSource(1)
+        frequencies = {}
+        for i in range(count):
+            record = sampler.Select(rng)
+            name = record.name if record != None else None
+            frequencies[name] = frequencies.get(name, 0) + 1.0 / count
+        return frequencies
+
+    def test_empty_list_never_fires(self):
+        self.assertIsNone(self.Sampler([]).Select(behavior.RandomSource(1)))
+
+    def test_matches_rolling_every_entry(self):
+        # two entries at 0.5: nothing fires 1/4 of the time, otherwise each is picked half of the time
+        frequencies = self.Frequencies(self.Sampler([0.5, 0.5, 0.0]), 20000)
+        self.assertAlmostEqual(frequencies.get(None, 0.0), 0.25, delta=0.02)
+        self.assertAlmostEqual(frequencies.get("0", 0.0), 0.375, delta=0.02)
+        self.assertAlmostEqual(frequencies.get("1", 0.0), 0.375, delta=0.02)
+        self.assertNotIn("2", frequencies)
+
+    def test_certain_entries_always_fire(self):
+        frequencies = self.Frequencies(self.Sampler([1.0, 1.0]), 2000)
+        self.assertNotIn(None, frequencies)
+
+
+class AnimationCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="test_behavior_")
+        self.path = os.path.join(self.dir, 'anim.yaml')
+        self.validated = []
+        self.Write({"idle_gestures": []})
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def Write(self, data):
+        with open(self.path, 'w') as stream:
+            yaml.safe_dump(data, stream)
+
+    def Cache(self):
+        return behavior.AnimationCache(os.path.join(self.dir, 'snapshots'), lambda data: self.validated.append(data) or data, lambda data: ("compiled", data))
+
+    def test_unchanged_file_is_not_parsed_again(self):
+        cache = self.Cache()
+        compiled = cache.Compiled(self.path)
+        self.assertEqual(compiled, ("compiled", {"idle_gestures": []}))
+        self.assertIs(cache.Compiled(self.path), compiled)
+        self.assertEqual(len(self.validated), 1)
+
+    def test_changed_file_is_loaded_again(self):
+        cache = self.Cache()
+        cache.Load(self.path)
+        self.Write({"idle_gestures": [], "idle_expressions": []})
+        stat = os.stat(self.path)
+        os.utime(self.path, (stat.st_atime, stat.st_mtime + 1.0))
+        self.assertEqual(cache.Load(self.path), {"idle_gestures": [], "idle_expressions": []})
+        self.assertEqual(len(self.validated), 2)
+
+    def test_snapshot_skips_parsing_and_validation(self):
+        self.Cache().Load(self.path)
+        self.assertEqual(self.Cache().Load(self.path), {"idle_gestures": []})
+        self.assertEqual(len(self.validated), 1)
+
+    def test_invalid_file_raises(self):
+        cache = behavior.AnimationCache(os.path.join(self.dir, 'snapshots'), lambda data: behavior.ValidateAnimations(data, {}, {}), lambda data: data)
+        self.assertRaises(ValueError, cache.Load, self.path)
+
+
+class ValidateAnimationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.schemas = []
+        for name in ['r2_behavior_anim.default.yaml', 'gestures_schema.yaml', 'expressions_schema.yaml']:
+            with open(os.path.join(behavior.CFG_DIR, name)) as stream:
+                self.schemas.append(yaml.safe_load(stream))
+        self.data = self.schemas.pop(0)
+
+    def Validate(self):
+        return behavior.ValidateAnimations(self.data, *self.schemas)
+
+    def test_default_animations(self):
+        self.assertEqual(self.Validate(), self.data)
+
+    def test_accepts_the_legacy_presenting_gestures(self):
+        gestures = self.data["presenting_gestures"]
+        self.data["presenting__gestures"] = self.data.pop("presenting_gestures")
+        animations = self.Validate()
+        self.assertEqual(animations["presenting_gestures"], gestures)
+        self.assertNotIn("presenting__gestures", animations)
+
+    def test_rejects_unknown_names(self):
+        self.data["presenting__expressions"] = self.data.pop("presenting_expressions")
+        self.assertRaises(ValueError, self.Validate)
+
+
+class CompileStatesTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(os.path.join(behavior.CFG_DIR, 'r2_behavior_states.yaml')) as stream:
+            self.data = yaml.safe_load(stream)
+
+    def test_default_states(self):
+        entries, transitions = behavior.CompileStates(self.data, PIPELINES)
+        count = len(entries)
+        self.assertEqual(entries[behavior.State.FOCUSED].lookat, behavior.LookAt.HAND)
+        self.assertEqual(transitions[behavior.Trigger.HAND * count + behavior.State.IDLE], behavior.State.FOCUSED)
+        self.assertEqual(transitions[behavior.Trigger.HAND * count + behavior.State.SPEAKING], -1)
+
+    def test_rejects_unknown_names(self):
+        for state, key, value in [("idle", "pipelines", {"wideangel": [1.0, 1.0]}),
+                                  ("focused", "gestures", "focussed_gestures"),
+                                  ("focused", "gestures", None),
+                                  ("focused", "expressions", None),
+                                  ("focused", "lookat", "HANDS"),
+                                  ("focused", "enter", ["hand_decays"])]:
+            data = yaml.safe_load(yaml.safe_dump(self.data))
+            data["states"][state][key] = value
+            self.assertRaises(ValueError, behavior.CompileStates, data, PIPELINES)
+
+    def test_rejects_missing_states(self):
+        del self.data["states"]["presenting"]
+        self.assertRaises(ValueError, behavior.CompileStates, self.data, PIPELINES)
+
+
+class PipelineWorkerTest(unittest.TestCase):
+
+    # a client that records the configurations, and holds each update until it is released
+
+    def setUp(self):
+        self.updates = []
+        self.busy = threading.Event()
+        self.release = threading.Semaphore(0)
+        self.worker = behavior.PipelineWorker("test", lambda: self, False, lambda name, duration: None)
+        self.assertTrue(self.worker.connected.wait(5.0))
+
+    def tearDown(self):
+        self.worker.Shutdown()
+        for _ in range(10):
+            self.release.release()
+
+    def update_configuration(self, config):
+        self.busy.set()
+        self.release.acquire()
+        self.updates.append(config)
+
+    def Applied(self, config):
+        deadline = time.time() + 5.0
+        while self.worker.applied != config and time.time() < deadline:
+            time.sleep(0.001)
+        self.assertEqual(self.worker.applied, config)
+
+    def test_requests_during_an_update_are_coalesced(self):
+        self.worker.Request({"pipeline_rate": 1.0})
+        self.assertTrue(self.busy.wait(5.0))
+        for rate in [2.0, 3.0, 4.0]:
+            self.worker.Request({"pipeline_rate": rate})
+        self.release.release()
+        self.release.release()
+        self.Applied({"pipeline_rate": 4.0})
+        self.assertEqual(self.updates, [{"pipeline_rate": 1.0}, {"pipeline_rate": 4.0}])
+
+    def test_unchanged_configuration_is_not_sent_again(self):
+        self.release.release()
+        self.worker.Request({"pipeline_rate": 1.0})
+        self.Applied({"pipeline_rate": 1.0})
+        self.worker.Request({"pipeline_rate": 1.0})
+        self.release.release()
+        self.worker.Request({"pipeline_rate": 2.0})
+        self.Applied({"pipeline_rate": 2.0})
+        self.assertEqual(self.updates, [{"pipeline_rate": 1.0}, {"pipeline_rate": 2.0}])
+
+
+class StateDisplayTest(unittest.TestCase):
+
+    # the server echoes every update it takes back through Shown, like the dynamic_reconfigure server does
+
+    SHOWN = {"eyecontact_state": 0, "lookat_state": 0, "mirroring_state": 0, "gaze_state": 0, "state": 0}
+
+    def setUp(self):
+        self.updates = []
+        self.busy = threading.Event()
+        self.release = threading.Semaphore(0)
+        self.display = behavior.StateDisplay(self.Update, 1000.0)
+        self.display.Shown(behavior_benchmark.Config(self.SHOWN))
+
+    def tearDown(self):
+        self.display.Shutdown()
+        for _ in range(10):
+            self.release.release()
+
+    def Update(self, fields):
+        self.busy.set()
+        self.release.acquire()
+        self.updates.append(fields)
+
+    def Sent(self, count):
+        deadline = time.time() + 5.0
+        while self.display.sent < count and time.time() < deadline:
+            time.sleep(0.001)
+        self.assertEqual(self.display.sent, count)
+
+    def Config(self, **fields):
+        config = dict(self.SHOWN)
+        config.update(fields)
+        return behavior_benchmark.Config(config)
+
+    def test_only_changed_fields_are_sent(self):
+        self.release.release()
+        self.display.Show({"state": 2, "lookat_state": 0})
+        self.Sent(1)
+        self.assertEqual(self.updates, [{"state": 2}])
+
+    def test_echo_is_not_a_change_when_the_robot_moved_on(self):
+        self.display.Show({"state": 2})
+        self.assertTrue(self.busy.wait(5.0))
+        # the robot moves on while the update is sent, and the echo of the update comes in during the send
+        self.display.Show({"state": 3})
+        self.assertEqual(self.display.Shown(self.Config(state=2)), [])
+        self.release.release()
+        self.release.release()
+        self.Sent(2)
+        self.assertEqual(self.updates, [{"state": 2}, {"state": 3}])
+
+    def test_outside_change_is_kept(self):
+        self.display.Show({"state": 2})
+        self.assertTrue(self.busy.wait(5.0))
+        self.assertEqual(self.display.Shown(self.Config(state=2, lookat_state=4)), ["lookat_state"])
+        self.release.release()
+        self.Sent(1)
+        self.display.Show({"state": 3})
+        self.release.release()
+        self.Sent(2)
+        self.assertEqual(self.updates, [{"state": 2}, {"state": 3}])
+
+
+class PipelineGovernorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.governor = behavior.PipelineGovernor()
+
+    def tearDown(self):
+        self.governor.Shutdown()
+
+    def test_waits_until_all_pipelines_are_connected(self):
+        for name in PIPELINES:
+            self.governor.Add(name, object)
+        self.governor.WaitConnected(5.0)
+        self.assertTrue(all(worker.connected.is_set() for worker in self.governor.workers.values()))
+
+    def test_gives_up_on_a_pipeline_that_never_comes_up(self):
+        def Unreachable():
+            raise behavior.rospy.ROSException("unreachable")
+        self.governor.Add("lefteye", object)
+        self.governor.Add("realsense", Unreachable)
+        with self.assertRaises(behavior.rospy.ROSException) as context:
+            self.governor.WaitConnected(0.2)
+        self.assertIn("realsense", str(context.exception))
+        self.assertNotIn("lefteye", str(context.exception))
+
+
+class NodeTest(unittest.TestCase):
+
+    # a whole Behavior on the stand-ins, ticked by hand, in state IDLE
+    # with STATES set, that is the robot's own r2_behavior_states.yaml
+
+    STATES = None
+
+    def setUp(self):
+        self.Prepare()
+        self.node = behavior.Behavior()
+        self.server = behavior_benchmark._registry.servers[-1]
+        self.server.update_configuration({"state": behavior.State.IDLE})
+        self.Tick()
+        self.entered = []
+        set_state = self.node.SetState
+        self.node.SetState = lambda state: (self.entered.append(state), set_state(state))
+
+    def Prepare(self):
+        # the parameters, and no threads: the test ticks
+        self.config_dir = tempfile.mkdtemp(prefix="test_behavior_")
+        if self.STATES != None:
+            os.makedirs(os.path.join(self.config_dir, 'heads', 'test'))
+            with open(os.path.join(self.config_dir, 'heads', 'test', 'r2_behavior_states.yaml'), 'w') as stream:
+                yaml.safe_dump(self.STATES, stream)
+        self.start = behavior.TickLoop.start, behavior.StateDisplay.start, behavior.AnimationWatcher.start
+        behavior.TickLoop.start = lambda self: None
+        behavior.StateDisplay.start = lambda self: None
+        behavior.AnimationWatcher.start = lambda self: None
+        registry = behavior_benchmark._registry
+        registry.reset()
+        registry.params["/robot_name"] = "test"
+        registry.params["/robots_config_dir"] = self.config_dir
+        registry.params["/behavior/animation_snapshot_dir"] = os.path.join(self.config_dir, 'snapshots')
+        behavior_benchmark._clock.now = 1.7e9
+
+    def tearDown(self):
+        for handler in behavior_benchmark._registry.shutdown_handlers:
+            handler()
+        behavior.TickLoop.start, behavior.StateDisplay.start, behavior.AnimationWatcher.start = self.start
+        shutil.rmtree(self.config_dir)
+
+    def Tick(self, dt=0.1):
+        behavior_benchmark._clock.now += dt
+        self.node.tick_clock.Tick(behavior_benchmark._clock.now, behavior_benchmark._clock.now)
+
+    def Deliver(self, topic, msg):
+        for callback in behavior_benchmark._registry.subscribers[TOPICS[topic].format("test")]:
+            callback(msg)
+
+
+class TransitionTest(NodeTest):
+
+    def Post(self, trigger):
+        self.node.inbox.Post(lambda msg, received: self.node.Fire(trigger), None)
+
+    def test_transitions_in_one_tick_are_collapsed(self):
+        self.assertEqual(self.node.state, behavior.State.IDLE)
+        self.Post(behavior.Trigger.SALIENCY)
+        self.Post(behavior.Trigger.HAND)
+        self.Tick()
+        self.assertEqual(self.entered, [behavior.State.FOCUSED])
+        self.assertEqual(self.node.state, behavior.State.FOCUSED)
+
+    def test_transitions_back_to_the_same_state_enter_nothing(self):
+        self.Post(behavior.Trigger.CHAT)
+        self.Post(behavior.Trigger.TALK_LOST)
+        self.Tick()
+        self.assertEqual(self.entered, [])
+        self.assertEqual(self.node.state, behavior.State.IDLE)
+
+    def test_triggers_without_transition_are_ignored(self):
+        self.Post(behavior.Trigger.SPEECH_STOP)
+        self.Tick()
+        self.assertEqual(self.entered, [])
+        self.assertEqual(self.node.state, behavior.State.IDLE)
+
+
+class AwarenessGridTest(unittest.TestCase):
+
+    def setUp(self):
+        self.grid = behavior.AwarenessGrid(16, 5, 1.2, 0.4)
+
+    def test_activity_decays(self):
+        self.grid.Add(1.0, 0.0, 0.0, 1.0, 1000.0)
+        self.assertAlmostEqual(self.grid.Activity(1000.0), 1.0)
+        self.assertAlmostEqual(self.grid.Activity(1002.0), math.exp(-1.0))
+
+    def test_scale_does_not_overflow(self):
+        for ts in [1.7e9, 1.7e9 + 1000.0]:
+            self.grid.Add(1.0, 0.0, 0.0, 1.0, ts)
+        self.assertAlmostEqual(self.grid.Activity(1.7e9 + 1000.0), 1.0)
+        self.assertTrue(np.isfinite(self.grid.grid).all())
+
+    def test_set_decay_keeps_the_activity(self):
+        self.grid.Add(1.0, 0.0, 0.0, 1.0, 1000.0)
+        self.grid.SetDecay(4.0, 1002.0)
+        self.assertAlmostEqual(self.grid.Activity(1002.0), math.exp(-1.0))
+        self.assertAlmostEqual(self.grid.Activity(1006.0), math.exp(-2.0))
+
+    def test_emptiest_avoids_activity(self):
+        straight = self.grid.Emptiest(1000.0)
+        self.assertGreater(straight[0], 0.99)
+        self.grid.Add(straight[0], straight[1], straight[2], 1.0, 1000.0)
+        self.assertLess(np.dot(self.grid.Emptiest(1000.0), straight), 0.999)
+
+
+class AudienceModelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.audience = behavior.AudienceModel(3)
+
+    def Look(self, azimuth, ts, weight=1.0):
+        self.audience.Add(math.cos(azimuth), math.sin(azimuth), 0.0, weight, ts)
+
+    def Regions(self, now):
+        # azimuths of the regions that are not forgotten, in the order Next visits them
+        regions = []
+        for i in range(self.audience.capacity):
+            self.audience.Next(now)
+            if self.audience.current < 0 or self.audience.current in [region for region, azimuth in regions]:
+                break
+            direction = self.audience.Direction()
+            regions.append((self.audience.current, math.atan2(direction[1], direction[0])))
+        return sorted(azimuth for region, azimuth in regions)
+
+    def test_nearby_directions_join_a_region(self):
+        self.Look(0.0, 1000.0)
+        self.Look(0.1, 1000.0)
+        self.Look(1.0, 1000.0)
+        regions = self.Regions(1000.0)
+        self.assertEqual(len(regions), 2)
+        self.assertAlmostEqual(regions[0], 0.05, places=3)
+        self.assertAlmostEqual(regions[1], 1.0)
+
+    def test_regions_are_forgotten(self):
+        self.Look(0.0, 1000.0)
+        self.Look(1.0, 1020.0)
+        # the first region decayed to exp(-3) and the second to exp(-1) by then, so only the second is above the minimum
+        regions = self.Regions(1030.0)
+        self.assertEqual(len(regions), 1)
+        self.assertAlmostEqual(regions[0], 1.0)
+        self.Look(-1.0, 1030.0)
+        self.assertEqual(len(self.Regions(1030.0)), 2)
+        self.audience.Next(1100.0)
+        self.assertIsNone(self.audience.Direction())
+
+    def test_scale_does_not_overflow(self):
+        self.Look(0.0, 1.7e9)
+        self.Look(1.0, 1.7e9 + 1000.0)
+        self.assertTrue(np.isfinite(self.audience.weight).all())
+        regions = self.Regions(1.7e9 + 1000.0)
+        self.assertEqual(len(regions), 1)
+        self.assertAlmostEqual(regions[0], 1.0)
+
+    def test_set_decay_keeps_the_weights(self):
+        self.Look(0.0, 1000.0)
+        self.audience.SetDecay(100.0, 1030.0)
+        # decayed to exp(-3) with the old decay by then, below the minimum
+        self.assertEqual(self.Regions(1030.0), [])
+        # and a new region is forgotten with the new decay
+        self.Look(0.0, 1030.0, 2.0)
+        self.assertEqual(len(self.Regions(1100.0)), 1)
+
+
+class SpeakerLocatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.faces = behavior.FaceTable(8)
+        self.faces.Update(Face(1, 10.0, 0.0))
+        self.faces.Update(Face(2, 10.0, 0.8))
+        self.speaker = behavior.SpeakerLocator(16, self.faces.capacity)
+
+    def test_locates_the_face_the_sound_comes_from(self):
+        for i in range(5):
+            self.speaker.Add(10.0 + 0.1 * i, 0.75, 0.9)
+        self.assertEqual(self.speaker.Locate(self.faces, 10.5), 2)
+
+    def test_sound_away_from_all_faces_matches_none(self):
+        for i in range(5):
+            self.speaker.Add(10.0 + 0.1 * i, -0.8, 0.9)
+        self.assertEqual(self.speaker.Locate(self.faces, 10.5), 0)
+        self.assertTrue(self.speaker.Active(10.5))
+
+    def test_a_stray_sample_does_not_switch_faces(self):
+        for i in range(5):
+            self.speaker.Add(10.0 + 0.1 * i, 0.0, 0.9)
+        self.speaker.Add(10.5, 0.8, 0.9)
+        self.assertEqual(self.speaker.Locate(self.faces, 10.5), 1)
+
+    def test_old_samples_are_ignored(self):
+        self.speaker.Add(10.0, 0.8, 0.9)
+        self.assertEqual(self.speaker.Locate(self.faces, 10.0 + 2.0 * self.speaker.window), 0)
+        self.assertFalse(self.speaker.Active(10.0 + 2.0 * self.speaker.window))
+
+
+class LookAtSpeakerTest(NodeTest):
+
+    def setUp(self):
+        NodeTest.setUp(self)
+        self.server.update_configuration({"lookat_state": behavior.LookAt.SPEAKER})
+        self.Tick()
+
+    def Hear(self, azimuth):
+        now = behavior_benchmark._clock.now
+        self.Deliver("cface", Face(1, now, 0.0))
+        self.Deliver("cface", Face(2, now, 0.8))
+        self.Deliver("audiodir", AudioDirection(ts=Time(now), direction=azimuth, confidence=0.9))
+        self.Tick()
+
+    def test_looks_at_the_speaking_face(self):
+        for i in range(5):
+            self.Hear(0.8)
+        self.assertEqual(self.node.current_face_id, 2)
+        self.assertAlmostEqual(math.atan2(self.node.gaze_pos[1], self.node.gaze_pos[0]), 0.8, delta=0.1)
+
+    def test_looks_at_a_speaker_without_face_while_others_are_visible(self):
+        for i in range(5):
+            self.Hear(-0.8)
+        self.assertEqual(self.node.speaker_face_id, 0)
+        self.assertAlmostEqual(math.atan2(self.node.gaze_pos[1], self.node.gaze_pos[0]), -0.8, delta=0.01)
+
+
+class TickRateTest(NodeTest):
+
+    def test_rate_follows_the_state(self):
+        self.assertEqual(self.node.tick_clock.rate, self.node.state_rates[behavior.State.IDLE])
+        self.server.update_configuration({"focused_rate": 8.0})
+        self.Tick()
+        self.node.SetState(behavior.State.FOCUSED)
+        self.assertEqual(self.node.tick_clock.rate, 8.0)
+        self.node.SetState(behavior.State.SLEEPING)
+        self.assertEqual(self.node.tick_clock.rate, self.node.state_rates[behavior.State.SLEEPING])
+
+    def test_perception_wakes_the_clock(self):
+        self.Deliver("cface", Face(1, behavior_benchmark._clock.now))
+        self.assertTrue(self.node.tick_clock.woken)
+        self.Tick()
+        self.server.update_configuration({"perception_wakeup": False})
+        self.Tick()
+        self.Deliver("cface", Face(1, behavior_benchmark._clock.now))
+        self.assertFalse(self.node.tick_clock.woken)
+
+
+class HostedRobotsTest(NodeTest):
+
+    # two robots in one process, like with ~robots
+
+    def setUp(self):
+        self.Prepare()
+        behavior_benchmark._registry.params["/behavior/seed"] = 7
+        self.loop = behavior.TickLoop()
+        cache = behavior.MakeAnimationCache(os.path.join(self.config_dir, 'snapshots'))
+        self.robots = [behavior.Behavior(name, self.loop, cache) for name in ["a", "b"]]
+        for robot in self.robots:
+            robot.animation_watcher.Check()
+            robot.tick_clock.Tick(behavior_benchmark._clock.now, behavior_benchmark._clock.now)
+
+    def test_robots_share_the_loop_and_the_animation_tables(self):
+        self.assertEqual(self.loop.clocks, [robot.tick_clock for robot in self.robots])
+        self.assertIsNotNone(self.robots[0].gesture_samplers)
+        self.assertIs(self.robots[0].gesture_samplers, self.robots[1].gesture_samplers)
+
+    def test_topics_are_per_robot(self):
+        for name in ["a", "b"]:
+            self.assertIn("/{}/blender_api/set_face_target".format(name), behavior_benchmark._registry.publishers)
+            self.assertIn(TOPICS["cface"].format(name), behavior_benchmark._registry.subscribers)
+
+    def test_random_streams_differ(self):
+        self.assertNotEqual([self.robots[0].rng.Random() for i in range(4)], [self.robots[1].rng.Random() for i in range(4)])
+
+    def test_diagnostics_are_per_robot(self):
+        names = []
+        for robot in self.robots:
+            robot.diagnostics_pub.publish = lambda msg: names.extend(status.name for status in msg.status)
+            robot.HandleDiagnostics()
+        self.assertEqual(len(names), 2)
+        self.assertNotEqual(names[0], names[1])
+
+
+def DefaultStates():
+    with open(os.path.join(behavior.CFG_DIR, 'r2_behavior_states.yaml')) as stream:
+        return yaml.safe_load(stream)
+
+
+class EnterActionTest(NodeTest):
+
+    # hand_decay on INTERESTED instead of FOCUSED
+
+    STATES = DefaultStates()
+    STATES["states"]["interested"]["enter"] = ["hand_decay"]
+    STATES["states"]["focused"]["enter"] = []
+    STATES["transitions"]["hand_lost"] = {"interested": "idle"}
+
+    def test_enter_actions_follow_the_table(self):
+        self.server.update_configuration({"state": behavior.State.FOCUSED})
+        self.Tick(self.node.hand_state_decay + 1.0)
+        self.Tick(self.node.hand_state_decay + 1.0)
+        self.assertEqual(self.node.state, behavior.State.FOCUSED)
+        self.server.update_configuration({"state": behavior.State.INTERESTED})
+        self.Tick()
+        self.Tick(self.node.hand_state_decay + 1.0)
+        self.assertEqual(self.node.state, behavior.State.IDLE)
+
+
+if __name__ == "__main__":
+    unittest.main()